@@ -0,0 +1,217 @@
+"""
+Maintenance commands.
+
+Usage:
+    python -m app.cli ledger rebuild
+    python -m app.cli ledger verify
+    python -m app.cli balances check-engines
+    python -m app.cli history checkpoint
+    python -m app.cli history verify
+    python -m app.cli history rebuild
+    python -m app.cli money migrate [--dry-run]
+    python -m app.cli people reconcile
+    python -m app.cli indexes ensure [--prune]
+    python -m app.cli indexes explain
+
+balances check-engines and the history commands work on every storage
+backend; the other commands maintain MongoDB collections and need
+STORAGE_BACKEND=mongo.
+"""
+from datetime import datetime
+import argparse
+import asyncio
+import logging
+import sys
+
+from app.db.database import init_db, close_db, db_manager
+from app.db.indexes import ensure_indexes, explain_queries
+from app.db.migrations import migrate_money_to_minor_units
+from app.db.repository import STORAGE_BACKEND, get_repository
+from app.services import history_service, ledger_service, people_service, settlement_service
+from app.services.cache_service import advance_data_version
+
+logger = logging.getLogger(__name__)
+
+async def ledger_rebuild(args) -> int:
+    """Recompute the balance ledger from the expenses collection"""
+    count = await ledger_service.rebuild_ledger()
+    if count is None:
+        print("Another process was rebuilding the ledger; it has finished")
+        return 0
+    # Running API processes drop balances computed from the old ledger
+    await advance_data_version()
+    print(f"Rebuilt ledger for {count} people")
+    return 0
+
+async def ledger_verify(args) -> int:
+    """Report any drift between the ledger and a full recomputation"""
+    drift = await ledger_service.verify_ledger()
+    if not drift:
+        print("Ledger is consistent with expenses")
+        return 0
+
+    for row in drift:
+        print(
+            f"{row['name']}: {row['field']} ledger={row['ledger']} "
+            f"expected={row['expected']} difference={row['difference']}"
+        )
+    print(f"Found {len(drift)} drifted values; run 'ledger rebuild' to repair")
+    return 1
+
+async def balances_check_engines(args) -> int:
+    """Check that every balance engine gives identical rounded results"""
+    mismatches = await settlement_service.compare_balance_engines(args.engines)
+    if not mismatches:
+        print(f"Balance engines agree: {', '.join(args.engines)}")
+        return 0
+
+    for row in mismatches:
+        print(
+            f"{row['name']}: {row['field']} {args.engines[0]}={row['expected']} "
+            f"{row['engine']}={row['actual']}"
+        )
+    print(f"Found {len(mismatches)} mismatched values")
+    return 1
+
+async def history_checkpoint(args) -> int:
+    """Store balance checkpoints up to the last closed period"""
+    totals = await history_service.totals_as_of(datetime.utcnow())
+    print(f"Balance history checkpointed per {history_service.CHECKPOINT_PERIOD}; {len(totals)} people now")
+    return 0
+
+async def history_verify(args) -> int:
+    """Check that replaying the expense journal gives the current totals"""
+    drift = await history_service.verify_history()
+    if not drift:
+        print("Expense journal replays to the current balances")
+        return 0
+
+    for row in drift:
+        print(f"{row['name']}: {row['field']} replayed={row['replayed']} ledger={row['ledger']}")
+    print(f"Found {len(drift)} differing values; run 'history rebuild' to restart the journal from the current expenses")
+    return 1
+
+async def history_rebuild(args) -> int:
+    """Drop the expense journal and checkpoints and journal the current expenses again"""
+    count = await history_service.rebuild_history()
+    await advance_data_version()
+    print(f"Journaled {count} expenses; earlier edits and deletes are no longer in the history")
+    return 0
+
+async def money_migrate(args) -> int:
+    """Convert float money fields to int64 minor units / Decimal128"""
+    count = await migrate_money_to_minor_units(args.batch_size, args.dry_run)
+    if args.dry_run:
+        print(f"{count} expenses still store money as floats")
+    else:
+        print(f"Converted {count} expenses")
+    return 0
+
+async def people_reconcile(args) -> int:
+    """Rebuild the people registry from the expenses collection"""
+    count = await people_service.reconcile_people()
+    if count is None:
+        print("Another process was reconciling the people registry; it has finished")
+        return 0
+    await advance_data_version()
+    print(f"Reconciled people registry with {count} people")
+    return 0
+
+async def indexes_ensure(args) -> int:
+    """Apply the index spec in app/db/indexes.py"""
+    for row in await ensure_indexes(db_manager.db, prune=args.prune):
+        print(f"{row['collection']}.{row['index']}: {row['action']}")
+    return 0
+
+async def indexes_explain(args) -> int:
+    """Explain every registered service query and fail on unexpected collection scans"""
+    results = await explain_queries(db_manager.db)
+    for row in results:
+        status = "ok" if row["ok"] else "FAIL"
+        detail = row.get("error") or " > ".join(row["stages"])
+        print(f"[{status}] {row['name']} ({row['collection']}): {detail}")
+
+    failures = [row for row in results if not row["ok"]]
+    if failures:
+        print(f"{len(failures)} queries scan a collection instead of using an index")
+        return 1
+    print(f"All {len(results)} queries use an index where expected")
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Expense Splitter maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ledger = commands.add_parser("ledger", help="Balance ledger maintenance")
+    ledger_commands = ledger.add_subparsers(dest="action", required=True)
+    ledger_commands.add_parser("rebuild", help="Recompute the ledger from scratch").set_defaults(handler=ledger_rebuild)
+    ledger_commands.add_parser("verify", help="Check the ledger for drift").set_defaults(handler=ledger_verify)
+
+    balances = commands.add_parser("balances", help="Balance engine checks")
+    balances_commands = balances.add_subparsers(dest="action", required=True)
+    check_engines = balances_commands.add_parser("check-engines", help="Compare balance engines on the current data")
+    check_engines.add_argument(
+        "--engines", nargs="+", default=list(settlement_service.BALANCE_ENGINES),
+        choices=settlement_service.BALANCE_ENGINES, help="Engines to compare; the first is the reference"
+    )
+    check_engines.set_defaults(handler=balances_check_engines, any_backend=True)
+
+    history = commands.add_parser("history", help="Expense journal and balance checkpoints for as-of balances")
+    history_commands = history.add_subparsers(dest="action", required=True)
+    history_commands.add_parser(
+        "checkpoint", help="Store balance checkpoints for every closed period"
+    ).set_defaults(handler=history_checkpoint, any_backend=True)
+    history_commands.add_parser(
+        "verify", help="Check that the journal replays to the current balances"
+    ).set_defaults(handler=history_verify, any_backend=True)
+    history_commands.add_parser(
+        "rebuild", help="Restart the journal from the current expenses"
+    ).set_defaults(handler=history_rebuild, any_backend=True)
+
+    money = commands.add_parser("money", help="Money storage format")
+    money_commands = money.add_subparsers(dest="action", required=True)
+    migrate = money_commands.add_parser("migrate", help="Convert float amounts to integer minor units")
+    migrate.add_argument("--batch-size", type=int, default=1000)
+    migrate.add_argument("--dry-run", action="store_true", help="Only count the expenses that need converting")
+    migrate.set_defaults(handler=money_migrate)
+
+    people = commands.add_parser("people", help="People registry maintenance")
+    people_commands = people.add_subparsers(dest="action", required=True)
+    people_commands.add_parser("reconcile", help="Rebuild the registry from expenses").set_defaults(handler=people_reconcile)
+
+    indexes = commands.add_parser("indexes", help="Index management")
+    indexes_commands = indexes.add_subparsers(dest="action", required=True)
+    ensure = indexes_commands.add_parser("ensure", help="Create, rebuild and retire indexes to match the spec")
+    ensure.add_argument("--prune", action="store_true", help="Also drop indexes that are not in the spec")
+    ensure.set_defaults(handler=indexes_ensure)
+    indexes_commands.add_parser(
+        "explain", help="Fail if a service query falls back to a collection scan"
+    ).set_defaults(handler=indexes_explain)
+
+    return parser
+
+async def run(args) -> int:
+    if getattr(args, "any_backend", False):
+        repository = get_repository()
+        await repository.connect()
+        try:
+            return await args.handler(args)
+        finally:
+            await repository.close()
+
+    if STORAGE_BACKEND != "mongo":
+        print(f"'{args.command} {args.action}' maintains MongoDB collections, but STORAGE_BACKEND is {STORAGE_BACKEND}")
+        return 2
+    await init_db()
+    try:
+        return await args.handler(args)
+    finally:
+        await close_db()
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    args = build_parser().parse_args(argv)
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+In-memory backend for tests and demos: expenses in a dict, per-person totals
+and participation counts kept current on every write. Nothing is persisted
+and every process has its own data.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+import os
+
+from bson.objectid import ObjectId
+
+from app.db.repository import DataVersion, ExpenseChange, ExpenseRepository
+from app.services.ledger_service import Totals, _diff_totals, _empty_totals, expense_totals
+from app.services.people_service import _diff_counts
+
+def _copy(document: dict) -> dict:
+    """Copy of a document, so callers can never change what is stored"""
+    copied = dict(document)
+    if "participants" in copied:
+        copied["participants"] = list(copied["participants"])
+    if copied.get("custom_split") is not None:
+        copied["custom_split"] = dict(copied["custom_split"])
+    return copied
+
+class MemoryExpenseRepository(ExpenseRepository):
+    """Expenses, totals and people held in process memory"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.expenses: Dict[str, dict] = {}
+        # _ids in order, for pagination and ordered export
+        self.ids: List[str] = []
+        self.totals: Totals = {}
+        self.people = Counter()
+        # _ids of the expenses each person is involved in
+        self.by_person: Dict[str, Set[str]] = {}
+        # Journal events and checkpoints, each with a parallel sorted list of times
+        self.events: List[dict] = []
+        self.event_times: List[datetime] = []
+        self.checkpoints: List[dict] = []
+        self.checkpoint_times: List[datetime] = []
+        # (expense_id, version, kind) of every versioned event
+        self.event_keys: Set[tuple] = set()
+        self.data_version: DataVersion = (os.urandom(4).hex(), 0)
+        self.markers: Dict[str, dict] = {}
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "expenses": len(self.expenses), "people": len(self.totals)}
+
+    async def list_expenses(self, after: Optional[str], skip: int, limit: int) -> List[dict]:
+        start = bisect_right(self.ids, after) if after else skip
+        return [_copy(self.expenses[expense_id]) for expense_id in self.ids[start:start + limit]]
+
+    async def get_expense(self, expense_id: str) -> Optional[dict]:
+        document = self.expenses.get(expense_id)
+        return _copy(document) if document else None
+
+    async def expense_exists(self, expense_id: str) -> bool:
+        return expense_id in self.expenses
+
+    def _store(self, document: dict) -> dict:
+        stored = _copy(document)
+        stored["_id"] = str(ObjectId())
+        self.expenses[stored["_id"]] = stored
+        insort(self.ids, stored["_id"])
+        return _copy(stored)
+
+    async def insert_expense(self, document: dict) -> dict:
+        return self._store(document)
+
+    async def insert_expenses(self, documents: List[dict]) -> Tuple[List[dict], List[Tuple[int, str]]]:
+        return [self._store(document) for document in documents], []
+
+    async def update_expense(self, expense_id: str, fields: dict, expected_version: Optional[int]) -> Optional[dict]:
+        current = self.expenses.get(expense_id)
+        if current is None:
+            return None
+        if expected_version is not None and current.get("version", 0) != expected_version:
+            return None
+
+        previous = _copy(current)
+        self.expenses[expense_id] = _copy({**current, **fields, "version": current.get("version", 0) + 1})
+        return previous
+
+    async def delete_expense(self, expense_id: str) -> Optional[dict]:
+        document = self.expenses.pop(expense_id, None)
+        if document is None:
+            return None
+        del self.ids[bisect_right(self.ids, expense_id) - 1]
+        return document
+
+    async def record_changes(self, changes: Iterable[ExpenseChange]):
+        changes = list(changes)
+        for person, values in _diff_totals(changes).items():
+            current = self.totals.setdefault(person, _empty_totals())
+            for field, value in values.items():
+                current[field] += value
+        self.people.update(_diff_counts(changes))
+        for before, after in changes:
+            if before:
+                for person in expense_totals(before):
+                    self.by_person.get(person, set()).discard(before["_id"])
+            if after:
+                for person in expense_totals(after):
+                    self.by_person.setdefault(person, set()).add(after["_id"])
+
+    async def iter_expenses(self, batch_size: int = 1000, read_only: bool = False) -> AsyncIterator[dict]:
+        # Resume after the last _id seen rather than at an offset, so
+        # expenses deleted meanwhile do not shift the ones not yet reached
+        start = 0
+        while True:
+            batch = self.ids[start:start + batch_size]
+            for expense_id in batch:
+                document = self.expenses.get(expense_id)
+                if document is not None:
+                    yield _copy(document)
+            if len(batch) < batch_size:
+                return
+            start = bisect_right(self.ids, batch[-1])
+
+    async def scan_expenses(self, fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        # Readers only look at the documents, so no copies are needed
+        for document in list(self.expenses.values()):
+            yield document
+
+    async def person_expenses(self, name: str) -> AsyncIterator[dict]:
+        for expense_id in list(self.by_person.get(name, ())):
+            document = self.expenses.get(expense_id)
+            if document is not None:
+                yield document
+
+    async def count_expenses(self) -> int:
+        return len(self.expenses)
+
+    async def ledger_totals(self) -> Totals:
+        return {
+            person: dict(values) for person, values in self.totals.items()
+            if values["expense_count"] > 0
+        }
+
+    async def list_people(self) -> List[dict]:
+        return [
+            {"name": name, "count": count}
+            for name, count in sorted(self.people.items()) if count > 0
+        ]
+
+    async def read_data_version(self) -> DataVersion:
+        return self.data_version
+
+    async def advance_data_version(self) -> DataVersion:
+        epoch, version = self.data_version
+        self.data_version = (epoch, version + 1)
+        return self.data_version
+
+    async def read_marker(self, name: str) -> Optional[dict]:
+        marker = self.markers.get(name)
+        return dict(marker) if marker else None
+
+    async def claim_marker(self, name: str, owner: str, stale_before: datetime) -> bool:
+        marker = self.markers.get(name)
+        if marker and (marker["state"] == "done" or (marker["owner"] != owner and marker["at"] >= stale_before)):
+            return False
+        self.markers[name] = {"state": "running", "owner": owner, "at": datetime.utcnow()}
+        return True
+
+    async def complete_marker(self, name: str, owner: str) -> bool:
+        marker = self.markers.get(name)
+        if not marker or marker["owner"] != owner:
+            return False
+        marker.update(state="done", at=datetime.utcnow())
+        return True
+
+    async def delete_marker(self, name: str):
+        self.markers.pop(name, None)
+
+    async def append_events(self, events: List[dict]):
+        for event in events:
+            if event.get("version") is not None:
+                key = (event["expense_id"], event["version"], event["kind"])
+                if key in self.event_keys:
+                    continue
+                self.event_keys.add(key)
+            # Events nearly always arrive in order, so this is an append
+            position = bisect_right(self.event_times, event["at"])
+            self.event_times.insert(position, event["at"])
+            self.events.insert(position, event)
+
+    async def iter_events(self, since: Optional[datetime], until: datetime) -> AsyncIterator[dict]:
+        start = bisect_left(self.event_times, since) if since else 0
+        end = bisect_right(self.event_times, until)
+        for event in self.events[start:end]:
+            yield event
+
+    async def count_events(self) -> int:
+        return len(self.events)
+
+    async def latest_checkpoint(self, at: datetime) -> Optional[dict]:
+        position = bisect_right(self.checkpoint_times, at)
+        return self.checkpoints[position - 1] if position else None
+
+    async def save_checkpoint(self, checkpoint: dict):
+        position = bisect_left(self.checkpoint_times, checkpoint["at"])
+        if position < len(self.checkpoints) and self.checkpoint_times[position] == checkpoint["at"]:
+            self.checkpoints[position] = checkpoint
+            return
+        self.checkpoint_times.insert(position, checkpoint["at"])
+        self.checkpoints.insert(position, checkpoint)
+
+    async def clear_history(self):
+        self.events, self.event_times = [], []
+        self.event_keys = set()
+        self.checkpoints, self.checkpoint_times = [], []
@@ -0,0 +1,414 @@
+"""
+MongoDB backend: expenses in the expenses collection, per-person totals in
+the incrementally maintained ledger collection and participation counts in
+the people registry.
+
+Only expense pages and the expense export go to the configured read
+preference. Balances, settlements, people and per-person
+results are cached under the data version, which is read from the primary,
+so the reads that compute them use the primary too. A lagging secondary
+would otherwise put old totals in the cache under the new version.
+"""
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+import os
+
+from bson.int64 import Int64
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.db.codec import MINOR_PER_UNIT, to_decimal
+from app.db.database import (
+    db_manager, get_checkpoints_collection, get_events_collection, get_expense_collection, get_people_collection,
+    get_state_collection
+)
+from app.db.repository import DataVersion, ExpenseChange, ExpenseRepository
+from app.services.expense_state import expense_state, EXPENSE_STATE_ENABLED
+from app.services.ledger_service import Totals, apply_expense_changes, ensure_ledger, get_ledger_totals
+from app.services.people_service import apply_people_changes, ensure_people
+from app.services.rebuild_gate import wait_for_rebuilds
+
+# Documents per cursor batch when scanning every expense
+SCAN_BATCH_SIZE = 5000
+
+# Amount of an expense in minor units as Decimal128; legacy float amounts are
+# rounded half to even exactly like codec.to_minor
+_AMOUNT_MINOR = {"$cond": [
+    {"$eq": [{"$type": "$amount"}, "double"]},
+    {"$round": [{"$multiply": [{"$toDecimal": "$amount"}, MINOR_PER_UNIT]}, 0]},
+    {"$toDecimal": "$amount"}
+]}
+
+# Share rows of one expense. Equal split: floor(amount / n) each, the first
+# (amount mod n) participants get one more minor unit
+_EQUAL_ROWS = {"$let": {
+    "vars": {"n": {"$size": {"$ifNull": ["$participants", []]}}},
+    "in": {"$cond": [{"$eq": ["$$n", 0]}, [], {"$let": {
+        "vars": {"base": {"$floor": {"$divide": ["$amount", "$$n"]}}},
+        "in": {"$let": {
+            "vars": {"extra": {"$subtract": ["$amount", {"$multiply": ["$$base", "$$n"]}]}},
+            "in": {"$map": {
+                "input": {"$range": [0, "$$n"]},
+                "as": "index",
+                "in": {
+                    "name": {"$arrayElemAt": ["$participants", "$$index"]},
+                    "total_share": {"$add": ["$$base", {"$cond": [{"$lt": ["$$index", "$$extra"]}, 1, 0]}]}
+                }
+            }}
+        }}
+    }}]}
+}}
+
+# Percentage split: floor(amount * pct / 100) each, the residue spread over
+# custom_split entries in stored order
+_PERCENTAGE_ROWS = {"$let": {
+    "vars": {"split": {"$map": {
+        "input": {"$objectToArray": {"$ifNull": ["$custom_split", {}]}},
+        "in": {
+            "k": "$$this.k",
+            "v": {"$floor": {"$divide": [{"$multiply": ["$amount", {"$toDecimal": "$$this.v"}]}, 100]}}
+        }
+    }}},
+    "in": {"$let": {
+        "vars": {"n": {"$size": "$$split"}, "residue": {"$subtract": ["$amount", {"$sum": "$$split.v"}]}},
+        "in": {"$cond": [{"$eq": ["$$n", 0]}, [], {"$let": {
+            "vars": {"base": {"$floor": {"$divide": ["$$residue", "$$n"]}}},
+            "in": {"$let": {
+                "vars": {"extra": {"$subtract": ["$$residue", {"$multiply": ["$$base", "$$n"]}]}},
+                "in": {"$map": {
+                    "input": {"$range": [0, "$$n"]},
+                    "as": "index",
+                    "in": {
+                        "name": {"$arrayElemAt": ["$$split.k", "$$index"]},
+                        "total_share": {"$add": [
+                            {"$arrayElemAt": ["$$split.v", "$$index"]},
+                            "$$base",
+                            {"$cond": [{"$lt": ["$$index", "$$extra"]}, 1, 0]}
+                        ]}
+                    }
+                }}
+            }}
+        }}]}
+    }}
+}}
+
+# Exact split: each value rounded half to even to minor units
+_EXACT_ROWS = {"$map": {
+    "input": {"$objectToArray": {"$ifNull": ["$custom_split", {}]}},
+    "in": {
+        "name": "$$this.k",
+        "total_share": {"$round": [{"$multiply": [{"$toDecimal": "$$this.v"}, MINOR_PER_UNIT]}, 0]}
+    }
+}}
+
+# Per-person paid/share sums for all three split types, computed server-side
+# in minor units with the same flooring and residue rules as
+# codec.split_shares_minor, so the result matches the Python engines exactly.
+# Each expense is turned into its rows (what was paid, each share, one count
+# per person involved) and a single $group adds them up per person, so the
+# result streams through the cursor one person per document.
+BALANCE_PIPELINE = [
+    {"$project": {
+        "paid_by": 1,
+        "participants": 1,
+        "split_type": 1,
+        "custom_split": 1,
+        "amount": _AMOUNT_MINOR
+    }},
+    {"$project": {"rows": {"$concatArrays": [
+        [{"name": "$paid_by", "total_paid": "$amount"}],
+        {"$switch": {
+            "branches": [
+                {"case": {"$eq": ["$split_type", "equal"]}, "then": _EQUAL_ROWS},
+                {"case": {"$eq": ["$split_type", "percentage"]}, "then": _PERCENTAGE_ROWS},
+                {"case": {"$eq": ["$split_type", "exact"]}, "then": _EXACT_ROWS}
+            ],
+            "default": []
+        }},
+        # Number of expenses each person is involved in (as payer or participant)
+        {"$map": {
+            "input": {"$setUnion": [["$paid_by"], "$participants"]},
+            "in": {"name": "$$this", "expense_count": 1}
+        }}
+    ]}}},
+    {"$unwind": "$rows"},
+    {"$group": {
+        "_id": "$rows.name",
+        "total_paid": {"$sum": "$rows.total_paid"},
+        "total_share": {"$sum": "$rows.total_share"},
+        "expense_count": {"$sum": "$rows.expense_count"}
+    }}
+]
+
+def _version_filter(version: int):
+    """Match a document version; documents written before versioning count as version 0"""
+    if version == 0:
+        return {"$in": [0, None]}
+    return version
+
+def _with_str_id(document: dict) -> dict:
+    document["_id"] = str(document["_id"])
+    return document
+
+def _totals_rows(totals: Totals) -> List[dict]:
+    """Per-person totals as an array, since names are not safe as field names"""
+    return [
+        {"name": person, **{field: Int64(value) for field, value in values.items()}}
+        for person, values in totals.items()
+    ]
+
+def _rows_totals(rows: List[dict]) -> Totals:
+    return {
+        row["name"]: {field: int(row[field]) for field in ("total_paid", "total_share", "expense_count")}
+        for row in rows
+    }
+
+class MongoExpenseRepository(ExpenseRepository):
+    """Expenses, ledger and people registry in MongoDB"""
+
+    name = "mongo"
+
+    async def connect(self):
+        await db_manager.connect()
+        await ensure_ledger()
+        await ensure_people()
+        if EXPENSE_STATE_ENABLED:
+            await expense_state.start()
+
+    async def close(self):
+        await expense_state.stop()
+        await db_manager.close()
+
+    def stats(self) -> dict:
+        return {"backend": self.name, **db_manager.stats()}
+
+    async def list_expenses(self, after: Optional[str], skip: int, limit: int) -> List[dict]:
+        expense_collection = await get_expense_collection(read_only=True)
+
+        query = {}
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+
+        find = expense_collection.find(query).sort("_id", 1)
+        if skip:
+            find = find.skip(skip)
+        return [_with_str_id(document) async for document in find.limit(limit)]
+
+    async def get_expense(self, expense_id: str) -> Optional[dict]:
+        expense_collection = await get_expense_collection()
+        document = await expense_collection.find_one({"_id": ObjectId(expense_id)})
+        return _with_str_id(document) if document else None
+
+    async def expense_exists(self, expense_id: str) -> bool:
+        expense_collection = await get_expense_collection()
+        return bool(await expense_collection.count_documents({"_id": ObjectId(expense_id)}, limit=1))
+
+    async def insert_expense(self, document: dict) -> dict:
+        await wait_for_rebuilds()
+        expense_collection = await get_expense_collection()
+        # The stored document is exactly what was sent, so there is no need to read it back
+        result = await expense_collection.insert_one(document)
+        return {**document, "_id": str(result.inserted_id)}
+
+    async def insert_expenses(self, documents: List[dict]) -> Tuple[List[dict], List[Tuple[int, str]]]:
+        await wait_for_rebuilds()
+        expense_collection = await get_expense_collection()
+
+        errors = []
+        try:
+            await expense_collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                errors.append((write_error["index"], write_error.get("errmsg", "Insert failed")))
+
+        # insert_many sets _id on each document it was given
+        failed = {position for position, _ in errors}
+        inserted = [
+            {**document, "_id": str(document["_id"])}
+            for position, document in enumerate(documents) if position not in failed
+        ]
+        return inserted, errors
+
+    async def update_expense(self, expense_id: str, fields: dict, expected_version: Optional[int]) -> Optional[dict]:
+        await wait_for_rebuilds()
+        expense_collection = await get_expense_collection()
+
+        query = {"_id": ObjectId(expense_id)}
+        if expected_version is not None:
+            query["version"] = _version_filter(expected_version)
+
+        # The pre-image is returned so the ledger can take the old version off
+        previous = await expense_collection.find_one_and_update(
+            query,
+            {"$set": fields, "$inc": {"version": 1}},
+            return_document=ReturnDocument.BEFORE
+        )
+        return _with_str_id(previous) if previous else None
+
+    async def delete_expense(self, expense_id: str) -> Optional[dict]:
+        await wait_for_rebuilds()
+        expense_collection = await get_expense_collection()
+        # find_one_and_delete hands back the removed document so its
+        # contribution can be taken off the ledger and registry
+        deleted = await expense_collection.find_one_and_delete({"_id": ObjectId(expense_id)})
+        return _with_str_id(deleted) if deleted else None
+
+    async def record_changes(self, changes: Iterable[ExpenseChange]):
+        changes = list(changes)
+        await apply_expense_changes(changes)
+        await apply_people_changes(changes)
+
+    async def iter_expenses(self, batch_size: int = 1000, read_only: bool = False) -> AsyncIterator[dict]:
+        expense_collection = await get_expense_collection(read_only)
+        async for document in expense_collection.find().sort("_id", 1).batch_size(batch_size):
+            yield _with_str_id(document)
+
+    async def scan_expenses(self, fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        # The change-stream fed copy in memory saves a collection scan when it is warm
+        if expense_state.warm:
+            for document in list(expense_state.values()):
+                yield document
+            return
+
+        expense_collection = await get_expense_collection()
+        projection = {field: 1 for field in fields} if fields else None
+        async for document in expense_collection.find({}, projection).batch_size(SCAN_BATCH_SIZE):
+            yield document
+
+    async def person_expenses(self, name: str) -> AsyncIterator[dict]:
+        # Each branch of the $or is answered by its own index (paid_by_1__id_1
+        # and the multikey participants_1__id_1) and the results are merged
+        expense_collection = await get_expense_collection()
+        query = {"$or": [{"paid_by": name}, {"participants": name}]}
+        async for document in expense_collection.find(query).batch_size(SCAN_BATCH_SIZE):
+            yield _with_str_id(document)
+
+    async def count_expenses(self) -> int:
+        # From memory when the state is warm, otherwise from collection metadata
+        if expense_state.warm:
+            return len(expense_state.expenses)
+        expense_collection = await get_expense_collection()
+        return await expense_collection.estimated_document_count()
+
+    async def ledger_totals(self) -> Totals:
+        return await get_ledger_totals()
+
+    async def aggregate_totals(self) -> Totals:
+        """Compute per-person totals with BALANCE_PIPELINE; only one row per person is returned"""
+        expense_collection = await get_expense_collection()
+
+        totals = {}
+        async for row in expense_collection.aggregate(BALANCE_PIPELINE, allowDiskUse=True):
+            totals[row["_id"]] = {
+                "total_paid": int(to_decimal(row["total_paid"])),
+                "total_share": int(to_decimal(row["total_share"])),
+                "expense_count": int(row["expense_count"])
+            }
+        return totals
+
+    async def list_people(self) -> List[dict]:
+        people_collection = await get_people_collection()
+
+        people = []
+        async for person in people_collection.find(
+            {"count": {"$gt": 0}}, {"_id": 0, "name": 1, "count": 1}
+        ).sort("name", 1):
+            people.append(person)
+        return people
+
+    async def read_data_version(self) -> DataVersion:
+        state_collection = await get_state_collection()
+        document = await state_collection.find_one({"_id": "data_version"})
+        return (document["epoch"], document["version"]) if document else ("", 0)
+
+    async def advance_data_version(self) -> DataVersion:
+        state_collection = await get_state_collection()
+        document = await state_collection.find_one_and_update(
+            {"_id": "data_version"},
+            {"$inc": {"version": 1}, "$setOnInsert": {"epoch": os.urandom(4).hex()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return document["epoch"], document["version"]
+
+    async def read_marker(self, name: str) -> Optional[dict]:
+        state_collection = await get_state_collection()
+        return await state_collection.find_one({"_id": name}, {"_id": 0, "state": 1, "owner": 1, "at": 1})
+
+    async def claim_marker(self, name: str, owner: str, stale_before: datetime) -> bool:
+        state_collection = await get_state_collection()
+        # When the marker exists but does not match, the upsert collides with
+        # it on _id, so the claim fails with a duplicate key
+        try:
+            await state_collection.update_one(
+                {"_id": name, "state": {"$ne": "done"}, "$or": [{"owner": owner}, {"at": {"$lt": stale_before}}]},
+                {"$set": {"state": "running", "owner": owner, "at": datetime.utcnow()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def complete_marker(self, name: str, owner: str) -> bool:
+        state_collection = await get_state_collection()
+        result = await state_collection.update_one(
+            {"_id": name, "owner": owner}, {"$set": {"state": "done", "at": datetime.utcnow()}}
+        )
+        return result.matched_count == 1
+
+    async def delete_marker(self, name: str):
+        state_collection = await get_state_collection()
+        await state_collection.delete_one({"_id": name})
+
+    async def append_events(self, events: List[dict]):
+        events_collection = await get_events_collection()
+        documents = []
+        for event in events:
+            document = {
+                "at": event["at"],
+                "expense_id": event["expense_id"],
+                "kind": event["kind"],
+                "delta": _totals_rows(event["delta"])
+            }
+            if event.get("version") is not None:
+                document["version"] = event["version"]
+            documents.append(document)
+
+        # Events already journaled collide on the unique change index and are skipped
+        try:
+            await events_collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def iter_events(self, since: Optional[datetime], until: datetime) -> AsyncIterator[dict]:
+        events_collection = await get_events_collection()
+        query = {"at": {"$lte": until}}
+        if since:
+            query["at"]["$gte"] = since
+        async for event in events_collection.find(query, {"_id": 0}).sort("at", 1).batch_size(SCAN_BATCH_SIZE):
+            event["delta"] = _rows_totals(event["delta"])
+            event.setdefault("version", None)
+            yield event
+
+    async def count_events(self) -> int:
+        events_collection = await get_events_collection()
+        return await events_collection.estimated_document_count()
+
+    async def latest_checkpoint(self, at: datetime) -> Optional[dict]:
+        checkpoints_collection = await get_checkpoints_collection()
+        async for checkpoint in checkpoints_collection.find({"_id": {"$lte": at}}).sort("_id", -1).limit(1):
+            return {"at": checkpoint["_id"], "totals": _rows_totals(checkpoint["totals"])}
+        return None
+
+    async def save_checkpoint(self, checkpoint: dict):
+        checkpoints_collection = await get_checkpoints_collection()
+        await checkpoints_collection.replace_one(
+            {"_id": checkpoint["at"]}, {"totals": _totals_rows(checkpoint["totals"])}, upsert=True
+        )
+
+    async def clear_history(self):
+        for get_collection in (get_events_collection, get_checkpoints_collection):
+            collection = await get_collection()
+            await collection.delete_many({})
@@ -0,0 +1,560 @@
+"""
+Embedded SQLite backend for single-node deployments.
+
+The database file runs in WAL mode, so readers never wait for the writer.
+sqlite3 calls block, so they run on threads: one writer thread owns the only
+write connection (SQLite allows a single writer anyway) and a small pool of
+reader threads each keep their own read-only connection.
+
+Besides the expenses table, every expense has one row per person in the
+shares table holding what that person paid and owes for it, written in the
+same transaction as the expense. Balances and the people list are a
+GROUP BY over a covering index on shares, so there is no separate ledger to
+keep in step. The expense journal and balance checkpoints for as-of balances
+live in the expense_events and balance_checkpoints tables, the shared data
+version in app_state and job markers in markers.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from bson.objectid import ObjectId
+
+from app.db.codec import stored_amount_minor, to_decimal
+from app.db.repository import DataVersion, ExpenseChange, ExpenseRepository
+from app.services.ledger_service import Totals, expense_totals
+
+logger = logging.getLogger(__name__)
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "expenses.sqlite3")
+# Threads (and connections) serving reads; the writer always has one
+SQLITE_READ_THREADS = int(os.getenv("SQLITE_READ_THREADS", 4))
+# How long a connection waits for a lock before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+# NORMAL is durable across application crashes in WAL mode; FULL also survives power loss
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+# Page cache per connection, in KiB
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 16384))
+
+# Rows fetched per query when walking every expense
+SCAN_BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    id TEXT PRIMARY KEY,
+    amount INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    paid_by TEXT NOT NULL,
+    split_type TEXT NOT NULL,
+    participants TEXT NOT NULL,
+    custom_split TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    created_at TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS shares (
+    expense_id TEXT NOT NULL REFERENCES expenses (id) ON DELETE CASCADE,
+    person TEXT NOT NULL,
+    paid INTEGER NOT NULL,
+    share INTEGER NOT NULL,
+    participations INTEGER NOT NULL,
+    PRIMARY KEY (expense_id, person)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS shares_by_person ON shares (person, paid, share, participations);
+
+CREATE TABLE IF NOT EXISTS expense_events (
+    at TEXT NOT NULL,
+    expense_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    delta TEXT NOT NULL,
+    version INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS expense_events_by_at ON expense_events (at);
+
+CREATE TABLE IF NOT EXISTS balance_checkpoints (
+    at TEXT PRIMARY KEY,
+    totals TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS app_state (
+    name TEXT PRIMARY KEY,
+    epoch TEXT NOT NULL,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS markers (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    at TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Columns added after the first release, with their definitions, for files
+# created by an earlier version
+ADDED_COLUMNS = {"expenses": [("created_at", "TEXT")], "expense_events": [("version", "INTEGER")]}
+
+# Indexes on added columns, created once the columns exist. Events without a
+# version (journaled before it was recorded) never conflict: NULLs are distinct
+SCHEMA_AFTER_COLUMNS = """
+CREATE UNIQUE INDEX IF NOT EXISTS expense_events_by_change ON expense_events (expense_id, version, kind);
+"""
+
+_EXPENSE_COLUMNS = "id, amount, description, paid_by, split_type, participants, custom_split, version, updated_at, created_at"
+_INSERT_EXPENSE = f"INSERT INTO expenses ({_EXPENSE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+_UPDATE_EXPENSE = (
+    "UPDATE expenses SET amount = ?, description = ?, paid_by = ?, split_type = ?, "
+    "participants = ?, custom_split = ?, version = ?, updated_at = ?, created_at = ? WHERE id = ?"
+)
+_INSERT_SHARE = "INSERT INTO shares (expense_id, person, paid, share, participations) VALUES (?, ?, ?, ?, ?)"
+
+_TOTALS_QUERY = (
+    "SELECT person, SUM(paid), SUM(share), COUNT(*) FROM shares GROUP BY person"
+)
+_PEOPLE_QUERY = (
+    "SELECT person, SUM(participations) AS count FROM shares "
+    "GROUP BY person HAVING count > 0 ORDER BY person"
+)
+
+_PERSON_EXPENSES_QUERY = (
+    "SELECT " + ", ".join("e." + column for column in _EXPENSE_COLUMNS.split(", ")) + " "
+    "FROM shares s JOIN expenses e ON e.id = s.expense_id WHERE s.person = ?"
+)
+
+_DATA_VERSION_QUERY = "SELECT epoch, version FROM app_state WHERE name = 'data_version'"
+
+_INSERT_EVENT = (
+    "INSERT INTO expense_events (at, expense_id, kind, version, delta) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT DO NOTHING"
+)
+
+_MARKER_QUERY = "SELECT state, owner, at FROM markers WHERE name = ?"
+
+def _timestamp(value: datetime) -> str:
+    """Fixed-width ISO 8601, so times compare correctly as text"""
+    return value.isoformat(timespec="microseconds")
+
+def _to_row(expense_id: str, document: dict) -> tuple:
+    """Column values for a stored-format expense document"""
+    return (
+        expense_id,
+        stored_amount_minor(document),
+        document["description"],
+        document["paid_by"],
+        document["split_type"],
+        json.dumps(document["participants"]),
+        json.dumps({person: str(to_decimal(value)) for person, value in (document.get("custom_split") or {}).items()}),
+        document.get("version", 1),
+        document["updated_at"].isoformat(),
+        _timestamp(document["created_at"]) if document.get("created_at") else None
+    )
+
+def _from_row(row: tuple) -> dict:
+    """Stored-format expense document for a row of the expenses table"""
+    return {
+        "_id": row[0],
+        "amount": row[1],
+        "description": row[2],
+        "paid_by": row[3],
+        "split_type": row[4],
+        "participants": json.loads(row[5]),
+        "custom_split": {person: Decimal(value) for person, value in json.loads(row[6]).items()},
+        "version": row[7],
+        "updated_at": datetime.fromisoformat(row[8]),
+        "created_at": datetime.fromisoformat(row[9]) if row[9] else None
+    }
+
+def _share_rows(expense_id: str, document: dict) -> List[tuple]:
+    """One shares row per person the expense involves"""
+    participations = Counter(document["participants"])
+    return [
+        (expense_id, person, values["total_paid"], values["total_share"], participations.get(person, 0))
+        for person, values in expense_totals(document).items()
+    ]
+
+@contextmanager
+def _transaction(connection: sqlite3.Connection):
+    """BEGIN IMMEDIATE takes the write lock up front, so the transaction cannot fail half way on a lock upgrade"""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+def _insert_rows(connection: sqlite3.Connection, document: dict):
+    """Insert an expense and its share rows"""
+    connection.execute(_INSERT_EXPENSE, _to_row(document["_id"], document))
+    connection.executemany(_INSERT_SHARE, _share_rows(document["_id"], document))
+
+def _insert_error(error: Exception) -> str:
+    if isinstance(error, KeyError):
+        return f"Missing field {error}"
+    return str(error) or type(error).__name__
+
+class SQLiteExpenseRepository(ExpenseRepository):
+    """Expenses and per-person share rows in one SQLite file"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH, read_threads: int = SQLITE_READ_THREADS):
+        self.path = path
+        self.read_threads = read_threads
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._readers: Optional[ThreadPoolExecutor] = None
+        self.journal_mode: Optional[str] = None
+        self._connect_lock = asyncio.Lock()
+
+    def _connection(self, read_only: bool) -> sqlite3.Connection:
+        """This thread's connection, opened on first use"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode; transactions are opened explicitly with _transaction
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+            connection.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+            connection.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+            connection.execute("PRAGMA foreign_keys = ON")
+            if read_only:
+                connection.execute("PRAGMA query_only = ON")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    async def _run(self, executor: ThreadPoolExecutor, read_only: bool, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, lambda: function(self._connection(read_only), *args)
+        )
+
+    async def _read(self, function, *args):
+        """Run function(connection, *args) on a reader thread"""
+        if self._readers is None:
+            await self.connect()
+        return await self._run(self._readers, True, function, *args)
+
+    async def _write(self, function, *args):
+        """Run function(connection, *args) on the writer thread"""
+        if self._writer is None:
+            await self.connect()
+        return await self._run(self._writer, False, function, *args)
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+
+            def prepare(connection):
+                # WAL is a property of the file and sticks once set
+                mode = connection.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+                connection.executescript(SCHEMA)
+                for table, columns in ADDED_COLUMNS.items():
+                    existing = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+                    for column, definition in columns:
+                        if column not in existing:
+                            connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                connection.executescript(SCHEMA_AFTER_COLUMNS)
+                return mode
+
+            self.journal_mode = await self._run(writer, False, prepare)
+            self._readers = ThreadPoolExecutor(max_workers=self.read_threads, thread_name_prefix="sqlite-reader")
+            self._writer = writer
+        if self.journal_mode != "wal":
+            logger.warning(f"SQLite database {self.path} is not in WAL mode ({self.journal_mode}); readers will block writers")
+        logger.info(f"Opened SQLite database {self.path} (journal: {self.journal_mode}, readers: {self.read_threads})")
+
+    async def close(self):
+        if self._writer is None:
+            return
+        for executor in (self._writer, self._readers):
+            executor.shutdown(wait=True)
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+        self._writer = self._readers = None
+        logger.info(f"Closed SQLite database {self.path}")
+
+    def stats(self) -> dict:
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        wal_path = self.path + "-wal"
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "journal_mode": self.journal_mode,
+            "synchronous": SQLITE_SYNCHRONOUS,
+            "read_threads": self.read_threads,
+            "open_connections": len(self._connections),
+            "size_bytes": size,
+            "wal_size_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+        }
+
+    async def list_expenses(self, after: Optional[str], skip: int, limit: int) -> List[dict]:
+        def query(connection):
+            if after:
+                rows = connection.execute(
+                    f"SELECT {_EXPENSE_COLUMNS} FROM expenses WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+                )
+            else:
+                rows = connection.execute(
+                    f"SELECT {_EXPENSE_COLUMNS} FROM expenses ORDER BY id LIMIT ? OFFSET ?", (limit, skip)
+                )
+            return [_from_row(row) for row in rows]
+        return await self._read(query)
+
+    async def get_expense(self, expense_id: str) -> Optional[dict]:
+        def query(connection):
+            row = connection.execute(f"SELECT {_EXPENSE_COLUMNS} FROM expenses WHERE id = ?", (expense_id,)).fetchone()
+            return _from_row(row) if row else None
+        return await self._read(query)
+
+    async def expense_exists(self, expense_id: str) -> bool:
+        def query(connection):
+            return connection.execute("SELECT 1 FROM expenses WHERE id = ?", (expense_id,)).fetchone() is not None
+        return await self._read(query)
+
+    async def insert_expense(self, document: dict) -> dict:
+        inserted = {**document, "_id": str(ObjectId())}
+
+        def write(connection):
+            with _transaction(connection):
+                _insert_rows(connection, inserted)
+
+        await self._write(write)
+        return inserted
+
+    async def insert_expenses(self, documents: List[dict]) -> Tuple[List[dict], List[Tuple[int, str]]]:
+        def write(connection):
+            # One transaction for the chunk, one savepoint per expense, so a
+            # row that fails is rolled back alone and the rest are kept
+            inserted, errors = [], []
+            with _transaction(connection):
+                for position, document in enumerate(documents):
+                    document = {**document, "_id": str(ObjectId())}
+                    connection.execute("SAVEPOINT expense")
+                    try:
+                        _insert_rows(connection, document)
+                    except (sqlite3.Error, KeyError, TypeError, ValueError) as e:
+                        connection.execute("ROLLBACK TO expense")
+                        errors.append((position, _insert_error(e)))
+                    else:
+                        inserted.append(document)
+                    connection.execute("RELEASE expense")
+            return inserted, errors
+
+        return await self._write(write)
+
+    async def update_expense(self, expense_id: str, fields: dict, expected_version: Optional[int]) -> Optional[dict]:
+        def write(connection):
+            with _transaction(connection):
+                row = connection.execute(f"SELECT {_EXPENSE_COLUMNS} FROM expenses WHERE id = ?", (expense_id,)).fetchone()
+                if row is None:
+                    return None
+                previous = _from_row(row)
+                if expected_version is not None and previous["version"] != expected_version:
+                    return None
+
+                updated = {**previous, **fields, "version": previous["version"] + 1}
+                values = _to_row(expense_id, updated)
+                connection.execute(_UPDATE_EXPENSE, values[1:] + (expense_id,))
+                connection.execute("DELETE FROM shares WHERE expense_id = ?", (expense_id,))
+                connection.executemany(_INSERT_SHARE, _share_rows(expense_id, updated))
+                return previous
+        return await self._write(write)
+
+    async def delete_expense(self, expense_id: str) -> Optional[dict]:
+        def write(connection):
+            with _transaction(connection):
+                row = connection.execute(f"SELECT {_EXPENSE_COLUMNS} FROM expenses WHERE id = ?", (expense_id,)).fetchone()
+                if row is None:
+                    return None
+                # Share rows go with it through ON DELETE CASCADE
+                connection.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
+                return _from_row(row)
+        return await self._write(write)
+
+    async def record_changes(self, changes: Iterable[ExpenseChange]):
+        # Share rows are written in the same transaction as the expense itself
+        pass
+
+    async def iter_expenses(self, batch_size: int = 1000, read_only: bool = False) -> AsyncIterator[dict]:
+        # Keyset pagination, so no read transaction stays open between batches
+        def query(connection, after):
+            rows = connection.execute(
+                f"SELECT {_EXPENSE_COLUMNS} FROM expenses WHERE id > ? ORDER BY id LIMIT ?", (after, batch_size)
+            )
+            return [_from_row(row) for row in rows]
+
+        after = ""
+        while True:
+            batch = await self._read(query, after)
+            for document in batch:
+                yield document
+            if len(batch) < batch_size:
+                return
+            after = batch[-1]["_id"]
+
+    async def scan_expenses(self, fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        async for document in self.iter_expenses(SCAN_BATCH_SIZE):
+            yield document
+
+    async def person_expenses(self, name: str) -> AsyncIterator[dict]:
+        # Every person an expense involves has a share row, and shares_by_person
+        # carries the expense_id (the key of a WITHOUT ROWID table)
+        def query(connection):
+            return [_from_row(row) for row in connection.execute(_PERSON_EXPENSES_QUERY, (name,))]
+
+        for document in await self._read(query):
+            yield document
+
+    async def count_expenses(self) -> int:
+        def query(connection):
+            return connection.execute("SELECT COUNT(*) FROM expenses").fetchone()[0]
+        return await self._read(query)
+
+    async def ledger_totals(self) -> Totals:
+        def query(connection):
+            return {
+                person: {"total_paid": paid, "total_share": share, "expense_count": count}
+                for person, paid, share, count in connection.execute(_TOTALS_QUERY)
+            }
+        return await self._read(query)
+
+    async def list_people(self) -> List[dict]:
+        def query(connection):
+            return [{"name": name, "count": count} for name, count in connection.execute(_PEOPLE_QUERY)]
+        return await self._read(query)
+
+    async def read_data_version(self) -> DataVersion:
+        def query(connection):
+            return connection.execute(_DATA_VERSION_QUERY).fetchone()
+        row = await self._read(query)
+        return (row[0], row[1]) if row else ("", 0)
+
+    async def advance_data_version(self) -> DataVersion:
+        def write(connection):
+            with _transaction(connection):
+                connection.execute(
+                    "INSERT INTO app_state (name, epoch, version) VALUES ('data_version', ?, 0) "
+                    "ON CONFLICT (name) DO NOTHING",
+                    (os.urandom(4).hex(),)
+                )
+                connection.execute("UPDATE app_state SET version = version + 1 WHERE name = 'data_version'")
+                return connection.execute(_DATA_VERSION_QUERY).fetchone()
+        epoch, version = await self._write(write)
+        return epoch, version
+
+    async def read_marker(self, name: str) -> Optional[dict]:
+        def query(connection):
+            return connection.execute(_MARKER_QUERY, (name,)).fetchone()
+        row = await self._read(query)
+        return {"state": row[0], "owner": row[1], "at": datetime.fromisoformat(row[2])} if row else None
+
+    async def claim_marker(self, name: str, owner: str, stale_before: datetime) -> bool:
+        def write(connection):
+            cursor = connection.execute(
+                "INSERT INTO markers (name, state, owner, at) VALUES (?, 'running', ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET state = 'running', owner = excluded.owner, at = excluded.at "
+                "WHERE markers.state != 'done' AND (markers.owner = excluded.owner OR markers.at < ?)",
+                (name, owner, _timestamp(datetime.utcnow()), _timestamp(stale_before))
+            )
+            return cursor.rowcount == 1
+        return await self._write(write)
+
+    async def complete_marker(self, name: str, owner: str) -> bool:
+        def write(connection):
+            cursor = connection.execute(
+                "UPDATE markers SET state = 'done', at = ? WHERE name = ? AND owner = ?",
+                (_timestamp(datetime.utcnow()), name, owner)
+            )
+            return cursor.rowcount == 1
+        return await self._write(write)
+
+    async def delete_marker(self, name: str):
+        def write(connection):
+            connection.execute("DELETE FROM markers WHERE name = ?", (name,))
+        await self._write(write)
+
+    async def append_events(self, events: List[dict]):
+        rows = [
+            (_timestamp(event["at"]), event["expense_id"], event["kind"], event.get("version"), json.dumps(event["delta"]))
+            for event in events
+        ]
+
+        def write(connection):
+            with _transaction(connection):
+                connection.executemany(_INSERT_EVENT, rows)
+        await self._write(write)
+
+    async def iter_events(self, since: Optional[datetime], until: datetime) -> AsyncIterator[dict]:
+        # Keyset pagination on (at, rowid), like iter_expenses
+        def query(connection, after):
+            rows = connection.execute(
+                "SELECT rowid, at, expense_id, kind, version, delta FROM expense_events "
+                "WHERE (at, rowid) > (?, ?) AND at <= ? ORDER BY at, rowid LIMIT ?",
+                after + (_timestamp(until), SCAN_BATCH_SIZE)
+            )
+            return rows.fetchall()
+
+        # Every stored time sorts after the empty string and no rowid is negative
+        after = (_timestamp(since), -1) if since else ("", -1)
+        while True:
+            batch = await self._read(query, after)
+            for _, at, expense_id, kind, version, delta in batch:
+                yield {
+                    "at": datetime.fromisoformat(at),
+                    "expense_id": expense_id,
+                    "kind": kind,
+                    "version": version,
+                    "delta": json.loads(delta)
+                }
+            if len(batch) < SCAN_BATCH_SIZE:
+                return
+            after = (batch[-1][1], batch[-1][0])
+
+    async def count_events(self) -> int:
+        def query(connection):
+            return connection.execute("SELECT COUNT(*) FROM expense_events").fetchone()[0]
+        return await self._read(query)
+
+    async def latest_checkpoint(self, at: datetime) -> Optional[dict]:
+        def query(connection):
+            return connection.execute(
+                "SELECT at, totals FROM balance_checkpoints WHERE at <= ? ORDER BY at DESC LIMIT 1", (_timestamp(at),)
+            ).fetchone()
+        row = await self._read(query)
+        return {"at": datetime.fromisoformat(row[0]), "totals": json.loads(row[1])} if row else None
+
+    async def save_checkpoint(self, checkpoint: dict):
+        def write(connection):
+            connection.execute(
+                "INSERT OR REPLACE INTO balance_checkpoints (at, totals) VALUES (?, ?)",
+                (_timestamp(checkpoint["at"]), json.dumps(checkpoint["totals"]))
+            )
+        await self._write(write)
+
+    async def clear_history(self):
+        def write(connection):
+            with _transaction(connection):
+                connection.execute("DELETE FROM expense_events")
+                connection.execute("DELETE FROM balance_checkpoints")
+        await self._write(write)
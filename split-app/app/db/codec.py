@@ -0,0 +1,153 @@
+"""
+Storage format for money.
+
+Expense amounts are stored as BSON int64 in minor units (cents/paise), and
+custom_split values as BSON Decimal128, so no value ever passes through a
+float. Documents written before this format have float amounts and
+custom_split values; everything here reads both until the one-shot
+migration (python -m app.cli money migrate) has converted them.
+"""
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_EVEN, ROUND_FLOOR, localcontext
+from typing import Dict, List
+import os
+
+from bson.decimal128 import Decimal128, create_decimal128_context
+from bson.int64 import Int64
+from bson.objectid import ObjectId
+
+# Digits after the decimal point in the currency (2 for cents/paise)
+MONEY_DECIMALS = int(os.getenv("MONEY_DECIMALS", 2))
+MINOR_PER_UNIT = 10 ** MONEY_DECIMALS
+
+_QUANTUM = Decimal(1).scaleb(-MONEY_DECIMALS)
+_DECIMAL128_CONTEXT = create_decimal128_context()
+# Decimal128 carries 34 significant digits; matching it keeps Python and
+# server-side arithmetic on percentages identical
+_DECIMAL128_PRECISION = 34
+
+def to_decimal(value) -> Decimal:
+    """Read a stored or API number (Decimal128, float, int, str, Decimal) as a Decimal"""
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        return Decimal(str(value))
+    return Decimal(value)
+
+def to_minor(value) -> int:
+    """Convert an amount in currency units to integer minor units, rounding half to even"""
+    return int(to_decimal(value).quantize(_QUANTUM, rounding=ROUND_HALF_EVEN).scaleb(MONEY_DECIMALS))
+
+def from_minor(minor: int) -> Decimal:
+    """Convert integer minor units back to currency units"""
+    return Decimal(int(minor)).scaleb(-MONEY_DECIMALS)
+
+def to_decimal128(value) -> Decimal128:
+    """Store a number as Decimal128, rounding to its 34-digit precision"""
+    return Decimal128(_DECIMAL128_CONTEXT.create_decimal(to_decimal(value)))
+
+def stored_amount_minor(document: dict) -> int:
+    """Amount of a stored expense in minor units; int is the current format, float the legacy one"""
+    amount = document["amount"]
+    if isinstance(amount, float):
+        return to_minor(amount)
+    return int(amount)
+
+def percentage_floor(amount_minor: int, percentage) -> int:
+    """floor(amount * percentage / 100) with Decimal128 precision"""
+    with localcontext() as context:
+        context.prec = _DECIMAL128_PRECISION
+        context.rounding = ROUND_HALF_EVEN
+        share = Decimal(amount_minor) * to_decimal(percentage) / Decimal(100)
+        return int(share.to_integral_value(rounding=ROUND_FLOOR))
+
+def distribute_residue(shares: List[int], residue: int) -> List[int]:
+    """
+    Spread a rounding residue over shares: everyone gets residue // n and the
+    first residue % n shares get one more minor unit. The order of shares
+    decides who receives the extra units, so the result is deterministic.
+    """
+    if not shares:
+        return shares
+    base, extra = divmod(residue, len(shares))
+    return [share + base + (1 if index < extra else 0) for index, share in enumerate(shares)]
+
+def split_shares_minor(document: dict) -> Dict[str, int]:
+    """
+    Each person's share of a stored expense, in minor units.
+    Equal and percentage shares are floored and the residue handed out in
+    participant (or custom_split) order so the shares add up to the amount.
+    Exact shares are taken as entered.
+    """
+    amount = stored_amount_minor(document)
+    split_type = document["split_type"]
+
+    if split_type == "equal":
+        participants = document["participants"]
+        floors = [amount // len(participants)] * len(participants)
+        shares = distribute_residue(floors, amount - sum(floors))
+        result: Dict[str, int] = {}
+        for person, share in zip(participants, shares):
+            result[person] = result.get(person, 0) + share
+        return result
+
+    custom_split = document.get("custom_split") or {}
+    if split_type == "percentage":
+        people = list(custom_split)
+        floors = [percentage_floor(amount, custom_split[person]) for person in people]
+        shares = distribute_residue(floors, amount - sum(floors))
+        return dict(zip(people, shares))
+
+    if split_type == "exact":
+        return {person: to_minor(value) for person, value in custom_split.items()}
+
+    return {}
+
+def split_evenly(amount, participants: List[str]) -> Dict[str, Decimal]:
+    """Default exact split: equal amounts in whole minor units that add up to amount"""
+    amount_minor = to_minor(amount)
+    floors = [amount_minor // len(participants)] * len(participants)
+    shares = distribute_residue(floors, amount_minor - sum(floors))
+    return {person: from_minor(share) for person, share in zip(participants, shares)}
+
+def encode_fields(fields: dict) -> dict:
+    """Convert the money fields of an expense (or a partial $set) to the storage format"""
+    encoded = dict(fields)
+    if encoded.get("amount") is not None:
+        encoded["amount"] = Int64(to_minor(encoded["amount"]))
+    if encoded.get("custom_split") is not None:
+        encoded["custom_split"] = {
+            person: to_decimal128(value) for person, value in encoded["custom_split"].items()
+        }
+    return encoded
+
+def created_at(document: dict) -> datetime:
+    """
+    When a stored expense was created, as naive UTC. Expenses written before
+    created_at was stored fall back to the second encoded in their ObjectId.
+    """
+    value = document.get("created_at")
+    if value is not None:
+        return value
+    return ObjectId(str(document["_id"])).generation_time.replace(tzinfo=None)
+
+def decode_expense(document: dict) -> dict:
+    """Convert a stored expense to API values: amounts and splits as Decimals in currency units"""
+    decoded = dict(document)
+    if "_id" in decoded:
+        decoded["created_at"] = created_at(document)
+    if "amount" in decoded:
+        decoded["amount"] = from_minor(stored_amount_minor(document))
+    if decoded.get("custom_split"):
+        decoded["custom_split"] = {
+            person: to_decimal(value) for person, value in decoded["custom_split"].items()
+        }
+    return decoded
+
+def is_legacy(document: dict) -> bool:
+    """True for documents still holding float amounts"""
+    return isinstance(document.get("amount"), float) or any(
+        isinstance(value, float) for value in (document.get("custom_split") or {}).values()
+    )
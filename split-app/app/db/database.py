@@ -1,8 +1,15 @@
+from typing import Optional
+import asyncio
 import os
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 from dotenv import load_dotenv
 
+from app.db.codec import encode_fields
+from app.db.indexes import ensure_indexes
+from app.db.monitoring import CommandTimingListener, PoolWaitMonitor
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -11,50 +18,165 @@ logger = logging.getLogger(__name__)
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "expense_splitter")
 
-# MongoDB clients and collections
-client = None
-db = None
-expense_collection = None
+# Connection pool and timeouts; unset values keep the driver defaults
+MONGODB_MAX_POOL_SIZE = os.getenv("MONGODB_MAX_POOL_SIZE")
+MONGODB_MIN_POOL_SIZE = os.getenv("MONGODB_MIN_POOL_SIZE")
+MONGODB_MAX_IDLE_TIME_MS = os.getenv("MONGODB_MAX_IDLE_TIME_MS")
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS")
+MONGODB_CONNECT_TIMEOUT_MS = os.getenv("MONGODB_CONNECT_TIMEOUT_MS")
+MONGODB_SOCKET_TIMEOUT_MS = os.getenv("MONGODB_SOCKET_TIMEOUT_MS")
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS")
+# Comma separated wire compressors in order of preference, e.g. "zstd,snappy,zlib"
+MONGODB_COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "")
+
+# Where uncached reads (expense pages, the expense export) send their queries:
+# primary, primaryPreferred, secondary, secondaryPreferred or nearest. Writes,
+# reads that feed a write and reads whose results are cached under the data
+# version (balances, settlements, people) always use the primary.
+MONGODB_READ_PREFERENCE = os.getenv("MONGODB_READ_PREFERENCE", "primary")
+MONGODB_MAX_STALENESS_SECONDS = int(os.getenv("MONGODB_MAX_STALENESS_SECONDS", -1))
+
+# Create missing indexes when connecting; large deployments may prefer to run
+# `python -m app.cli indexes ensure` during a maintenance window instead
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "true").lower() == "true"
+
+_POOL_OPTIONS = {
+    "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+    "minPoolSize": MONGODB_MIN_POOL_SIZE,
+    "maxIdleTimeMS": MONGODB_MAX_IDLE_TIME_MS,
+    "waitQueueTimeoutMS": MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+    "connectTimeoutMS": MONGODB_CONNECT_TIMEOUT_MS,
+    "socketTimeoutMS": MONGODB_SOCKET_TIMEOUT_MS,
+    "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT_MS
+}
+
+def client_options() -> dict:
+    """Keyword arguments for the MongoDB client built from the environment"""
+    options = {name: int(value) for name, value in _POOL_OPTIONS.items() if value not in (None, "")}
+    compressors = [name.strip() for name in MONGODB_COMPRESSORS.split(",") if name.strip()]
+    if compressors:
+        options["compressors"] = compressors
+    return options
+
+def read_preference():
+    """Read preference for read-only endpoints"""
+    mode = read_pref_mode_from_name(MONGODB_READ_PREFERENCE)
+    return make_read_preference(mode, None, MONGODB_MAX_STALENESS_SECONDS)
+
+class DatabaseManager:
+    """
+    Owns the MongoDB client for the lifetime of the process.
+    Connected by the FastAPI lifespan (or lazily on first use by scripts)
+    and closed on shutdown.
+    """
+
+    def __init__(self, uri: str, db_name: str):
+        self.uri = uri
+        self.db_name = db_name
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.db = None
+        self.pool_monitor = PoolWaitMonitor()
+        self.command_listener = CommandTimingListener()
+        self._read_preference = read_preference()
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self.db is not None
+
+    async def connect(self, client=None):
+        """
+        Create the client, check the server is reachable and prepare collections.
+        An already constructed client (e.g. an in-memory one for benchmarks) can be passed in.
+        """
+        async with self._connect_lock:
+            if self.connected:
+                return
+            try:
+                if client is None:
+                    client = AsyncIOMotorClient(
+                        self.uri,
+                        event_listeners=[self.pool_monitor, self.command_listener],
+                        **client_options()
+                    )
+                # Validate connection
+                await client.admin.command('ping')
+            except Exception as e:
+                logger.error(f"Failed to connect to MongoDB: {e}")
+                raise
+
+            self.client = client
+            self.db = client[self.db_name]
+            logger.info(f"Connected to MongoDB: {self.uri} (reads: {MONGODB_READ_PREFERENCE})")
+
+            # Bring indexes in line with app/db/indexes.py
+            if ENSURE_INDEXES_ON_STARTUP:
+                await ensure_indexes(self.db)
+
+            # Seed initial data if needed (for testing)
+            if os.getenv("ENVIRONMENT") == "development":
+                await seed_initial_data()
+
+    async def close(self):
+        """Close the client and its connection pool"""
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.db = None
+            logger.info("Closed MongoDB connection")
+
+    async def get_collection(self, name: str, read_only: bool = False):
+        """A collection, routed to the configured read preference for read-only use"""
+        if not self.connected:
+            await self.connect()
+        collection = self.db[name]
+        if read_only:
+            collection = collection.with_options(read_preference=self._read_preference)
+        return collection
+
+    def stats(self) -> dict:
+        """Pool configuration and checkout wait statistics"""
+        return {
+            "connected": self.connected,
+            "read_preference": MONGODB_READ_PREFERENCE,
+            "options": client_options(),
+            "pool": self.pool_monitor.stats()
+        }
+
+db_manager = DatabaseManager(MONGODB_URI, DB_NAME)
 
 async def init_db():
     """Initialize database connection"""
-    global client, db, expense_collection
-    
-    try:
-        client = AsyncIOMotorClient(MONGODB_URI)
-        # Validate connection
-        await client.admin.command('ping')
-        
-        # Access database and collections
-        db = client[DB_NAME]
-        expense_collection = db.expenses
-        
-        logger.info(f"Connected to MongoDB: {MONGODB_URI}")
-        
-        # Create indexes for better performance
-        await expense_collection.create_index("paid_by")
-        
-        # Seed initial data if needed (for testing)
-        if os.getenv("ENVIRONMENT") == "development":
-            await seed_initial_data()
-        
-        return expense_collection
-            
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {e}")
-        raise
+    await db_manager.connect()
+    return await get_expense_collection()
 
-async def get_expense_collection():
+async def get_expense_collection(read_only: bool = False):
     """Get the expense collection, initializing if needed"""
-    global expense_collection
-    if expense_collection is None:
-        await init_db()
-    return expense_collection
+    return await db_manager.get_collection("expenses", read_only)
+
+async def get_ledger_collection(read_only: bool = False):
+    """Get the per-person balance ledger collection, initializing if needed"""
+    return await db_manager.get_collection("ledger", read_only)
+
+async def get_people_collection(read_only: bool = False):
+    """Get the people registry collection, initializing if needed"""
+    return await db_manager.get_collection("people", read_only)
+
+async def get_events_collection(read_only: bool = False):
+    """Get the expense journal collection, initializing if needed"""
+    return await db_manager.get_collection("expense_events", read_only)
+
+async def get_checkpoints_collection(read_only: bool = False):
+    """Get the balance checkpoint collection, initializing if needed"""
+    return await db_manager.get_collection("balance_checkpoints", read_only)
+
+async def get_state_collection():
+    """Get the collection of shared counters and markers (the data version); always on the primary"""
+    return await db_manager.get_collection("app_state")
 
 async def seed_initial_data():
     """Seed initial test data"""
-    # Ensure we have the collection
-    global expense_collection
+    expense_collection = await get_expense_collection()
     
     # Check if we already have expenses
     count = await expense_collection.count_documents({})
@@ -106,11 +228,9 @@ async def seed_initial_data():
         }
     ]
     
-    await expense_collection.insert_many(expenses)
+    await expense_collection.insert_many([encode_fields(expense) for expense in expenses])
     logger.info("Seeded initial expense data")
 
 async def close_db():
     """Close database connection"""
-    if client:
-        client.close()
-        logger.info("Closed MongoDB connection")
\ No newline at end of file
+    await db_manager.close()
@@ -0,0 +1,244 @@
+"""
+Declarative index registry.
+
+INDEXES lists every index the application relies on, per collection, and
+RETIRED_INDEXES the ones it used to create. ensure_indexes() brings a
+database in line with both and is safe to run any number of times; it runs
+at startup and through `python -m app.cli indexes ensure`.
+
+QUERY_PLANS lists the queries the services run, with sample values, so
+`python -m app.cli indexes explain` can check each one against the live
+database and fail when a query that should use an index falls back to a
+collection scan. tests/test_query_plans.py explains the commands the
+repository actually sends and fails when one of its finds is missing here.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import logging
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+class IndexSpec(NamedTuple):
+    name: str
+    keys: List[Tuple[str, int]]
+    unique: bool = False
+    # partialFilterExpression: only documents matching it are indexed
+    partial: Optional[Dict[str, Any]] = None
+
+INDEXES: Dict[str, List[IndexSpec]] = {
+    "expenses": [
+        # Expenses someone paid for or takes part in, in _id (page) order;
+        # participants is an array, so that index is multikey
+        IndexSpec("paid_by_1__id_1", [("paid_by", ASCENDING), ("_id", ASCENDING)]),
+        IndexSpec("participants_1__id_1", [("participants", ASCENDING), ("_id", ASCENDING)]),
+        # Polling for changes when change streams are unavailable
+        IndexSpec("updated_at_1", [("updated_at", ASCENDING)])
+    ],
+    "people": [
+        IndexSpec("name_1", [("name", ASCENDING)], unique=True)
+    ],
+    "ledger": [],
+    # Replaying the journal from a checkpoint; checkpoints use their _id (the time)
+    "expense_events": [
+        IndexSpec("at_1", [("at", ASCENDING)]),
+        # Each change is journaled once; events from before versions were
+        # recorded have no version and are left out
+        IndexSpec(
+            "expense_id_1_version_1_kind_1",
+            [("expense_id", ASCENDING), ("version", ASCENDING), ("kind", ASCENDING)],
+            unique=True,
+            partial={"version": {"$exists": True}}
+        )
+    ],
+    "balance_checkpoints": [],
+    # Shared counters and markers, looked up by _id
+    "app_state": []
+}
+
+# Indexes created by earlier versions that the spec above replaces
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    # Prefix of paid_by_1__id_1
+    "expenses": ["paid_by_1"]
+}
+
+def _index_model(spec: IndexSpec) -> IndexModel:
+    options = {"partialFilterExpression": spec.partial} if spec.partial else {}
+    return IndexModel(spec.keys, name=spec.name, unique=spec.unique, **options)
+
+def index_models(collection_name: str) -> List[IndexModel]:
+    """IndexModels for one collection's spec"""
+    return [_index_model(spec) for spec in INDEXES.get(collection_name, [])]
+
+def _matches(spec: IndexSpec, existing: dict) -> bool:
+    return [tuple(key) for key in existing["key"]] == [tuple(key) for key in spec.keys] \
+        and bool(existing.get("unique", False)) == spec.unique \
+        and (existing.get("partialFilterExpression") or None) == spec.partial
+
+async def ensure_indexes(db, prune: bool = False) -> List[dict]:
+    """
+    Create missing indexes, rebuild ones whose definition changed and drop
+    retired ones. With prune, also drop any other index not in the spec.
+    Returns one entry per index describing what was done.
+    """
+    report = []
+    for collection_name, specs in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        wanted = {spec.name for spec in specs}
+
+        for spec in specs:
+            current = existing.get(spec.name)
+            if current is not None and _matches(spec, current):
+                report.append({"collection": collection_name, "index": spec.name, "action": "exists"})
+                continue
+            if current is not None:
+                await collection.drop_index(spec.name)
+            await collection.create_indexes([_index_model(spec)])
+            action = "rebuilt" if current is not None else "created"
+            logger.info(f"Index {collection_name}.{spec.name} {action}")
+            report.append({"collection": collection_name, "index": spec.name, "action": action})
+
+        retired = set(RETIRED_INDEXES.get(collection_name, []))
+        for name in existing:
+            if name == "_id_" or name in wanted:
+                continue
+            if name in retired or prune:
+                await collection.drop_index(name)
+                logger.info(f"Index {collection_name}.{name} dropped")
+                report.append({"collection": collection_name, "index": name, "action": "dropped"})
+            else:
+                report.append({"collection": collection_name, "index": name, "action": "unmanaged"})
+
+    return report
+
+class QueryPlan(NamedTuple):
+    """A service query to explain. allow_collscan marks queries that read the whole collection by design."""
+    name: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]] = None
+    limit: int = 0
+    pipeline: Optional[List[dict]] = None
+    allow_collscan: bool = False
+
+_SAMPLE_ID = ObjectId("000000000000000000000000")
+_SAMPLE_PERSON = "sample-person"
+
+QUERY_PLANS: List[QueryPlan] = [
+    QueryPlan("MongoExpenseRepository.list_expenses (first page)", "expenses", {}, [("_id", 1)], 11),
+    QueryPlan("MongoExpenseRepository.list_expenses (cursor)", "expenses", {"_id": {"$gt": _SAMPLE_ID}}, [("_id", 1)], 11),
+    QueryPlan("MongoExpenseRepository.get_expense", "expenses", {"_id": _SAMPLE_ID}),
+    QueryPlan("expenses by payer", "expenses", {"paid_by": _SAMPLE_PERSON}, [("_id", 1)]),
+    QueryPlan("expenses by participant", "expenses", {"participants": _SAMPLE_PERSON}, [("_id", 1)]),
+    QueryPlan(
+        "MongoExpenseRepository.person_expenses", "expenses",
+        {"$or": [{"paid_by": _SAMPLE_PERSON}, {"participants": _SAMPLE_PERSON}]}
+    ),
+    QueryPlan("MongoExpenseRepository.iter_expenses", "expenses", {}, [("_id", 1)]),
+    QueryPlan("MongoExpenseRepository.scan_expenses", "expenses", {}, allow_collscan=True),
+    QueryPlan("expense_state._poll_updates", "expenses", {"updated_at": {"$gte": datetime(2000, 1, 1)}}),
+    QueryPlan("expense_state._poll_updates (first poll)", "expenses", {"updated_at": {"$exists": True}}),
+    QueryPlan("MongoExpenseRepository.list_people", "people", {"count": {"$gt": 0}}, [("name", 1)]),
+    QueryPlan("people_service.apply_people_changes", "people", {"name": _SAMPLE_PERSON}),
+    QueryPlan(
+        "MongoExpenseRepository.iter_events", "expense_events",
+        {"at": {"$gte": datetime(2000, 1, 1), "$lte": datetime(2000, 2, 1)}}, [("at", 1)]
+    ),
+    QueryPlan(
+        "MongoExpenseRepository.iter_events (from the start)", "expense_events",
+        {"at": {"$lte": datetime(2000, 2, 1)}}, [("at", 1)]
+    ),
+    QueryPlan(
+        "MongoExpenseRepository.latest_checkpoint", "balance_checkpoints",
+        {"_id": {"$lte": datetime(2000, 1, 1)}}, [("_id", -1)], 1
+    ),
+    QueryPlan(
+        "ledger_service.get_ledger_totals", "ledger", {"expense_count": {"$gt": 0}},
+        allow_collscan=True
+    ),
+    QueryPlan(
+        "people_service.count_people_from_expenses", "expenses", {},
+        pipeline=[{"$unwind": "$participants"}, {"$group": {"_id": "$participants", "count": {"$sum": 1}}}],
+        allow_collscan=True
+    ),
+]
+
+def _stages(plan) -> List[str]:
+    """Every stage name in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_stages(value))
+    return stages
+
+def plan_stages(explain: dict) -> List[str]:
+    """Stages of the winning plan(s) in explain output"""
+    # Aggregations nest the query planner under their first stage
+    stages = []
+    for planner in _find_key(explain, "queryPlanner"):
+        stages.extend(_stages(planner.get("winningPlan")))
+    return stages
+
+async def explain_query(db, query: QueryPlan) -> dict:
+    """Explain one query and report the stages of its winning plan"""
+    collection = db[query.collection]
+    if query.pipeline is not None:
+        explain = await db.command(
+            "explain",
+            {"aggregate": query.collection, "pipeline": [{"$match": query.filter}] + query.pipeline, "cursor": {}},
+            verbosity="queryPlanner"
+        )
+    else:
+        cursor = collection.find(query.filter)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        if query.limit:
+            cursor = cursor.limit(query.limit)
+        explain = await cursor.explain()
+
+    stages = plan_stages(explain)
+    collscan = "COLLSCAN" in stages
+    return {
+        "name": query.name,
+        "collection": query.collection,
+        "stages": stages,
+        "collscan": collscan,
+        "ok": query.allow_collscan or not collscan
+    }
+
+def _find_key(document, key: str):
+    if isinstance(document, dict):
+        for name, value in document.items():
+            if name == key:
+                yield value
+            else:
+                yield from _find_key(value, key)
+    elif isinstance(document, list):
+        for value in document:
+            yield from _find_key(value, key)
+
+async def explain_queries(db) -> List[dict]:
+    """Explain every registered query; entries with ok=False scan a collection they should not"""
+    results = []
+    for query in QUERY_PLANS:
+        try:
+            results.append(await explain_query(db, query))
+        except OperationFailure as e:
+            results.append({
+                "name": query.name,
+                "collection": query.collection,
+                "stages": [],
+                "collscan": False,
+                "ok": False,
+                "error": str(e)
+            })
+    return results
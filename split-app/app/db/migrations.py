@@ -0,0 +1,53 @@
+import logging
+
+from pymongo import UpdateOne
+
+from app.db.codec import encode_fields, decode_expense
+from app.db.database import get_expense_collection
+
+logger = logging.getLogger(__name__)
+
+# Expenses still holding a float amount or float custom_split values
+LEGACY_MONEY_QUERY = {"$or": [
+    {"amount": {"$type": "double"}},
+    {"$expr": {"$anyElementTrue": [{"$map": {
+        "input": {"$objectToArray": {"$ifNull": ["$custom_split", {}]}},
+        "in": {"$eq": [{"$type": "$$this.v"}, "double"]}
+    }}]}}
+]}
+
+async def migrate_money_to_minor_units(batch_size: int = 1000, dry_run: bool = False) -> int:
+    """
+    Rewrite float amounts as int64 minor units and float custom_split values
+    as Decimal128. Safe to re-run: converted documents no longer match.
+    Returns the number of documents converted (or that would be, with dry_run).
+    """
+    expense_collection = await get_expense_collection()
+
+    if dry_run:
+        return await expense_collection.count_documents(LEGACY_MONEY_QUERY)
+
+    converted = 0
+    operations = []
+    projection = {"amount": 1, "custom_split": 1}
+    async for document in expense_collection.find(LEGACY_MONEY_QUERY, projection).batch_size(batch_size):
+        fields = encode_fields(decode_expense({
+            "amount": document["amount"],
+            "custom_split": document.get("custom_split") or {}
+        }))
+        operations.append(UpdateOne(
+            # Skip documents that changed since they were read
+            {"_id": document["_id"], "amount": document["amount"]},
+            {"$set": fields}
+        ))
+        if len(operations) >= batch_size:
+            result = await expense_collection.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+            operations = []
+
+    if operations:
+        result = await expense_collection.bulk_write(operations, ordered=False)
+        converted += result.modified_count
+
+    logger.info(f"Converted {converted} expenses to minor-unit money")
+    return converted
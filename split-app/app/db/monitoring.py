@@ -0,0 +1,172 @@
+"""
+Driver event listeners: connection pool checkout waits, used to size the
+pool, and per-command latency for /metrics.
+
+Motor runs PyMongo operations on a thread pool, and a connection checkout
+starts and completes on the same thread, so the start time of a checkout
+is kept in a thread-local and matched up when the connection is handed out.
+"""
+from collections import deque
+from typing import Dict
+import threading
+import time
+
+from pymongo import monitoring
+
+from app.utils.metrics import Counter, Gauge, Histogram
+
+# Upper bounds (ms) of the checkout wait histogram
+POOL_WAIT_BUCKETS_MS = (0.5, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+# Recent waits kept for percentiles
+POOL_WAIT_SAMPLES = 2048
+
+MONGODB_POOL_CHECKOUT_WAIT = Histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting to check a connection out of the pool",
+    buckets=tuple(bound / 1000 for bound in POOL_WAIT_BUCKETS_MS)
+)
+MONGODB_POOL_CONNECTIONS = Gauge(
+    "mongodb_pool_connections", "Connections in the pool, by state", ("state",)
+)
+
+def _percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class PoolWaitMonitor(monitoring.ConnectionPoolListener):
+    """Records how long operations wait to check a connection out of the pool"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.failures: Dict[str, int] = {}
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.bucket_counts = [0] * len(POOL_WAIT_BUCKETS_MS)
+        self.recent_waits = deque(maxlen=POOL_WAIT_SAMPLES)
+        self.open_connections = 0
+        self.checked_out = 0
+
+    def _started(self) -> Dict:
+        started = getattr(self._local, "started", None)
+        if started is None:
+            started = self._local.started = {}
+        return started
+
+    def connection_check_out_started(self, event):
+        self._started()[event.address] = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = self._started().pop(event.address, None)
+        if started is None:
+            return
+        wait_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            self.recent_waits.append(wait_ms)
+            for index, bound in enumerate(POOL_WAIT_BUCKETS_MS):
+                if wait_ms <= bound:
+                    self.bucket_counts[index] += 1
+                    break
+        MONGODB_POOL_CHECKOUT_WAIT.observe(wait_ms / 1000)
+        MONGODB_POOL_CONNECTIONS.inc("checked_out")
+
+    def connection_check_out_failed(self, event):
+        self._started().pop(event.address, None)
+        with self._lock:
+            self.failures[event.reason] = self.failures.get(event.reason, 0) + 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+        MONGODB_POOL_CONNECTIONS.dec("checked_out")
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+        MONGODB_POOL_CONNECTIONS.inc("open")
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections = max(0, self.open_connections - 1)
+        MONGODB_POOL_CONNECTIONS.dec("open")
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        """Checkout wait summary in milliseconds, plus current pool usage"""
+        with self._lock:
+            recent = list(self.recent_waits)
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.failures),
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "wait_ms": {
+                    "mean": round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                    "max": round(self.max_wait_ms, 3),
+                    "p50": round(_percentile(recent, 0.50), 3),
+                    "p95": round(_percentile(recent, 0.95), 3),
+                    "p99": round(_percentile(recent, 0.99), 3)
+                },
+                "wait_histogram_ms": {
+                    f"le_{bound}": count for bound, count in zip(POOL_WAIT_BUCKETS_MS, self.bucket_counts)
+                },
+                "waits_over_last_bucket": self.checkouts - sum(self.bucket_counts)
+            }
+
+MONGODB_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trip, by command and collection",
+    ("command", "collection")
+)
+MONGODB_COMMAND_FAILURES = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that failed, by command and collection",
+    ("command", "collection")
+)
+
+def _command_collection(event) -> str:
+    """Collection a command targets; empty for database and admin commands"""
+    if event.command_name == "getMore":
+        return event.command.get("collection", "")
+    target = event.command.get(event.command_name)
+    return target if isinstance(target, str) else ""
+
+class CommandTimingListener(monitoring.CommandListener):
+    """
+    Records command durations. The driver measures the duration itself;
+    the collection is only known from the started event, so it is held
+    by request id until the command finishes.
+    """
+
+    def __init__(self):
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event):
+        self._collections[event.request_id] = _command_collection(event)
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGODB_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name, collection)
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGODB_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name, collection)
+        MONGODB_COMMAND_FAILURES.inc(event.command_name, collection)
@@ -0,0 +1,201 @@
+"""
+Storage backend interface.
+
+expense_service, settlement_service and the people and export endpoints
+program against ExpenseRepository instead of talking to a driver, so the
+app can run on:
+  mongo   - MongoDB through Motor (default)
+  sqlite  - an embedded SQLite file in WAL mode; balances are computed in SQL
+  memory  - plain Python structures, nothing persisted (tests, demos)
+
+The backend is picked with STORAGE_BACKEND. Documents passed in and out are
+in the stored format of app/db/codec.py (amounts as integer minor units) with
+_id as a 24 character hex string, so ids and page cursors look the same on
+every backend.
+
+Each backend also keeps the expense journal and balance checkpoints of
+app/services/history_service.py. An event is
+{"at", "expense_id", "kind", "version", "delta"} and a checkpoint
+{"at", "totals"}, with delta and totals in the per-person minor-unit form of
+the ledger. (expense_id, version, kind) identifies an event, so appending
+the same event twice stores it once. Events journaled before versions were
+recorded have version None and are always stored.
+
+Backends also keep the shared data version of app/services/cache_service.py,
+so every process on the same storage ties its cached results to the same
+count of writes, and named markers that let one process claim a one-off
+job (the journal backfill) for all of them. A marker is
+{"state", "owner", "at"} with state "running" or "done".
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import os
+
+STORAGE_BACKENDS = ("mongo", "sqlite", "memory")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo").lower()
+
+# A (before, after) pair per changed expense; None before a create or after a delete
+ExpenseChange = Tuple[Optional[dict], Optional[dict]]
+# (epoch, number of writes); the epoch changes when the storage starts afresh
+DataVersion = Tuple[str, int]
+
+class ExpenseRepository(ABC):
+    """Everything the services need from storage"""
+
+    name = ""
+
+    async def connect(self):
+        """Open connections and prepare storage; called once at startup"""
+
+    async def close(self):
+        """Release connections; called on shutdown"""
+
+    def stats(self) -> dict:
+        """Backend specific connection and storage statistics"""
+        return {"backend": self.name}
+
+    @abstractmethod
+    async def list_expenses(self, after: Optional[str], skip: int, limit: int) -> List[dict]:
+        """Up to limit expenses in _id order, starting after the given _id (or skipping skip rows)"""
+
+    @abstractmethod
+    async def get_expense(self, expense_id: str) -> Optional[dict]:
+        """One expense, or None"""
+
+    @abstractmethod
+    async def expense_exists(self, expense_id: str) -> bool:
+        """True if an expense with this _id is stored"""
+
+    @abstractmethod
+    async def insert_expense(self, document: dict) -> dict:
+        """Store a new expense and return it with its _id"""
+
+    @abstractmethod
+    async def insert_expenses(self, documents: List[dict]) -> Tuple[List[dict], List[Tuple[int, str]]]:
+        """
+        Store many new expenses. Returns the stored documents and
+        (position, message) for every document that could not be written.
+        """
+
+    @abstractmethod
+    async def update_expense(self, expense_id: str, fields: dict, expected_version: Optional[int]) -> Optional[dict]:
+        """
+        Set fields and bump the version, only if the stored version still
+        matches expected_version (when given). Returns the expense as it was
+        before the update, or None when nothing matched.
+        """
+
+    @abstractmethod
+    async def delete_expense(self, expense_id: str) -> Optional[dict]:
+        """Remove an expense and return it, or None if it did not exist"""
+
+    @abstractmethod
+    async def record_changes(self, changes: Iterable[ExpenseChange]):
+        """Bring derived data (per-person totals, the people registry) in line with written expenses"""
+
+    @abstractmethod
+    def iter_expenses(self, batch_size: int = 1000, read_only: bool = False) -> AsyncIterator[dict]:
+        """
+        Every expense in _id order, fetched batch_size at a time. read_only
+        lets the backend serve it from a replica that may lag behind (exports).
+        """
+
+    @abstractmethod
+    def scan_expenses(self, fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        """Every expense in no particular order, as cheaply as the backend can; fields limits what is read"""
+
+    @abstractmethod
+    def person_expenses(self, name: str) -> AsyncIterator[dict]:
+        """Every expense the person paid for or takes part in, read through an index on the person"""
+
+    @abstractmethod
+    async def count_expenses(self) -> int:
+        """Number of stored expenses (may be an estimate)"""
+
+    @abstractmethod
+    async def ledger_totals(self) -> Dict[str, Dict[str, int]]:
+        """Per-person totals in minor units, as maintained or computed by the backend"""
+
+    @abstractmethod
+    async def list_people(self) -> List[dict]:
+        """{name, count} for everyone taking part in at least one expense, sorted by name"""
+
+    @abstractmethod
+    async def read_data_version(self) -> DataVersion:
+        """The shared data version, ("", 0) before the first write"""
+
+    @abstractmethod
+    async def advance_data_version(self) -> DataVersion:
+        """Count a write in the shared data version and return the new version"""
+
+    @abstractmethod
+    async def read_marker(self, name: str) -> Optional[dict]:
+        """A shared marker, or None when it was never claimed"""
+
+    @abstractmethod
+    async def claim_marker(self, name: str, owner: str, stale_before: datetime) -> bool:
+        """
+        Mark name running for owner and return True, unless it is done or
+        another owner's claim was made or renewed after stale_before.
+        Claiming again as the same owner renews the claim.
+        """
+
+    @abstractmethod
+    async def complete_marker(self, name: str, owner: str) -> bool:
+        """Mark name done if owner still holds the claim; False when it does not"""
+
+    @abstractmethod
+    async def delete_marker(self, name: str):
+        """Forget a marker, so the job can be claimed again"""
+
+    @abstractmethod
+    async def append_events(self, events: List[dict]):
+        """Add events to the expense journal, skipping any already stored"""
+
+    @abstractmethod
+    def iter_events(self, since: Optional[datetime], until: datetime) -> AsyncIterator[dict]:
+        """Journal events with since <= at <= until (from the start when since is None), in at order"""
+
+    @abstractmethod
+    async def count_events(self) -> int:
+        """Number of journal events"""
+
+    @abstractmethod
+    async def latest_checkpoint(self, at: datetime) -> Optional[dict]:
+        """The balance checkpoint with the latest at no later than at, or None"""
+
+    @abstractmethod
+    async def save_checkpoint(self, checkpoint: dict):
+        """Store a balance checkpoint, replacing any other at the same time"""
+
+    @abstractmethod
+    async def clear_history(self):
+        """Remove every journal event and checkpoint"""
+
+def create_repository(backend: str = STORAGE_BACKEND) -> ExpenseRepository:
+    """Build the repository for a backend name"""
+    if backend == "mongo":
+        from app.db.backends.mongo import MongoExpenseRepository
+        return MongoExpenseRepository()
+    if backend == "sqlite":
+        from app.db.backends.sqlite import SQLiteExpenseRepository
+        return SQLiteExpenseRepository()
+    if backend == "memory":
+        from app.db.backends.memory import MemoryExpenseRepository
+        return MemoryExpenseRepository()
+    raise ValueError(f"Unknown storage backend '{backend}', expected one of: {', '.join(STORAGE_BACKENDS)}")
+
+_repository: Optional[ExpenseRepository] = None
+
+def get_repository() -> ExpenseRepository:
+    """The configured repository, created on first use"""
+    global _repository
+    if _repository is None:
+        _repository = create_repository()
+    return _repository
+
+def set_repository(repository: Optional[ExpenseRepository]):
+    """Swap the repository in use, e.g. for an in-memory one in tests; None resets to the configured backend"""
+    global _repository
+    _repository = repository
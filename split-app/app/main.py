@@ -1,11 +1,21 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 import os
 from dotenv import load_dotenv
 
-from app.db.database import init_db
+from app.db.repository import STORAGE_BACKEND, get_repository
+from app.middleware.admission import AdmissionMiddleware, admission_stats
+from app.middleware.compression import CompressionMiddleware
+from app.middleware.metrics import MetricsMiddleware
 from app.routers import expenses, settlements, people
+from app.services.cache_service import result_cache
+from app.services.expense_service import write_batcher
+from app.services.history_service import ensure_history
+from app.utils import metrics, offload
+from app.utils.json_response import FastJSONResponse
 
 # Load environment variables
 load_dotenv()
@@ -18,13 +28,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the storage backend for the lifetime of the app and close it on shutdown"""
+    repository = get_repository()
+    logger.info(f"Opening {STORAGE_BACKEND} storage...")
+    await repository.connect()
+    # Journal expenses stored before the expense history existed; when another
+    # process is already doing it, as-of queries wait for it instead of startup
+    await ensure_history(wait=False)
+    logger.info(f"Storage ready ({STORAGE_BACKEND})")
+    app.state.repository = repository
+    try:
+        yield
+    finally:
+        # Batched creates still waiting are written before storage closes
+        await write_batcher.close()
+        await repository.close()
+        offload.shutdown()
+
 # Create FastAPI app
 app = FastAPI(
     title="Expense Splitter API",
     description="API for splitting expenses among friends",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
+# Per-class concurrency limits and queues; innermost, so shed 503s still
+# carry CORS headers and show up in the request metrics
+app.add_middleware(AdmissionMiddleware, router_app=app)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -34,23 +69,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# br/gzip for responses above COMPRESSION_MIN_SIZE, including streamed exports
+app.add_middleware(CompressionMiddleware)
+
+# Per-route latency and in-flight requests for /metrics
+app.add_middleware(MetricsMiddleware, router_app=app)
+
 # Include routers
 app.include_router(expenses.router, prefix="/expenses", tags=["Expenses"])
 app.include_router(settlements.router, tags=["Settlements"])
 app.include_router(people.router, prefix="/people", tags=["People"])
 
-@app.on_event("startup")
-async def startup_db_client():
-    logger.info("Connecting to MongoDB...")
-    await init_db()
-    logger.info("Connected to MongoDB!")
-
 @app.get("/", tags=["Health"])
 async def root():
     """Health check endpoint"""
     return {"status": "ok", "message": "Expense Splitter API is running"}
 
+@app.get("/cache/stats", tags=["Health"])
+async def cache_stats():
+    """Response cache size, hit/miss counts and current data version"""
+    return result_cache.stats()
+
+@app.get("/admission/stats", tags=["Health"])
+async def admission_statistics():
+    """Concurrency limit, running and queued requests and shed counts per request class"""
+    return admission_stats()
+
+@app.get("/db/stats", tags=["Health"])
+async def db_stats():
+    """Storage backend statistics: pool settings, usage and checkout waits on MongoDB, file and WAL size on SQLite"""
+    return get_repository().stats()
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Request, MongoDB command, pool and computation metrics in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run("app.main:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
+    uvicorn.run("app.main:app", host="0.0.0.0", port=port, reload=True)
@@ -0,0 +1,195 @@
+"""
+Admission control as a pure ASGI middleware.
+
+Every request belongs to a class with its own concurrency limit and a bounded
+wait queue:
+
+  read   cheap reads: expense pages, one person's balance, people
+  write  POST, PUT, PATCH and DELETE
+  heavy  full scans and computations: balances, settlements and the exports
+
+A request runs when its class has a free slot and otherwise waits in the
+class's queue, first come first served. When the queue is full, or the request
+has waited ADMISSION_QUEUE_TIMEOUT seconds, it is shed right away with a 503
+and a Retry-After header instead of piling more cursors and CPU work onto an
+overloaded worker. Health and metrics endpoints are never limited, so probes
+keep answering under load.
+
+Limits are per worker process: with N uvicorn workers the node admits N times
+as many requests.
+"""
+from collections import deque
+from typing import Deque, Dict, Optional
+import asyncio
+import os
+import time
+
+from app.middleware.metrics import RouteResolver
+from app.models.responses import ErrorResponse
+from app.utils.json_response import FastJSONResponse
+from app.utils.metrics import Counter, Gauge, Histogram
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_CLASSES = ("read", "write", "heavy")
+# Requests of a class running at once, and waiting for a slot beyond those
+ADMISSION_LIMITS = {
+    "read": (int(os.getenv("ADMISSION_READ_CONCURRENCY", 64)), int(os.getenv("ADMISSION_READ_QUEUE", 256))),
+    "write": (int(os.getenv("ADMISSION_WRITE_CONCURRENCY", 16)), int(os.getenv("ADMISSION_WRITE_QUEUE", 128))),
+    "heavy": (int(os.getenv("ADMISSION_HEAVY_CONCURRENCY", 4)), int(os.getenv("ADMISSION_HEAVY_QUEUE", 64)))
+}
+# Longest a request waits in a queue before it is shed
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+# Seconds a shed client is asked to wait before retrying
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 1))
+
+def _routes(value: str) -> frozenset:
+    return frozenset(route.strip() for route in value.split(",") if route.strip())
+
+# GET route templates in the heavy class; every other GET is a read
+HEAVY_ROUTES = _routes(os.getenv(
+    "ADMISSION_HEAVY_ROUTES", "/balances,/settlements,/balances/export,/settlements/export,/expenses/export"
+))
+# Route templates that are never limited
+EXEMPT_ROUTES = _routes(os.getenv(
+    "ADMISSION_EXEMPT_ROUTES", "/,/metrics,/cache/stats,/db/stats,/admission/stats,/docs,/redoc,/openapi.json"
+))
+READ_METHODS = ("GET", "HEAD")
+
+ADMISSION_QUEUE_DEPTH = Gauge("admission_queue_depth", "Requests waiting for a slot, by class", ("class",))
+ADMISSION_ACTIVE = Gauge("admission_active_requests", "Requests holding a slot, by class", ("class",))
+ADMISSION_SHED = Counter(
+    "admission_shed_total", "Requests rejected with 503, by class and reason (queue_full, timeout)", ("class", "reason")
+)
+ADMISSION_WAIT = Histogram("admission_queue_wait_seconds", "Time admitted requests waited for a slot, by class", ("class",))
+
+class Limiter:
+    """A concurrency limit with a bounded FIFO queue of waiting requests"""
+
+    def __init__(self, name: str, limit: int, queue_size: int):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "timeout": 0}
+
+    async def acquire(self, timeout: float) -> Optional[str]:
+        """Take a slot, waiting up to timeout seconds; returns None when admitted, else why it was shed"""
+        if self.active < self.limit and not self.waiters:
+            self._admit(0.0)
+            return None
+        if len(self.waiters) >= self.queue_size:
+            return self._shed("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        ADMISSION_QUEUE_DEPTH.inc(self.name)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait((waiter,), timeout=timeout)
+        except asyncio.CancelledError:
+            self._leave(waiter)
+            raise
+        if waiter.done():
+            # release() handed its slot over and counted it already
+            self.admitted += 1
+            ADMISSION_WAIT.observe(time.perf_counter() - started, self.name)
+            return None
+        self._leave(waiter)
+        return self._shed("timeout")
+
+    def release(self):
+        """Give up a slot, handing it straight to the longest waiting request if any"""
+        if self.waiters:
+            waiter = self.waiters.popleft()
+            ADMISSION_QUEUE_DEPTH.dec(self.name)
+            waiter.set_result(None)
+        else:
+            self.active -= 1
+            ADMISSION_ACTIVE.dec(self.name)
+
+    def _admit(self, waited: float):
+        self.active += 1
+        self.admitted += 1
+        ADMISSION_ACTIVE.inc(self.name)
+        ADMISSION_WAIT.observe(waited, self.name)
+
+    def _leave(self, waiter: asyncio.Future):
+        """Stop waiting; a slot handed over in the meantime is passed on"""
+        if waiter.done():
+            self.release()
+        else:
+            waiter.cancel()
+            self.waiters.remove(waiter)
+            ADMISSION_QUEUE_DEPTH.dec(self.name)
+
+    def _shed(self, reason: str) -> str:
+        self.shed[reason] += 1
+        ADMISSION_SHED.inc(self.name, reason)
+        return reason
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "shed": dict(self.shed)
+        }
+
+limiters: Dict[str, Limiter] = {
+    name: Limiter(name, limit, queue_size) for name, (limit, queue_size) in ADMISSION_LIMITS.items()
+}
+
+def admission_class(method: str, route: str) -> Optional[str]:
+    """Class of a request to route, or None when it is not limited"""
+    if route in EXEMPT_ROUTES:
+        return None
+    if method not in READ_METHODS:
+        return "write"
+    return "heavy" if route in HEAVY_ROUTES else "read"
+
+def admission_stats() -> dict:
+    """Limits, queue depth and shed counts per class"""
+    return {
+        "enabled": ADMISSION_ENABLED,
+        "queue_timeout_seconds": ADMISSION_QUEUE_TIMEOUT,
+        "classes": {name: limiter.stats() for name, limiter in limiters.items()}
+    }
+
+class AdmissionMiddleware:
+    """Limits concurrent requests per class and sheds the excess with 503 Retry-After"""
+
+    def __init__(self, app, router_app, timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.app = app
+        self.timeout = timeout
+        self._route = RouteResolver(router_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        kind = admission_class(scope["method"], self._route(scope))
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = limiters[kind]
+        reason = await limiter.acquire(self.timeout)
+        if reason is not None:
+            response = FastJSONResponse(
+                ErrorResponse(message="Server busy, retry later", detail=f"{kind} capacity exhausted ({reason})"),
+                status_code=503,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            # Held until the whole response is sent, streamed exports included
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
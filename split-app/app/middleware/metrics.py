@@ -0,0 +1,90 @@
+"""
+Request metrics as a pure ASGI middleware.
+
+Requests are labelled with the route template (/expenses/{expense_id}),
+not the raw path, so label cardinality stays bounded. The route is resolved
+before the request runs so the in-flight gauge can carry it too; routes
+without path parameters are remembered, so the hot read endpoints skip
+route matching after their first request.
+"""
+import time
+
+from starlette.routing import Match
+
+from app.utils.metrics import Counter, Gauge, Histogram
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to send the full response, by route",
+    ("method", "route", "status")
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests currently being handled, by route", ("method", "route")
+)
+HTTP_REQUEST_ERRORS = Counter(
+    "http_request_exceptions_total", "Requests that raised instead of responding, by route", ("method", "route")
+)
+
+UNMATCHED_ROUTE = "unmatched"
+
+def route_template(app, scope) -> str:
+    """Path template of the route that will handle scope"""
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", UNMATCHED_ROUTE)
+        if match == Match.PARTIAL and partial is None:
+            partial = getattr(route, "path", UNMATCHED_ROUTE)
+    return partial or UNMATCHED_ROUTE
+
+class RouteResolver:
+    """Route template for a request scope, remembered for paths without parameters"""
+
+    def __init__(self, router_app):
+        # The FastAPI application, whose routes are matched
+        self.router_app = router_app
+        self._static_routes = {}
+
+    def __call__(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        route = self._static_routes.get(key)
+        if route is None:
+            route = route_template(self.router_app, scope)
+            # Only paths that are their own template; anything else would
+            # grow without bound
+            if route == scope["path"]:
+                self._static_routes[key] = route
+        return route
+
+class MetricsMiddleware:
+    """Records latency histograms and in-flight gauges for every HTTP request"""
+
+    def __init__(self, app, router_app):
+        self.app = app
+        self._route = RouteResolver(router_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route(scope)
+        status = "500"
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            HTTP_REQUEST_ERRORS.inc(method, route)
+            raise
+        finally:
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, method, route, status)
+            HTTP_REQUESTS_IN_FLIGHT.dec(method, route)
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field, validator
-from typing import Dict, List, Optional, Literal
+from pydantic import BaseModel, Field, PlainSerializer, validator
+from typing import Annotated, Dict, List, Optional, Literal
+from datetime import datetime
 from decimal import Decimal
 
 class ExpenseBase(BaseModel):
@@ -82,6 +83,12 @@ class ExpenseUpdate(ExpenseBase):
     split_type: Optional[Literal["equal", "percentage", "exact"]] = None
     participants: Optional[List[str]] = None
     custom_split: Optional[Dict[str, Decimal]] = None
+    version: Optional[int] = Field(
+        None,
+        description="Version of the expense the change is based on (required by PUT /expenses/{id}); "
+                    "the update is rejected with 409 if it has changed since",
+        ge=0
+    )
     
     @validator('description')
     def description_not_empty_if_provided(cls, v):
@@ -99,4 +106,23 @@ class ExpenseInDB(ExpenseBase):
     id: str = Field(..., alias="_id")
     
     class Config:
-        allow_population_by_field_name = True
\ No newline at end of file
+        allow_population_by_field_name = True
+
+# Expense money is kept as Decimal but written to JSON as a number
+MoneyNumber = Annotated[Decimal, PlainSerializer(float, return_type=float, when_used="json")]
+
+class ExpenseOut(BaseModel):
+    """An expense as the API returns it; stored data is trusted, so none of the input validators run"""
+    id: str = Field(..., alias="_id")
+    amount: MoneyNumber
+    description: str
+    paid_by: str
+    split_type: str
+    participants: List[str]
+    custom_split: Dict[str, MoneyNumber] = {}
+    version: int = 0
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    
+    class Config:
+        allow_population_by_field_name = True
@@ -2,6 +2,8 @@ from pydantic import BaseModel
 from typing import Any, Dict, List, Optional
 from decimal import Decimal
 
+from app.models.expense import ExpenseOut
+
 class ResponseBase(BaseModel):
     success: bool
     message: str
@@ -9,6 +11,13 @@ class ResponseBase(BaseModel):
 class DataResponse(ResponseBase):
     data: Any
 
+class ExpenseResponse(ResponseBase):
+    data: ExpenseOut
+
+class ExpensePageResponse(ResponseBase):
+    data: List[ExpenseOut]
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= to fetch the next page; None on the last page
+
 class ErrorResponse(ResponseBase):
     success: bool = False
     detail: Optional[str] = None
@@ -22,4 +31,36 @@ class PersonBalance(BaseModel):
 class Settlement(BaseModel):
     from_person: str
     to_person: str
-    amount: Decimal
\ No newline at end of file
+    amount: Decimal
+
+class PersonCount(BaseModel):
+    name: str
+    count: int  # Expenses the person takes part in
+
+class BalancesResponse(ResponseBase):
+    data: List[PersonBalance]
+
+class PersonBalanceResponse(ResponseBase):
+    data: PersonBalance
+
+class SettlementsResponse(ResponseBase):
+    data: List[Settlement]
+
+class SettlementChange(BaseModel):
+    from_person: str
+    to_person: str
+    previous_amount: Decimal
+    amount: Decimal
+
+class SettlementDiff(BaseModel):
+    added: List[Settlement]
+    removed: List[Settlement]
+    changed: List[SettlementChange]
+    unchanged: int
+    rebuilt: bool  # True when the plan was made from scratch instead of adjusted
+
+class StableSettlementsResponse(SettlementsResponse):
+    diff: SettlementDiff  # Against the plan served before the last write
+
+class PeopleResponse(ResponseBase):
+    data: List[PersonCount]
@@ -1,49 +1,83 @@
-from fastapi import APIRouter, Body, HTTPException, status, Path, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Body, HTTPException, status, Path, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional
 from bson.objectid import ObjectId
 from datetime import datetime
 
 from app.models.expense import ExpenseCreate, ExpenseUpdate, ExpenseInDB
-from app.models.responses import DataResponse, ErrorResponse
-from app.db.database import expense_collection
-from app.services.expense_service import create_expense, get_all_expenses, update_expense, delete_expense
+from app.models.responses import DataResponse, ErrorResponse, ExpensePageResponse, ExpenseResponse
+from app.services.expense_service import (
+    create_expense,
+    get_all_expenses,
+    update_expense,
+    delete_expense,
+    bulk_create_expenses,
+    BULK_CHUNK_SIZE,
+    VersionConflictError
+)
+from app.services.export_service import stream_expenses, EXPORT_MEDIA_TYPES
+from app.utils.json_response import FastJSONResponse
+from app.utils.streaming import iter_json_array, iter_ndjson
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
 
 router = APIRouter()
 
-@router.get("/", response_model=DataResponse)
+@router.get("/", response_model=ExpensePageResponse)
 async def get_expenses(
-    skip: int = Query(0, ge=0),
-    limit: int = Query(10, ge=1, le=100)
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(10, ge=1, le=100),
+    skip: int = Query(0, ge=0, deprecated=True, description="Offset pagination; use cursor instead")
 ):
     """
-    Get all expenses with pagination
+    Get all expenses with cursor pagination, ordered by creation
     """
     try:
-        expenses = await get_all_expenses(skip, limit)
-        return {
+        expenses, next_cursor = await get_all_expenses(skip, limit, cursor)
+        # Stored expenses already have the ExpensePageResponse shape, so they
+        # are encoded as they are instead of being validated again
+        return FastJSONResponse({
             "success": True,
             "data": expenses,
+            "next_cursor": next_cursor,
             "message": f"Retrieved {len(expenses)} expenses"
-        }
+        })
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to retrieve expenses: {str(e)}"
         )
 
-@router.post("/", response_model=DataResponse, status_code=status.HTTP_201_CREATED)
+@router.get("/export")
+async def export_expenses(
+    format: str = Query("csv", pattern="^(csv|ndjson)$", description="csv or ndjson")
+):
+    """
+    Stream every expense as CSV or NDJSON
+    """
+    return StreamingResponse(
+        stream_expenses(format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=expenses.{format}"}
+    )
+
+@router.post("/", response_model=ExpenseResponse, status_code=status.HTTP_201_CREATED)
 async def add_expense(expense: ExpenseCreate):
     """
     Add a new expense
     """
     try:
         created_expense = await create_expense(expense)
-        return {
+        return FastJSONResponse({
             "success": True,
             "data": created_expense,
             "message": "Expense added successfully"
-        }
+        }, status_code=status.HTTP_201_CREATED)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -55,13 +89,46 @@ async def add_expense(expense: ExpenseCreate):
             detail=f"Failed to add expense: {str(e)}"
         )
 
-@router.put("/{expense_id}", response_model=DataResponse)
+@router.post("/bulk", response_model=DataResponse)
+async def add_expenses_bulk(
+    request: Request,
+    chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=10000, description="Rows per insert_many call")
+):
+    """
+    Add many expenses at once from a JSON array or a streamed NDJSON body
+    (Content-Type: application/x-ndjson). Invalid rows are reported individually
+    and do not stop the rest of the upload.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    parse = iter_ndjson if content_type in NDJSON_CONTENT_TYPES else iter_json_array
+    
+    try:
+        result = await bulk_create_expenses(parse(request.stream()), chunk_size)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to import expenses: {str(e)}"
+        )
+    
+    message = f"Imported {result['inserted']} expenses, {result['failed']} rows failed"
+    if result["aborted"]:
+        message += f"; upload stopped early: {result['aborted']}"
+    
+    return {
+        "success": result["failed"] == 0 and not result["aborted"],
+        "data": result,
+        "message": message
+    }
+
+@router.put("/{expense_id}", response_model=ExpenseResponse)
 async def update_expense_by_id(
     expense_id: str = Path(..., title="The ID of the expense to update"),
     expense_update: ExpenseUpdate = Body(...)
 ):
     """
-    Update an existing expense by ID
+    Update an existing expense by ID. The body must carry the version of the
+    expense the edit is based on, so an edit made concurrently is reported
+    with 409 instead of being overwritten; without it the update is a 428.
     """
     try:
         # Validate ObjectId
@@ -70,6 +137,12 @@ async def update_expense_by_id(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid expense ID format"
             )
+        
+        if expense_update.version is None:
+            raise HTTPException(
+                status_code=status.HTTP_428_PRECONDITION_REQUIRED,
+                detail="Send the version of the expense being edited, as returned when it was read"
+            )
             
         updated_expense = await update_expense(expense_id, expense_update)
         if not updated_expense:
@@ -78,13 +151,18 @@ async def update_expense_by_id(
                 detail=f"Expense with ID {expense_id} not found"
             )
             
-        return {
+        return FastJSONResponse({
             "success": True,
             "data": updated_expense,
             "message": "Expense updated successfully"
-        }
+        })
     except HTTPException as e:
         raise e
+    except VersionConflictError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -1,22 +1,32 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Header, Response
+from typing import Optional
 
-from app.models.responses import DataResponse
-from app.services.expense_service import get_all_people_from_expenses
+from app.models.responses import PeopleResponse
+from app.services.cache_service import result_cache, make_etag, etag_matches
+from app.services.people_service import get_all_people
+from app.utils.json_response import FastJSONResponse
 
 router = APIRouter()
 
-@router.get("/", response_model=DataResponse)
-async def get_people():
+@router.get("/", response_model=PeopleResponse)
+async def get_people(
+    if_none_match: Optional[str] = Header(None)
+):
     """
     Get all people who have been mentioned in expenses
     """
     try:
-        people = await get_all_people_from_expenses()
-        return {
+        etag = await make_etag("people")
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        
+        people = await result_cache.get_or_compute("people", None, get_all_people)
+        # Registry rows are already {name, count}; encoded without revalidation
+        return FastJSONResponse({
             "success": True,
             "data": people,
             "message": f"Retrieved {len(people)} people"
-        }
+        }, headers={"ETag": etag})
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,46 +1,258 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List
+from fastapi import APIRouter, HTTPException, status, Query, Header, Response
+from fastapi.responses import StreamingResponse
+from datetime import date, datetime
+from typing import List, Optional, Union
 
-from app.models.responses import DataResponse, PersonBalance, Settlement
+from app.models.responses import (
+    BalancesResponse, PersonBalanceResponse, SettlementsResponse, StableSettlementsResponse
+)
+from app.services.cache_service import result_cache, make_etag, etag_matches
+from app.services.export_service import (
+    stream_models,
+    EXPORT_MEDIA_TYPES,
+    BALANCE_EXPORT_FIELDS,
+    SETTLEMENT_EXPORT_FIELDS
+)
+from app.services.history_service import as_of_moment
 from app.services.settlement_service import (
     calculate_balances, 
-    calculate_simplified_settlements
+    calculate_simplified_settlements,
+    calculate_person_balance,
+    calculate_person_settlements,
+    calculate_stable_settlements
 )
+from app.utils.json_response import FastJSONResponse
 
 router = APIRouter()
 
-@router.get("/balances", response_model=DataResponse)
-async def get_balances():
+@router.get("/balances/export")
+async def export_balances(
+    format: str = Query("csv", pattern="^(csv|ndjson)$", description="csv or ndjson"),
+    as_of: Optional[Union[datetime, date]] = Query(
+        None, description="Point in time (ISO 8601, UTC unless an offset is given); a date means the end of that day"
+    ),
+):
     """
-    Get the balance of each person (total paid, total share, net balance)
+    Download every person's balance as CSV or NDJSON
     """
+    as_of = as_of_moment(as_of) if as_of else None
     try:
-        balances = await calculate_balances()
-        return {
-            "success": True,
-            "data": balances,
-            "message": f"Retrieved balances for {len(balances)} people"
-        }
+        balances = await result_cache.get_or_compute(
+            "balances", (None, as_of), lambda: calculate_balances(as_of=as_of)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to calculate balances: {str(e)}"
         )
+    
+    return StreamingResponse(
+        stream_models(balances, BALANCE_EXPORT_FIELDS, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=balances.{format}"}
+    )
 
-@router.get("/settlements", response_model=DataResponse)
-async def get_settlements():
+@router.get("/settlements/export")
+async def export_settlements(
+    format: str = Query("csv", pattern="^(csv|ndjson)$", description="csv or ndjson"),
+    mode: str = Query(
+        "greedy",
+        description="Settlement mode: greedy, exact, or stable for this process's last plan adjusted to the "
+                    "current balances"
+    ),
+    as_of: Optional[Union[datetime, date]] = Query(
+        None, description="Point in time (ISO 8601, UTC unless an offset is given); a date means the end of that day"
+    ),
+):
     """
-    Get optimized settlement transactions
+    Download the settlement plan as CSV or NDJSON. A stable plan is the one
+    this process keeps, as for GET /settlements?mode=stable
     """
+    as_of = as_of_moment(as_of) if as_of else None
     try:
-        settlements = await calculate_simplified_settlements()
-        return {
-            "success": True,
-            "data": settlements,
-            "message": f"Generated {len(settlements)} settlement transactions"
-        }
+        settlements = await result_cache.get_or_compute(
+            "settlements", (mode, as_of), lambda: calculate_simplified_settlements(mode, as_of)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to calculate settlements: {str(e)}"
-        )
\ No newline at end of file
+        )
+    
+    return StreamingResponse(
+        stream_models(settlements, SETTLEMENT_EXPORT_FIELDS, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=settlements.{format}"}
+    )
+
+@router.get("/balances", response_model=BalancesResponse)
+async def get_balances(
+    engine: Optional[str] = Query(None, description="Balance engine: ledger, aggregate, python or columnar"),
+    as_of: Optional[Union[datetime, date]] = Query(
+        None, description="Point in time (ISO 8601, UTC unless an offset is given); a date means the end of that day"
+    ),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get the balance of each person (total paid, total share, net balance),
+    now or as of a past moment
+    """
+    as_of = as_of_moment(as_of) if as_of else None
+    try:
+        etag = await make_etag("balances", (engine, as_of))
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        
+        balances = await result_cache.get_or_compute(
+            "balances", (engine, as_of), lambda: calculate_balances(engine, as_of)
+        )
+        return FastJSONResponse(BalancesResponse(
+            success=True,
+            data=balances,
+            message=f"Retrieved balances for {len(balances)} people"
+        ), headers={"ETag": etag})
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to calculate balances: {str(e)}"
+        )
+
+@router.get("/settlements", response_model=SettlementsResponse)
+async def get_settlements(
+    mode: str = Query(
+        "greedy",
+        description="Settlement mode: greedy, exact for the true minimum on small groups, "
+                    "or stable to adjust the previous plan and get a diff against it (plans are kept per process)"
+    ),
+    as_of: Optional[Union[datetime, date]] = Query(
+        None, description="Point in time (ISO 8601, UTC unless an offset is given); a date means the end of that day"
+    ),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get optimized settlement transactions, now or as of a past moment.
+    In stable mode the response also has a diff from the previous plan.
+    That plan is kept in this process's memory, so behind a load balancer
+    each replica adjusts its own plan: replicas can return different plans
+    (each settles the same balances) and a diff is only meaningful against
+    the last plan from the same replica.
+    """
+    as_of = as_of_moment(as_of) if as_of else None
+    try:
+        etag = await make_etag("settlements", (mode, as_of))
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        
+        if mode == "stable" and as_of is None:
+            settlements, diff = await result_cache.get_or_compute(
+                "settlements_stable", None, calculate_stable_settlements
+            )
+            return FastJSONResponse(StableSettlementsResponse(
+                success=True,
+                data=settlements,
+                diff=diff,
+                message=f"Generated {len(settlements)} settlement transactions"
+            ), headers={"ETag": etag})
+        
+        settlements = await result_cache.get_or_compute(
+            "settlements", (mode, as_of), lambda: calculate_simplified_settlements(mode, as_of)
+        )
+        return FastJSONResponse(SettlementsResponse(
+            success=True,
+            data=settlements,
+            message=f"Generated {len(settlements)} settlement transactions"
+        ), headers={"ETag": etag})
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to calculate settlements: {str(e)}"
+        )
+
+# Declared after the export routes so /balances/export is not taken for a name
+
+@router.get("/balances/{name}", response_model=PersonBalanceResponse)
+async def get_person_balance(
+    name: str,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get one person's total paid, total share and net balance, computed from
+    only the expenses they paid for or take part in
+    """
+    try:
+        etag = await make_etag("balance", name)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        
+        balance = await result_cache.get_or_compute(
+            "balance", name, lambda: calculate_person_balance(name)
+        )
+        if balance is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"{name} takes part in no expense"
+            )
+        
+        return FastJSONResponse(PersonBalanceResponse(
+            success=True,
+            data=balance,
+            message=f"Retrieved balance for {name}"
+        ), headers={"ETag": etag})
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to calculate balance: {str(e)}"
+        )
+
+@router.get("/settlements/{name}", response_model=SettlementsResponse)
+async def get_person_settlements(
+    name: str,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get what each person owes this person and what they owe each person,
+    netted over the expenses they share
+    """
+    try:
+        etag = await make_etag("person-settlements", name)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        
+        settlements = await result_cache.get_or_compute(
+            "person-settlements", name, lambda: calculate_person_settlements(name)
+        )
+        if settlements is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"{name} takes part in no expense"
+            )
+        
+        return FastJSONResponse(SettlementsResponse(
+            success=True,
+            data=settlements,
+            message=f"Found {len(settlements)} open debts for {name}"
+        ), headers={"ETag": etag})
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to calculate settlements: {str(e)}"
+        )
@@ -0,0 +1,211 @@
+"""
+Computed results (balances, settlements, people) cached under a data version.
+
+Every expense write advances the shared data version the repository keeps
+next to the data (a counter document on MongoDB, a row on SQLite), so all
+API processes on the same storage agree on it. Before answering from the
+cache or with an ETag, a request reads the shared version
+(sync_data_version); a write made through any other process therefore
+invalidates this process's results too. DATA_VERSION_MAX_AGE_MS > 0 trusts a
+version read that recently instead of reading it on every request, trading
+up to that much staleness across processes for one round trip less.
+
+ETags are made from the shared version only, so any replica can answer an
+If-None-Match with 304. Changes this process picks up by itself (the
+change-stream fed expense state) invalidate its cached results but not its
+ETags; every write through the API advances the shared version anyway.
+"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from app.db.repository import get_repository
+from app.utils.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of computed results kept in memory
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 128))
+# How long (ms) a shared data version read from storage is trusted; 0 reads it on every request
+DATA_VERSION_MAX_AGE_MS = float(os.getenv("DATA_VERSION_MAX_AGE_MS", 0))
+
+# Process-local version that cached results are keyed by; moves on whenever
+# the shared version does or this process's expense state changes
+_data_version = 0
+# Shared (epoch, write count) as last read from or advanced in storage
+_shared_version: Tuple[str, int] = ("", 0)
+# When the shared version was last read, and by which request
+_synced_at = float("-inf")
+_synced_by: Optional[asyncio.Task] = None
+
+CACHE_LOOKUPS = Counter(
+    "result_cache_lookups_total",
+    "Result cache lookups: hit, miss (computed) or coalesced (joined a computation in flight)",
+    ("outcome",)
+)
+CACHE_COALESCING_RATIO = Gauge(
+    "result_cache_coalescing_ratio", "Share of cache misses that joined a computation already in flight"
+)
+
+def get_data_version() -> int:
+    """Current data version of this process; only ever grows"""
+    return _data_version
+
+def _new_version():
+    global _data_version
+    _data_version += 1
+    result_cache.discard_older_than(_data_version)
+
+def _observe(shared: Tuple[str, int]):
+    """Move to a shared version read from or written to storage, unless an even newer one is known"""
+    global _shared_version
+    epoch, count = shared
+    if epoch == _shared_version[0] and count <= _shared_version[1]:
+        return
+    _shared_version = shared
+    _new_version()
+
+async def sync_data_version():
+    """Catch up with writes made through other processes; reads storage at most once per request"""
+    global _synced_at, _synced_by
+    task = asyncio.current_task()
+    if task is _synced_by or time.monotonic() - _synced_at < DATA_VERSION_MAX_AGE_MS / 1000:
+        return
+    shared = await get_repository().read_data_version()
+    _synced_at, _synced_by = time.monotonic(), task
+    _observe(shared)
+
+async def advance_data_version() -> int:
+    """Count a write in the shared version, invalidating cached results and ETags in every process"""
+    _observe(await get_repository().advance_data_version())
+    return _data_version
+
+def bump_data_version() -> int:
+    """Invalidate this process's cached results only, e.g. after its expense state changed"""
+    _new_version()
+    return _data_version
+
+class _Flight:
+    """One computation in progress and the number of callers waiting for it"""
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+class ResultCache:
+    """
+    Bounded LRU cache of computed results keyed by (name, params, data version).
+
+    Misses are single-flight: concurrent callers for the same key share one
+    computation and its result instead of each starting their own. A caller
+    that is cancelled stops waiting without cancelling the computation for
+    the others; the computation is cancelled only when no caller is left.
+    Failures reach every waiting caller and are not cached, so the next call
+    computes again.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self.inflight: Dict[Tuple, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_compute(self, name: str, params: Hashable, compute: Callable[[], Awaitable[Any]]):
+        """Return the cached result for the current data version, computing it on a miss"""
+        await sync_data_version()
+        key = (name, params, _data_version)
+        if key in self.entries:
+            self.hits += 1
+            CACHE_LOOKUPS.inc("hit")
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        flight = self.inflight.get(key)
+        if flight is None:
+            self.misses += 1
+            CACHE_LOOKUPS.inc("miss")
+            flight = self.inflight[key] = _Flight(asyncio.ensure_future(self._compute(key, compute)))
+            flight.task.add_done_callback(lambda _: self._land(key, flight))
+        else:
+            self.coalesced += 1
+            CACHE_LOOKUPS.inc("coalesced")
+        CACHE_COALESCING_RATIO.set(self.coalescing_ratio())
+
+        flight.waiters += 1
+        try:
+            # shield: cancelling this caller must not cancel the shared task
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody wants the result any more; later callers start afresh
+                self._land(key, flight)
+                flight.task.cancel()
+
+    def _land(self, key: Tuple, flight: _Flight):
+        """Forget a finished or abandoned computation, unless a newer one took its key"""
+        if self.inflight.get(key) is flight:
+            del self.inflight[key]
+
+    async def _compute(self, key: Tuple, compute: Callable[[], Awaitable[Any]]):
+        value = await compute()
+        # A write during the computation makes the result stale on arrival
+        if key[2] == _data_version:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def discard_older_than(self, version: int):
+        """Drop results computed for earlier data versions"""
+        for key in [key for key in self.entries if key[2] < version]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+    def coalescing_ratio(self) -> float:
+        """Share of cache misses that joined a computation already in flight"""
+        waited = self.misses + self.coalesced
+        return round(self.coalesced / waited, 4) if waited else 0.0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "data_version": _data_version,
+            "shared_data_version": _version_tag(),
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "in_flight": len(self.inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "coalescing_ratio": self.coalescing_ratio()
+        }
+
+result_cache = ResultCache(RESPONSE_CACHE_SIZE)
+
+def _version_tag() -> str:
+    epoch, count = _shared_version
+    return f"{epoch}.{count}"
+
+async def make_etag(name: str, params: Hashable = None) -> str:
+    """Strong ETag for a result at the current shared data version"""
+    await sync_data_version()
+    digest = hashlib.sha1(repr((name, params)).encode()).hexdigest()[:12]
+    return f'"{name}-{_version_tag()}-{digest}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
@@ -0,0 +1,242 @@
+"""
+Columnar balance engine for very large expense collections.
+
+Expenses are loaded into flat arrays instead of a list of dicts: person
+names are interned to integer ids, and the people on each expense (with
+their split values) are stored CSR-style, as one long array plus per-expense
+offsets. Shares are then computed for all expenses at once with NumPy on
+integer minor units, using the same flooring and residue rules as
+codec.split_shares_minor, so totals match the other engines exactly.
+
+NumPy is optional; without it the "columnar" engine is simply not offered.
+"""
+from array import array
+from typing import Dict, Iterable, List
+import os
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+from app.db.codec import split_shares_minor, stored_amount_minor, to_decimal
+from app.db.repository import get_repository
+from app.services.ledger_service import Totals
+from app.utils.offload import run_cpu
+
+COLUMNAR_AVAILABLE = np is not None
+
+# Percentages are held as integers scaled by 10**PERCENT_DECIMALS; values with
+# more digits fall back to precomputed shares
+PERCENT_DECIMALS = 6
+_PERCENT_SCALE = 10 ** PERCENT_DECIMALS
+_PERCENT_DIVISOR = 100 * _PERCENT_SCALE
+_INT64_MAX = 2 ** 63 - 1
+
+# Expenses per vectorized block; bounds the temporary arrays of a computation
+COLUMNAR_BLOCK_SIZE = int(os.getenv("COLUMNAR_BLOCK_SIZE", 8192))
+
+# Split kinds in the columnar layout
+EQUAL, PERCENTAGE, FIXED = 0, 1, 2
+
+_FIELDS = ["amount", "paid_by", "split_type", "participants", "custom_split"]
+
+class ExpenseColumns:
+    """
+    Expenses as columns:
+      amount[i], payer[i], kind[i]                 one entry per expense
+      participant_ids[participant_offsets[i]:...]  the participants of expense i
+      split_ids / split_values[split_offsets[i]:...]
+                                                   percentage (scaled) or fixed
+                                                   minor-unit shares of expense i
+    """
+
+    def __init__(self):
+        self.names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self.amount = array("q")
+        self.payer = array("i")
+        self.kind = array("b")
+        self.participant_ids = array("i")
+        self.participant_offsets = array("q", [0])
+        self.split_ids = array("i")
+        self.split_values = array("q")
+        self.split_offsets = array("q", [0])
+
+    def __len__(self):
+        return len(self.amount)
+
+    def person_id(self, name: str) -> int:
+        """Intern a person name"""
+        person = self._ids.get(name)
+        if person is None:
+            person = self._ids[name] = len(self.names)
+            self.names.append(name)
+        return person
+
+    def append(self, document: dict):
+        """Add one stored expense document"""
+        amount = stored_amount_minor(document)
+        split_type = document["split_type"]
+        custom_split = document.get("custom_split") or {}
+
+        self.amount.append(amount)
+        self.payer.append(self.person_id(document["paid_by"]))
+        for person in document["participants"]:
+            self.participant_ids.append(self.person_id(person))
+        self.participant_offsets.append(len(self.participant_ids))
+
+        if split_type == "equal":
+            self.kind.append(EQUAL)
+        elif split_type == "percentage" and self._append_percentages(amount, custom_split):
+            self.kind.append(PERCENTAGE)
+        else:
+            # Exact splits, and percentages that do not fit the scaled
+            # integers, are stored as their final minor-unit shares
+            self.kind.append(FIXED)
+            for person, share in split_shares_minor(document).items():
+                self.split_ids.append(self.person_id(person))
+                self.split_values.append(share)
+        self.split_offsets.append(len(self.split_ids))
+
+    def _append_percentages(self, amount: int, custom_split: dict) -> bool:
+        """Store scaled percentages, or return False if they need the exact Decimal path"""
+        scaled = []
+        for person, value in custom_split.items():
+            percentage = to_decimal(value).scaleb(PERCENT_DECIMALS)
+            if percentage != percentage.to_integral_value():
+                return False
+            scaled.append((person, int(percentage)))
+
+        largest = max((abs(value) for _, value in scaled), default=0)
+        if abs(amount) * largest > _INT64_MAX:
+            return False
+
+        for person, value in scaled:
+            self.split_ids.append(self.person_id(person))
+            self.split_values.append(value)
+        return True
+
+def load_columns(documents: Iterable[dict]) -> ExpenseColumns:
+    """Build the columnar layout from expense documents"""
+    columns = ExpenseColumns()
+    for document in documents:
+        columns.append(document)
+    return columns
+
+def _as_numpy(values: array, dtype):
+    return np.frombuffer(values, dtype=dtype) if len(values) else np.zeros(0, dtype=dtype)
+
+def _row_index(offsets):
+    """For each CSR entry, the expense it belongs to and its position within that expense"""
+    counts = np.diff(offsets)
+    rows = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+    positions = np.arange(offsets[-1], dtype=np.int64) - offsets[:-1][rows]
+    return rows, positions, counts
+
+def _spread_residue(residue, counts, rows, positions):
+    """Vector form of codec.distribute_residue: per-entry extra minor units"""
+    n = np.maximum(counts, 1)
+    base = residue // n
+    extra = residue - base * n
+    return base[rows] + (positions < extra[rows])
+
+def _csr_block(offsets, start: int, end: int):
+    """Slice of the CSR entries of expenses start..end, and their offsets rebased to 0"""
+    block_offsets = offsets[start:end + 1]
+    return slice(block_offsets[0], block_offsets[-1]), block_offsets - block_offsets[0]
+
+def _add_block(columns: dict, start: int, end: int, people: int, total_share, expense_count):
+    """Accumulate the shares and expense counts of expenses start..end"""
+    amount = columns["amount"][start:end]
+    payer = columns["payer"][start:end]
+    kind = columns["kind"][start:end]
+
+    # Equal split over participants
+    entries, participant_offsets = _csr_block(columns["participant_offsets"], start, end)
+    participant_ids = columns["participant_ids"][entries]
+    rows, positions, counts = _row_index(participant_offsets)
+    is_equal = kind[rows] == EQUAL
+    equal_share = _spread_residue(amount, counts, rows, positions)
+    np.add.at(total_share, participant_ids[is_equal], equal_share[is_equal])
+
+    # Percentage splits are floored with the residue spread in key order;
+    # fixed splits are already final shares
+    entries, split_offsets = _csr_block(columns["split_offsets"], start, end)
+    split_ids = columns["split_ids"][entries]
+    split_values = columns["split_values"][entries]
+    split_rows, split_positions, split_counts = _row_index(split_offsets)
+    is_percentage = kind[split_rows] == PERCENTAGE
+    floors = np.where(is_percentage, (amount[split_rows] * split_values) // _PERCENT_DIVISOR, 0)
+    floored_sum = np.zeros(len(amount), dtype=np.int64)
+    np.add.at(floored_sum, split_rows, floors)
+    residue = np.where(kind == PERCENTAGE, amount - floored_sum, 0)
+    percentage_share = floors + _spread_residue(residue, split_counts, split_rows, split_positions)
+    np.add.at(total_share, split_ids, np.where(is_percentage, percentage_share, split_values))
+
+    # Expense count: distinct (expense, person) pairs over payer, participants and split
+    pairs = np.unique(np.concatenate([
+        np.arange(len(amount), dtype=np.int64) * people + payer,
+        rows * people + participant_ids,
+        split_rows * people + split_ids
+    ]))
+    expense_count += np.bincount(pairs % people, minlength=people)
+
+def compute_totals_columnar(columns: ExpenseColumns, block_size: int = COLUMNAR_BLOCK_SIZE) -> Totals:
+    """
+    Per-person totals in minor units, computed with batched NumPy operations.
+    Expenses are processed block_size at a time so temporary arrays stay small
+    next to the columns themselves.
+    """
+    if not COLUMNAR_AVAILABLE:
+        raise RuntimeError("The columnar balance engine requires numpy")
+
+    people = len(columns.names)
+    if not len(columns):
+        return {}
+
+    arrays = {
+        "amount": _as_numpy(columns.amount, np.int64),
+        "payer": _as_numpy(columns.payer, np.int32),
+        "kind": _as_numpy(columns.kind, np.int8),
+        "participant_ids": _as_numpy(columns.participant_ids, np.int32),
+        "participant_offsets": _as_numpy(columns.participant_offsets, np.int64),
+        "split_ids": _as_numpy(columns.split_ids, np.int32),
+        "split_values": _as_numpy(columns.split_values, np.int64),
+        "split_offsets": _as_numpy(columns.split_offsets, np.int64)
+    }
+
+    total_paid = np.zeros(people, dtype=np.int64)
+    total_share = np.zeros(people, dtype=np.int64)
+    expense_count = np.zeros(people, dtype=np.int64)
+    np.add.at(total_paid, arrays["payer"], arrays["amount"])
+
+    for start in range(0, len(columns), block_size):
+        _add_block(arrays, start, min(start + block_size, len(columns)), people, total_share, expense_count)
+
+    return {
+        name: {
+            "total_paid": int(total_paid[person]),
+            "total_share": int(total_share[person]),
+            "expense_count": int(expense_count[person])
+        }
+        for person, name in enumerate(columns.names)
+        if expense_count[person] > 0
+    }
+
+async def load_columns_from_db() -> ExpenseColumns:
+    """Load expenses into columns, reading only the fields balances need from storage"""
+    columns = ExpenseColumns()
+    async for document in get_repository().scan_expenses(_FIELDS):
+        columns.append(document)
+    return columns
+
+async def compute_totals_from_columns() -> Totals:
+    """Columnar equivalent of ledger_service.compute_totals_from_expenses"""
+    if not COLUMNAR_AVAILABLE:
+        raise ValueError(
+            "The columnar balance engine requires numpy, which is not installed "
+            "(pip install -r requirements-columnar.txt)"
+        )
+    columns = await load_columns_from_db()
+    return await run_cpu(compute_totals_columnar, columns, size=len(columns))
@@ -1,41 +1,106 @@
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Optional
 from bson.objectid import ObjectId
+from datetime import datetime
 from decimal import Decimal
+import base64
+import logging
+import os
 
-from app.db.database import get_expense_collection
+from pydantic import ValidationError
+
+from app.db.codec import encode_fields, decode_expense, split_evenly
+from app.db.repository import get_repository
 from app.models.expense import ExpenseCreate, ExpenseUpdate
-from app.utils.helpers import convert_decimal_to_float
+from app.services.cache_service import advance_data_version
+from app.services.history_service import journal_changes
+from app.services.write_batcher import WRITE_BATCH_ENABLED, WriteBatcher
+
+logger = logging.getLogger(__name__)
+
+# Rows per insert_many call for bulk uploads
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 500))
+# Per-row errors reported back for a single bulk upload
+BULK_MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", 1000))
+
+class VersionConflictError(Exception):
+    """Raised when an update was based on a version of the expense that is no longer current"""
+    
+    def __init__(self, expense_id: str, expected_version: int, current_version: Optional[int] = None):
+        self.expense_id = expense_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+        detail = f"Expense {expense_id} was modified concurrently (expected version {expected_version}"
+        if current_version is not None:
+            detail += f", found {current_version}"
+        super().__init__(detail + ")")
+
+async def _record_changes(changes: List[tuple]):
+    """
+    Move the balance ledger and people registry from old to new versions of
+    expenses, and journal the changes for point-in-time balances
+    """
+    await get_repository().record_changes(changes)
+    await journal_changes(changes)
+    # Shared by every API process, so none of them keeps serving the old results
+    await advance_data_version()
 
-async def get_all_expenses(skip: int = 0, limit: int = 10):
-    """Get all expenses with pagination"""
-    expense_collection = await get_expense_collection()
-    cursor = expense_collection.find().skip(skip).limit(limit)
-    expenses = []
+async def _record_inserted(inserted: List[dict]):
+    """
+    Record newly stored expenses like _record_changes, but log a failure
+    instead of raising it: the expenses are stored either way, and a client
+    told its create failed would retry and store it twice.
+    """
+    try:
+        await _record_changes([(None, doc) for doc in inserted])
+    except Exception:
+        ids = ", ".join(str(doc["_id"]) for doc in inserted)
+        logger.exception(
+            f"Stored expenses {ids} but could not record them; "
+            "run 'ledger rebuild', 'people reconcile' and 'history rebuild' to repair"
+        )
+
+def encode_cursor(expense_id: ObjectId) -> str:
+    """Opaque page cursor for the position after expense_id"""
+    return base64.urlsafe_b64encode(expense_id.binary).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> ObjectId:
+    """Read a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return ObjectId(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+async def get_all_expenses(skip: int = 0, limit: int = 10, cursor: Optional[str] = None):
+    """
+    Get a page of expenses ordered by _id, plus the cursor for the next page
+    (None on the last page). Pages continue from the cursor with an _id range
+    on the _id index, so every page costs the same however deep it is.
+    skip is only kept for older clients and gets slower the deeper it goes.
+    """
+    repository = get_repository()
+    after = str(decode_cursor(cursor)) if cursor else None
+    
+    # Fetch one extra row to find out whether there is a next page
+    expenses = await repository.list_expenses(after, 0 if cursor else skip, limit + 1)
     
-    async for document in cursor:
-        document["_id"] = str(document["_id"])
-        expenses.append(document)
+    next_cursor = None
+    if len(expenses) > limit:
+        expenses = expenses[:limit]
+        next_cursor = encode_cursor(ObjectId(expenses[-1]["_id"]))
     
-    return expenses
+    return [decode_expense(document) for document in expenses], next_cursor
 
 async def get_expense_by_id(expense_id: str):
     """Get a single expense by ID"""
-    expense_collection = await get_expense_collection()
-    
     if not ObjectId.is_valid(expense_id):
         return None
-        
-    document = await expense_collection.find_one({"_id": ObjectId(expense_id)})
-    if document:
-        document["_id"] = str(document["_id"])
-        return document
     
-    return None
+    document = await get_repository().get_expense(expense_id)
+    return decode_expense(document) if document else None
 
-async def create_expense(expense: ExpenseCreate):
-    """Create a new expense"""
-    expense_collection = await get_expense_collection()
-    
+def _prepare_new_expense(expense: ExpenseCreate) -> dict:
+    """Turn a validated ExpenseCreate into the document that gets stored"""
     # Convert Pydantic model to dict
     expense_dict = expense.dict()
     
@@ -53,98 +118,186 @@ async def create_expense(expense: ExpenseCreate):
             percentage = Decimal(100) / Decimal(len(expense_dict["participants"]))
             expense_dict["custom_split"] = {p: percentage for p in expense_dict["participants"]}
         else:  # exact
-            # Equal amount for all participants
-            share = expense_dict["amount"] / Decimal(len(expense_dict["participants"]))
-            expense_dict["custom_split"] = {p: share for p in expense_dict["participants"]}
+            # Equal amount for all participants, in whole minor units
+            expense_dict["custom_split"] = split_evenly(expense_dict["amount"], expense_dict["participants"])
+    
+    # Money is stored as integer minor units and Decimal128, never floats
+    expense_dict = encode_fields(expense_dict)
+    expense_dict["created_at"] = expense_dict["updated_at"] = datetime.utcnow()
+    expense_dict["version"] = 1
+    
+    return expense_dict
+
+async def _insert_batch(documents: List[dict]):
+    """Group-commit target: one insert_many and one ledger update for the whole batch"""
+    inserted, errors = await get_repository().insert_expenses(documents)
+    if inserted:
+        await _record_inserted(inserted)
+    return inserted, errors
+
+# Batches concurrent single creates when WRITE_BATCH_ENABLED
+write_batcher = WriteBatcher(_insert_batch)
+
+async def create_expense(expense: ExpenseCreate):
+    """Create a new expense"""
+    expense_dict = _prepare_new_expense(expense)
+    if WRITE_BATCH_ENABLED:
+        # Returns once the batch it joined is stored and on the ledger
+        created_expense = await write_batcher.insert(expense_dict)
+        return decode_expense(created_expense)
     
-    # Convert Decimal to float for MongoDB compatibility
-    expense_dict = convert_decimal_to_float(expense_dict)
+    created_expense = await get_repository().insert_expense(expense_dict)
     
-    # Insert new expense
-    result = await expense_collection.insert_one(expense_dict)
+    # Keep the balance ledger and people registry in step with the new expense
+    await _record_inserted([created_expense])
     
-    # Return the newly created expense with its ID
-    created_expense = await expense_collection.find_one({"_id": result.inserted_id})
-    created_expense["_id"] = str(created_expense["_id"])
+    return decode_expense(created_expense)
+
+def _validation_message(error: ValidationError) -> str:
+    """Flatten a pydantic ValidationError into one line"""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" if err.get("loc") else err["msg"]
+        for err in error.errors()
+    )
+
+async def _insert_chunk(documents: List[dict], row_indexes: List[int], result: dict):
+    """Insert one chunk of prepared expenses, recording per-row failures in result"""
+    inserted, errors = await get_repository().insert_expenses(documents)
+    for position, message in errors:
+        _record_bulk_error(result, row_indexes[position], message)
+    result["inserted"] += len(inserted)
+    
+    if inserted:
+        await _record_changes([(None, doc) for doc in inserted])
+
+def _record_bulk_error(result: dict, row: int, message: str):
+    result["failed"] += 1
+    if len(result["errors"]) < BULK_MAX_ERRORS:
+        result["errors"].append({"row": row, "error": message})
+    else:
+        result["errors_truncated"] = True
+
+async def bulk_create_expenses(rows: AsyncIterator, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """
+    Validate and insert expenses from an async iterator of (row_index, row) pairs.
+    A row may be an exception when it could not be parsed. Rows are written with
+    unordered insert_many in chunks of chunk_size, so only one chunk is held in
+    memory and a bad row never aborts the rest of the upload.
+    """
+    result = {"inserted": 0, "failed": 0, "errors": [], "errors_truncated": False, "aborted": None}
+    documents: List[dict] = []
+    row_indexes: List[int] = []
+    
+    try:
+        async for row_index, row in rows:
+            if isinstance(row, Exception):
+                _record_bulk_error(result, row_index, str(row))
+                continue
+            if not isinstance(row, dict):
+                _record_bulk_error(result, row_index, "Each row must be a JSON object")
+                continue
+            
+            try:
+                documents.append(_prepare_new_expense(ExpenseCreate(**row)))
+                row_indexes.append(row_index)
+            except ValidationError as e:
+                _record_bulk_error(result, row_index, _validation_message(e))
+                continue
+            except (TypeError, ValueError) as e:
+                _record_bulk_error(result, row_index, str(e))
+                continue
+            
+            if len(documents) >= chunk_size:
+                await _insert_chunk(documents, row_indexes, result)
+                documents, row_indexes = [], []
+    except ValueError as e:
+        # The upload itself is malformed and cannot be read any further
+        result["aborted"] = str(e)
+    
+    # Write whatever was validated before the upload ended or broke off
+    if documents:
+        await _insert_chunk(documents, row_indexes, result)
     
-    return created_expense
+    return result
 
 async def update_expense(expense_id: str, expense_update: ExpenseUpdate):
-    """Update an existing expense"""
-    expense_collection = await get_expense_collection()
+    """
+    Update an existing expense in a single find_one_and_update.
+    If expense_update.version is given, the update only applies when the stored
+    version still matches; otherwise VersionConflictError is raised.
+    """
+    repository = get_repository()
     
     if not ObjectId.is_valid(expense_id):
         return None
     
-    # Get the current expense
-    current_expense = await get_expense_by_id(expense_id)
-    if not current_expense:
-        return None
-    
     # Create update dict from non-None fields
     update_data = {k: v for k, v in expense_update.dict().items() if v is not None}
+    expected_version = update_data.pop("version", None)
+    
+    if not update_data:
+        return await get_expense_by_id(expense_id)
     
     # If changing split_type, update custom_split accordingly
     if "split_type" in update_data:
         split_type = update_data["split_type"]
-        participants = update_data.get("participants", current_expense["participants"])
         
         # Reset custom_split based on new split_type
         if split_type == "equal":
             update_data["custom_split"] = {}
         elif split_type in ["percentage", "exact"] and "custom_split" not in update_data:
+            # Default splits depend on the stored participants and amount, so this is
+            # the one case that has to read first. The read version guards the write.
+            current_expense = await get_expense_by_id(expense_id)
+            if not current_expense:
+                return None
+            current_version = current_expense.get("version", 0)
+            if expected_version is not None and expected_version != current_version:
+                raise VersionConflictError(expense_id, expected_version, current_version)
+            expected_version = current_version
+            
+            participants = update_data.get("participants", current_expense["participants"])
             # Use amount from update or from existing expense
-            amount = update_data.get("amount", Decimal(str(current_expense["amount"])))
+            amount = update_data.get("amount", current_expense["amount"])
             
             if split_type == "percentage":
                 # Equal percentage for all participants
                 percentage = Decimal(100) / Decimal(len(participants))
                 update_data["custom_split"] = {p: percentage for p in participants}
             else:  # exact
-                # Equal amount for all participants
-                share = amount / Decimal(len(participants))
-                update_data["custom_split"] = {p: share for p in participants}
-    
-    # Convert Decimal to float for MongoDB compatibility
-    update_data = convert_decimal_to_float(update_data)
-    
-    # Update the expense
-    if update_data:
-        await expense_collection.update_one(
-            {"_id": ObjectId(expense_id)},
-            {"$set": update_data}
-        )
+                # Equal amount for all participants, in whole minor units
+                update_data["custom_split"] = split_evenly(amount, participants)
+    
+    # Money is stored as integer minor units and Decimal128, never floats
+    update_data = encode_fields(update_data)
+    update_data["updated_at"] = datetime.utcnow()
+    
+    # The pre-image is returned so the ledger can take the old version off;
+    # the new version is exactly the pre-image with this update applied
+    previous_expense = await repository.update_expense(expense_id, update_data, expected_version)
+    
+    if not previous_expense:
+        if expected_version is not None and await repository.expense_exists(expense_id):
+            raise VersionConflictError(expense_id, expected_version)
+        return None
     
-    # Return the updated expense
-    return await get_expense_by_id(expense_id)
+    updated_expense = {**previous_expense, **update_data, "version": previous_expense.get("version", 0) + 1}
+    
+    # Move the ledger and registry from the old version of the expense to the new one
+    await _record_changes([(previous_expense, updated_expense)])
+    
+    return decode_expense(updated_expense)
 
 async def delete_expense(expense_id: str):
     """Delete an expense"""
-    expense_collection = await get_expense_collection()
-    
     if not ObjectId.is_valid(expense_id):
         return False
     
-    result = await expense_collection.delete_one({"_id": ObjectId(expense_id)})
-    return result.deleted_count > 0
-
-async def get_all_people_from_expenses():
-    """Extract unique people from all expenses"""
-    expense_collection = await get_expense_collection()
-    
-    pipeline = [
-        # Unwind participants array to get all participants
-        {"$unwind": "$participants"},
-        # Group by participant name and count occurrences
-        {"$group": {"_id": "$participants", "count": {"$sum": 1}}},
-        # Sort by name
-        {"$sort": {"_id": 1}},
-        # Project to desired output format
-        {"$project": {"name": "$_id", "_id": 0, "count": 1}}
-    ]
-    
-    people = []
-    async for person in expense_collection.aggregate(pipeline):
-        people.append(person)
-    
-    return people
\ No newline at end of file
+    # The removed document comes back so its contribution can be taken
+    # off the ledger and registry
+    deleted_expense = await get_repository().delete_expense(expense_id)
+    if not deleted_expense:
+        return False
+    
+    await _record_changes([(deleted_expense, None)])
+    return True
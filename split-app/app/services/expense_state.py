@@ -0,0 +1,216 @@
+"""
+In-memory copy of the expenses collection kept current from a change stream.
+
+The collection is loaded once; after that every insert, update and delete
+from any API replica arrives through a MongoDB change stream and is applied
+here, so readers never rescan the collection. The resume token of the last
+applied change is kept so a dropped stream picks up where it left off.
+
+Standalone servers have no change streams. There the state falls back to
+polling for documents whose updated_at moved past the last poll. updated_at
+is stamped before a write commits, so a poll looks EXPENSE_STATE_POLL_OVERLAP
+seconds further back, and a periodic full comparison with the collection adds,
+replaces and drops whatever the polls still missed.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import asyncio
+import logging
+import os
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.db.database import get_expense_collection
+from app.services.cache_service import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+EXPENSE_STATE_ENABLED = os.getenv("EXPENSE_STATE_ENABLED", "false").lower() == "true"
+# Seconds between polls when change streams are unavailable
+EXPENSE_STATE_POLL_INTERVAL = float(os.getenv("EXPENSE_STATE_POLL_INTERVAL", 2))
+# Seconds before the newest updated_at seen that each poll looks again, for
+# writes that committed after a later-stamped one (batched creates wait out
+# WRITE_BATCH_WINDOW_MS on top)
+EXPENSE_STATE_POLL_OVERLAP = float(os.getenv("EXPENSE_STATE_POLL_OVERLAP", 10))
+# Compare every document with the collection every N polls, to pick up deletes
+# and anything the polls missed
+EXPENSE_STATE_FULL_SYNC_EVERY = int(os.getenv("EXPENSE_STATE_FULL_SYNC_EVERY", 30))
+# Seconds to wait before reopening a change stream after an error
+EXPENSE_STATE_RETRY_DELAY = float(os.getenv("EXPENSE_STATE_RETRY_DELAY", 1))
+
+# Server error codes
+CHANGE_STREAMS_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = 286
+CHANGE_STREAM_FATAL = 280
+
+class ExpenseState:
+    """Expenses held in memory by _id, plus how they are being kept current"""
+
+    def __init__(self):
+        self.expenses: Dict = {}
+        self.warm = False
+        self.mode: Optional[str] = None
+        self.resume_token = None
+        self.last_updated_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the background task that loads and follows the collection"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop following the collection and drop the in-memory copy"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.warm = False
+        self.expenses = {}
+
+    def values(self):
+        """Current expense documents; only meaningful while warm"""
+        return self.expenses.values()
+
+    async def _run(self):
+        try:
+            await self._follow_change_stream()
+        except OperationFailure as e:
+            if e.code != CHANGE_STREAMS_UNSUPPORTED:
+                raise
+            logger.info("Change streams unavailable, polling expenses for changes instead")
+            await self._follow_by_polling()
+
+    async def _load(self):
+        """Read the whole collection into memory"""
+        expense_collection = await get_expense_collection()
+        expenses = {}
+        async for document in expense_collection.find():
+            expenses[document["_id"]] = document
+            self._track_updated_at(document)
+        self.expenses = expenses
+        self.warm = True
+        bump_data_version()
+        logger.info(f"Loaded {len(expenses)} expenses into memory")
+
+    def _track_updated_at(self, document: dict):
+        updated_at = document.get("updated_at")
+        if updated_at and (self.last_updated_at is None or updated_at > self.last_updated_at):
+            self.last_updated_at = updated_at
+
+    def _apply_change(self, change: dict):
+        """Apply a single change stream event"""
+        operation = change["operationType"]
+        if operation in ("insert", "update", "replace"):
+            document = change.get("fullDocument")
+            if document is not None:
+                self.expenses[document["_id"]] = document
+            else:
+                # Deleted again before the post-image could be looked up
+                self.expenses.pop(change["documentKey"]["_id"], None)
+        elif operation == "delete":
+            self.expenses.pop(change["documentKey"]["_id"], None)
+        elif operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            raise _Invalidated(operation)
+        bump_data_version()
+
+    async def _follow_change_stream(self):
+        expense_collection = await get_expense_collection()
+        while True:
+            if self.warm and self.resume_token is None:
+                # Nothing to resume from, so changes since the load could be missed
+                self._reset()
+            try:
+                # Open the stream before loading so no change between the
+                # two is missed; replaying one that the load already saw is harmless
+                async with expense_collection.watch(
+                    full_document="updateLookup",
+                    resume_after=self.resume_token
+                ) as stream:
+                    self.mode = "change_stream"
+                    # Where the stream opened, so a failure before the first
+                    # change still resumes from there
+                    if stream.resume_token is not None:
+                        self.resume_token = stream.resume_token
+                    if not self.warm:
+                        await self._load()
+                    async for change in stream:
+                        self._apply_change(change)
+                        self.resume_token = stream.resume_token
+            except _Invalidated as e:
+                logger.warning(f"Expense change stream invalidated by '{e}', reloading")
+                self._reset()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    raise
+                if e.code in (CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAM_FATAL):
+                    logger.warning(f"Cannot resume expense change stream ({e}), reloading")
+                    self._reset()
+                else:
+                    logger.warning(f"Expense change stream failed ({e}), resuming")
+                await asyncio.sleep(EXPENSE_STATE_RETRY_DELAY)
+            except PyMongoError as e:
+                logger.warning(f"Expense change stream interrupted ({e}), resuming")
+                await asyncio.sleep(EXPENSE_STATE_RETRY_DELAY)
+
+    def _reset(self):
+        """Forget the resume point so the next pass reloads from scratch"""
+        self.resume_token = None
+        self.last_updated_at = None
+        self.warm = False
+
+    async def _follow_by_polling(self):
+        self.mode = "polling"
+        polls = 0
+        while True:
+            try:
+                if not self.warm:
+                    await self._load()
+                else:
+                    await self._poll_updates()
+                    polls += 1
+                    if polls % EXPENSE_STATE_FULL_SYNC_EVERY == 0:
+                        await self._sync_all()
+            except PyMongoError as e:
+                logger.warning(f"Polling expenses failed ({e}), retrying")
+            await asyncio.sleep(EXPENSE_STATE_POLL_INTERVAL)
+
+    async def _poll_updates(self):
+        """Pick up documents written since the last poll"""
+        if self.last_updated_at is None:
+            query = {"updated_at": {"$exists": True}}
+        else:
+            # Look back past the last timestamp for writes that committed late;
+            # re-applying a document is harmless
+            query = {"updated_at": {"$gte": self.last_updated_at - timedelta(seconds=EXPENSE_STATE_POLL_OVERLAP)}}
+
+        expense_collection = await get_expense_collection()
+        changed = False
+        async for document in expense_collection.find(query):
+            if self.expenses.get(document["_id"]) != document:
+                self.expenses[document["_id"]] = document
+                changed = True
+            self._track_updated_at(document)
+
+        if changed:
+            bump_data_version()
+
+    async def _sync_all(self):
+        """Compare every document with the collection, adding, replacing and dropping what differs"""
+        expense_collection = await get_expense_collection()
+        expenses = {}
+        async for document in expense_collection.find():
+            expenses[document["_id"]] = document
+            self._track_updated_at(document)
+
+        if expenses != self.expenses:
+            self.expenses = expenses
+            bump_data_version()
+
+class _Invalidated(Exception):
+    """The change stream can no longer be resumed"""
+
+expense_state = ExpenseState()
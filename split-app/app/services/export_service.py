@@ -0,0 +1,103 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import AsyncIterator, Iterable, List
+import csv
+import io
+import json
+import os
+
+from app.db.codec import decode_expense
+from app.db.repository import get_repository
+from app.utils.json_response import json_default
+
+# Documents fetched per cursor batch and written per streamed chunk
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+EXPORT_FORMATS = ("csv", "ndjson")
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+EXPENSE_EXPORT_FIELDS = [
+    "_id", "amount", "description", "paid_by", "split_type",
+    "participants", "custom_split", "version", "created_at", "updated_at"
+]
+BALANCE_EXPORT_FIELDS = ["name", "total_paid", "total_share", "balance"]
+SETTLEMENT_EXPORT_FIELDS = ["from_person", "to_person", "amount"]
+
+# Spreadsheets evaluate a cell starting with one of these as a formula
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def _is_number(text: str) -> bool:
+    try:
+        Decimal(text)
+    except InvalidOperation:
+        return False
+    return True
+
+def _csv_value(value):
+    """Flatten one field for a CSV cell"""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        text = ";".join(str(item) for item in value)
+    elif isinstance(value, dict):
+        text = json.dumps(value, default=json_default, separators=(",", ":"))
+    elif isinstance(value, datetime):
+        text = value.isoformat()
+    else:
+        text = str(value)
+    # Quote text a spreadsheet would run as a formula; negative amounts stay numbers
+    if text.startswith(CSV_FORMULA_PREFIXES) and not _is_number(text):
+        return "'" + text
+    return text
+
+def _encode_batch(rows: List[dict], fields: List[str], fmt: str, header: bool) -> bytes:
+    """Serialize one batch of rows into a single chunk"""
+    buffer = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(fields)
+        for row in rows:
+            writer.writerow([_csv_value(row.get(field)) for field in fields])
+    else:
+        for row in rows:
+            buffer.write(json.dumps({field: row.get(field) for field in fields}, default=json_default))
+            buffer.write("\n")
+    return buffer.getvalue().encode()
+
+def _check_format(fmt: str):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of: {', '.join(EXPORT_FORMATS)}")
+
+async def stream_expenses(fmt: str = "csv", batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """
+    Stream every expense in _id order, one chunk per cursor batch,
+    so no more than one batch of documents is held in memory.
+    """
+    _check_format(fmt)
+
+    batch: List[dict] = []
+    header = True
+    async for document in get_repository().iter_expenses(batch_size, read_only=True):
+        batch.append(decode_expense(document))
+        if len(batch) >= batch_size:
+            yield _encode_batch(batch, EXPENSE_EXPORT_FIELDS, fmt, header)
+            batch, header = [], False
+
+    if batch or header:
+        yield _encode_batch(batch, EXPENSE_EXPORT_FIELDS, fmt, header)
+
+async def stream_models(models: Iterable, fields: List[str], fmt: str = "csv", batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Stream already computed balance or settlement rows in batches"""
+    _check_format(fmt)
+
+    batch: List[dict] = []
+    header = True
+    for model in models:
+        batch.append(model.model_dump(mode="json"))
+        if len(batch) >= batch_size:
+            yield _encode_batch(batch, fields, fmt, header)
+            batch, header = [], False
+
+    if batch or header:
+        yield _encode_batch(batch, fields, fmt, header)
@@ -0,0 +1,317 @@
+"""
+Expense history for point-in-time ("as of") balances.
+
+Every expense write appends an event to a journal: the time of the write,
+the expense, the kind of write (create, update, delete) and the per-person
+change in totals it caused. An update is journaled as a correction (new
+version minus old) and a delete as a tombstone (minus the deleted version).
+So the totals at any moment are exactly the sum of the events up to it.
+
+Summing the journal from the start gets slower as it grows, so balances are
+also checkpointed per CHECKPOINT_PERIOD: a checkpoint holds every person's
+totals at a period boundary. totals_as_of() starts from the latest checkpoint
+at or before the requested time and replays only the events after it. Any
+closed period boundary it replays past is checkpointed on the way, so the
+next query starts from there.
+
+Expenses written before the journal existed are entered once, as creates at
+their created_at (or the time in their ObjectId), by ensure_history(). Edits
+and deletes made before that point are lost, so history before the backfill
+shows those expenses as they are now.
+
+The backfill runs once for all processes sharing the storage: the one that
+claims the history_backfill marker runs it and the others wait for it to be
+done. Writes keep being journaled meanwhile, so each expense is entered as
+it stood at the version the backfill read, less the changes journaled up to
+that version. Events carry the expense version and (expense_id, version,
+kind) is unique in the journal, so an event appended twice is stored once.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Union
+import asyncio
+import logging
+import os
+import socket
+
+from app.db.codec import created_at
+from app.db.repository import ExpenseChange, get_repository
+from app.services.ledger_service import Totals, _diff_totals, _empty_totals
+from app.utils.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PERIODS = ("day", "month")
+# Balances are checkpointed at the start of every day or month (UTC)
+CHECKPOINT_PERIOD = os.getenv("CHECKPOINT_PERIOD", "month").lower()
+# A boundary is only checkpointed once it is this far in the past, so writes
+# stamped just before it but journaled just after are not left out
+CHECKPOINT_GRACE_SECONDS = int(os.getenv("CHECKPOINT_GRACE_SECONDS", 300))
+
+# Events journaled per call when backfilling existing expenses
+BACKFILL_BATCH_SIZE = 1000
+# Marker that gives one process the backfill
+HISTORY_MARKER = "history_backfill"
+# A backfill claim not renewed for this long is taken over by another process
+BACKFILL_STALE_SECONDS = int(os.getenv("HISTORY_BACKFILL_STALE_SECONDS", 600))
+# Pause between scanning the expenses and reading the journal, so writes
+# stored just before the scan ended have their events journaled by then
+BACKFILL_SETTLE_SECONDS = float(os.getenv("HISTORY_BACKFILL_SETTLE_SECONDS", 2))
+# How often a waiting process checks whether the backfill is done
+BACKFILL_POLL_SECONDS = 1.0
+
+AS_OF_DURATION = Histogram("balance_as_of_seconds", "Time to compute totals as of a point in time")
+AS_OF_REPLAYED = Counter("balance_as_of_replayed_events_total", "Journal events replayed for as-of totals")
+CHECKPOINTS_WRITTEN = Counter("balance_checkpoints_written_total", "Balance checkpoints stored")
+
+_history_ready = False
+
+def period_start(at: datetime, period: str = CHECKPOINT_PERIOD) -> datetime:
+    """Start of the checkpoint period containing at"""
+    if period == "day":
+        return datetime(at.year, at.month, at.day)
+    if period == "month":
+        return datetime(at.year, at.month, 1)
+    raise ValueError(f"Unknown checkpoint period '{period}', expected one of: {', '.join(CHECKPOINT_PERIODS)}")
+
+def next_period_start(at: datetime, period: str = CHECKPOINT_PERIOD) -> datetime:
+    """Start of the checkpoint period after the one containing at"""
+    start = period_start(at, period)
+    if period == "day":
+        return start + timedelta(days=1)
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+def to_utc_naive(at: datetime) -> datetime:
+    """Stored times are naive UTC; convert an aware datetime to match"""
+    if at.tzinfo is None:
+        return at
+    return (at - at.utcoffset()).replace(tzinfo=None)
+
+def as_of_moment(value: Union[date, datetime]) -> datetime:
+    """The moment an as_of parameter stands for: a datetime as is (in UTC), a date through its last microsecond"""
+    if isinstance(value, datetime):
+        return to_utc_naive(value)
+    return datetime.combine(value, time.max)
+
+def _change_kind(before: Optional[dict], after: Optional[dict]) -> str:
+    if before is None:
+        return "create"
+    if after is None:
+        return "delete"
+    return "update"
+
+def build_events(changes: Iterable[ExpenseChange], at: Optional[datetime] = None) -> List[dict]:
+    """
+    Journal events for a set of (before, after) expense changes, stamped with
+    at when given, else with the updated_at just written (creates and
+    updates) or the current time (deletes). The version is the one written,
+    or the one removed for deletes.
+    """
+    now = datetime.utcnow()
+    events = []
+    for before, after in changes:
+        events.append({
+            "at": at or (after or {}).get("updated_at") or now,
+            "expense_id": str((after or before)["_id"]),
+            "kind": _change_kind(before, after),
+            "version": (after or before).get("version", 0),
+            "delta": _diff_totals([(before, after)])
+        })
+    return events
+
+async def journal_changes(changes: Iterable[ExpenseChange]):
+    """Append the events for written expenses to the journal"""
+    events = build_events(changes)
+    if events:
+        await get_repository().append_events(events)
+
+def apply_delta(totals: Totals, delta: Totals):
+    """Add one event's per-person delta to running totals"""
+    for person, values in delta.items():
+        current = totals.get(person)
+        if current is None:
+            current = totals[person] = _empty_totals()
+        for field, value in values.items():
+            current[field] += value
+
+def _active(totals: Totals) -> Totals:
+    """Totals of people still involved in at least one expense"""
+    return {person: dict(values) for person, values in totals.items() if values["expense_count"] > 0}
+
+def _net(delta: Totals) -> Totals:
+    """delta without the people it leaves unchanged"""
+    return {person: values for person, values in delta.items() if any(values.values())}
+
+def _subtract(totals: Totals, events: Iterable[dict]) -> Totals:
+    totals = {person: dict(values) for person, values in totals.items()}
+    for event in events:
+        apply_delta(totals, {
+            person: {field: -value for field, value in values.items()}
+            for person, values in event["delta"].items()
+        })
+    return _net(totals)
+
+async def _backfill(repository, owner: str) -> Optional[int]:
+    """
+    Journal what the existing expenses contribute beyond the events already
+    journaled for them. Returns the number of events written, or None when
+    another process took the claim over.
+    """
+    async def renew() -> bool:
+        stale_before = datetime.utcnow() - timedelta(seconds=BACKFILL_STALE_SECONDS)
+        return await repository.claim_marker(HISTORY_MARKER, owner, stale_before)
+
+    # expense_id -> (version read, created_at, what that version contributes)
+    stored: Dict[str, tuple] = {}
+    async for expense in repository.iter_expenses(BACKFILL_BATCH_SIZE):
+        stored[str(expense["_id"])] = (expense.get("version", 0), created_at(expense), _diff_totals([(None, expense)]))
+        if len(stored) % BACKFILL_BATCH_SIZE == 0 and not await renew():
+            return None
+
+    await asyncio.sleep(BACKFILL_SETTLE_SECONDS)
+    journaled: Dict[str, List[dict]] = {}
+    async for event in repository.iter_events(None, datetime.max):
+        journaled.setdefault(event["expense_id"], []).append(event)
+
+    events = []
+    for expense_id, (version, at, contribution) in stored.items():
+        # Changes up to the version read are part of it already; a delete
+        # (or anything newer) happened after it was read
+        earlier = [
+            event for event in journaled.pop(expense_id, [])
+            if event["kind"] != "delete" and (event["version"] is None or event["version"] <= version)
+        ]
+        delta = _subtract(contribution, earlier)
+        if delta:
+            events.append({"at": at, "expense_id": expense_id, "kind": "create", "version": version, "delta": delta})
+
+    # Expenses deleted before the scan reached them
+    for expense_id, expense_events in journaled.items():
+        deletes = [event for event in expense_events if event["kind"] == "delete"]
+        delta = _subtract({}, expense_events) if deletes else {}
+        if delta:
+            events.append({
+                "at": created_at({"_id": expense_id}),
+                "expense_id": expense_id,
+                "kind": "create",
+                "version": deletes[0]["version"] or 0,
+                "delta": delta
+            })
+
+    for start in range(0, len(events), BACKFILL_BATCH_SIZE):
+        if not await renew():
+            return None
+        await repository.append_events(events[start:start + BACKFILL_BATCH_SIZE])
+    return len(events)
+
+async def ensure_history(wait: bool = True) -> int:
+    """
+    Journal the stored expenses once, for every process on the storage.
+    Returns the number of events written. Runs at startup and before the
+    first as-of query; when another process holds the backfill this waits
+    for it to finish, or returns 0 at once without wait.
+    """
+    global _history_ready
+    if _history_ready:
+        return 0
+
+    repository = get_repository()
+    owner = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}"
+    while True:
+        marker = await repository.read_marker(HISTORY_MARKER)
+        if marker and marker["state"] == "done":
+            _history_ready = True
+            return 0
+
+        stale_before = datetime.utcnow() - timedelta(seconds=BACKFILL_STALE_SECONDS)
+        if await repository.claim_marker(HISTORY_MARKER, owner, stale_before):
+            written = await _backfill(repository, owner)
+            if written is not None and await repository.complete_marker(HISTORY_MARKER, owner):
+                if written:
+                    logger.info(f"Journaled {written} existing expenses for balance history")
+                _history_ready = True
+                return written
+            logger.warning("Another process took over the balance history backfill")
+
+        if not wait:
+            return 0
+        await asyncio.sleep(BACKFILL_POLL_SECONDS)
+
+async def rebuild_history() -> int:
+    """Drop the journal and checkpoints and journal the current expenses again"""
+    global _history_ready
+    repository = get_repository()
+    await repository.clear_history()
+    await repository.delete_marker(HISTORY_MARKER)
+    _history_ready = False
+    return await ensure_history()
+
+async def totals_as_of(as_of: datetime, checkpoint: bool = True) -> Totals:
+    """
+    Per-person totals in minor units as they stood at as_of (inclusive):
+    the latest checkpoint at or before it plus the journal events since.
+    With checkpoint, closed period boundaries passed while replaying are stored.
+    """
+    as_of = to_utc_naive(as_of)
+    await ensure_history()
+    repository = get_repository()
+
+    with AS_OF_DURATION.time():
+        start = await repository.latest_checkpoint(as_of)
+        totals: Totals = {}
+        since = None
+        if start:
+            since = start["at"]
+            totals = {person: dict(values) for person, values in start["totals"].items()}
+
+        # Boundaries at or before this have received every event they will get
+        closed = period_start(min(as_of, datetime.utcnow() - timedelta(seconds=CHECKPOINT_GRACE_SECONDS)))
+        # First boundary after the events summed so far
+        boundary = next_period_start(since) if since else None
+
+        async def store_checkpoint(at: datetime):
+            await repository.save_checkpoint({"at": at, "totals": _active(totals)})
+            CHECKPOINTS_WRITTEN.inc()
+
+        replayed = 0
+        async for event in repository.iter_events(since, as_of):
+            if boundary is None:
+                boundary = next_period_start(event["at"])
+            elif event["at"] >= boundary:
+                # Totals now hold exactly the events before any boundary from
+                # here up to this event; store the latest closed one, not
+                # one per empty period in between
+                latest = min(period_start(event["at"]), closed)
+                if checkpoint and latest >= boundary:
+                    await store_checkpoint(latest)
+                boundary = next_period_start(event["at"])
+            apply_delta(totals, event["delta"])
+            replayed += 1
+
+        if checkpoint and boundary is not None and closed >= boundary:
+            await store_checkpoint(closed)
+
+    AS_OF_REPLAYED.inc(amount=replayed)
+    return _active(totals)
+
+async def verify_history() -> List[dict]:
+    """
+    Compare a full replay of the journal with the current ledger totals.
+    Returns one entry per differing value; an empty list means replay is exact.
+    """
+    replayed = await totals_as_of(datetime.utcnow(), checkpoint=False)
+    actual = await get_repository().ledger_totals()
+
+    zero = _empty_totals()
+    drift = []
+    for person in sorted(set(replayed) | set(actual)):
+        expected_values = actual.get(person, zero)
+        replayed_values = replayed.get(person, zero)
+        for field in ("total_paid", "total_share", "expense_count"):
+            if replayed_values[field] != expected_values[field]:
+                drift.append({
+                    "name": person,
+                    "field": field,
+                    "replayed": replayed_values[field],
+                    "ledger": expected_values[field]
+                })
+    return drift
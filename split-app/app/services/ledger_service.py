@@ -0,0 +1,206 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from bson.int64 import Int64
+from pymongo import UpdateOne
+
+from app.db.codec import split_shares_minor, stored_amount_minor
+from app.db.database import get_expense_collection, get_ledger_collection
+from app.services.expense_state import expense_state
+from app.services.rebuild_gate import LEDGER_MARKER, run_rebuild
+
+logger = logging.getLogger(__name__)
+
+# Per-person totals are integer minor units (see app/db/codec.py):
+# {person: {"total_paid": int, "total_share": int, "expense_count": int}}
+Totals = Dict[str, Dict[str, int]]
+
+def _empty_totals() -> Dict[str, int]:
+    return {"total_paid": 0, "total_share": 0, "expense_count": 0}
+
+def expense_totals(expense: dict) -> Totals:
+    """
+    Work out what a single stored expense contributes to each person's totals,
+    in minor units.
+    """
+    totals: Totals = {}
+
+    def entry(person):
+        if person not in totals:
+            totals[person] = {"total_paid": 0, "total_share": 0, "expense_count": 1}
+        return totals[person]
+
+    entry(expense["paid_by"])["total_paid"] += stored_amount_minor(expense)
+    for person in expense["participants"]:
+        entry(person)
+
+    for person, share in split_shares_minor(expense).items():
+        entry(person)["total_share"] += share
+
+    return totals
+
+def sum_expense_totals(expenses) -> Totals:
+    """Accumulate expense_totals over an iterable of expense documents"""
+    balances: Totals = {}
+    for expense in expenses:
+        for person, values in expense_totals(expense).items():
+            current = balances.get(person)
+            if current is None:
+                current = balances[person] = _empty_totals()
+            for field, value in values.items():
+                current[field] += value
+    return balances
+
+def _diff_totals(changes: Iterable[Tuple[Optional[dict], Optional[dict]]]) -> Totals:
+    """Per-person delta between the old and new versions of a set of expenses"""
+    delta: Totals = {}
+    for before, after in changes:
+        for sign, expense in ((-1, before), (1, after)):
+            if not expense:
+                continue
+            for person, values in expense_totals(expense).items():
+                current = delta.get(person)
+                if current is None:
+                    current = delta[person] = _empty_totals()
+                for field, value in values.items():
+                    current[field] += sign * value
+
+    # Drop people whose totals did not change
+    return {
+        person: values for person, values in delta.items()
+        if any(value != 0 for value in values.values())
+    }
+
+async def apply_expense_change(before: Optional[dict], after: Optional[dict]):
+    """
+    Apply the difference between two versions of an expense to the ledger.
+    Pass before=None for a create and after=None for a delete.
+    """
+    await apply_expense_changes([(before, after)])
+
+async def apply_expense_changes(changes: Iterable[Tuple[Optional[dict], Optional[dict]]]):
+    """Apply many (before, after) expense changes to the ledger in one bulk write"""
+    delta = _diff_totals(changes)
+    if not delta:
+        return
+
+    operations = [
+        UpdateOne(
+            {"_id": person},
+            {"$inc": {field: Int64(value) for field, value in values.items()}},
+            upsert=True
+        )
+        for person, values in delta.items()
+    ]
+
+    ledger_collection = await get_ledger_collection()
+    await ledger_collection.bulk_write(operations, ordered=False)
+
+async def get_ledger_totals(read_only: bool = False) -> Totals:
+    """
+    Read the current per-person totals from the ledger.
+    read_only routes the read to the configured read preference.
+    """
+    ledger_collection = await get_ledger_collection(read_only)
+
+    totals = {}
+    async for row in ledger_collection.find({"expense_count": {"$gt": 0}}):
+        totals[row["_id"]] = {
+            "total_paid": int(row.get("total_paid", 0)),
+            "total_share": int(row.get("total_share", 0)),
+            "expense_count": int(row.get("expense_count", 0))
+        }
+    return totals
+
+async def compute_totals_from_expenses(use_state: bool = True, read_only: bool = False) -> Totals:
+    """
+    Recompute every person's totals from every expense.
+    Reads the in-memory expense state when it is warm, otherwise scans the collection.
+    """
+    if use_state and expense_state.warm:
+        return sum_expense_totals(expense_state.values())
+
+    expense_collection = await get_expense_collection(read_only)
+
+    expenses = []
+    async for expense in expense_collection.find():
+        expenses.append(expense)
+
+    return sum_expense_totals(expenses)
+
+async def rebuild_ledger() -> Optional[int]:
+    """
+    Recompute the ledger from scratch and swap it in place of the current one,
+    with expense writes held off meanwhile (see rebuild_gate). Returns the
+    number of people written, or None when another process was rebuilding it
+    and this one waited for that instead.
+    """
+    return await run_rebuild(LEDGER_MARKER, _rebuild_ledger)
+
+async def _rebuild_ledger() -> int:
+    ledger_collection = await get_ledger_collection()
+    totals = await compute_totals_from_expenses(use_state=False)
+
+    # Build into a scratch collection and rename it over the live one,
+    # so readers never see a half-written ledger
+    scratch = ledger_collection.database[f"{ledger_collection.name}_rebuild"]
+    await scratch.drop()
+
+    if totals:
+        await scratch.insert_many([
+            {"_id": person, **{field: Int64(value) for field, value in values.items()}}
+            for person, values in totals.items()
+        ])
+        await scratch.rename(ledger_collection.name, dropTarget=True)
+    else:
+        await ledger_collection.delete_many({})
+
+    logger.info(f"Rebuilt balance ledger for {len(totals)} people")
+    return len(totals)
+
+async def verify_ledger() -> List[dict]:
+    """
+    Compare the ledger against a full recomputation.
+    Returns one entry per drifted value; an empty list means the ledger is correct.
+    """
+    expected = await compute_totals_from_expenses(use_state=False)
+    actual = await get_ledger_totals()
+
+    zero = _empty_totals()
+    drift = []
+    for person in sorted(set(expected) | set(actual)):
+        expected_values = expected.get(person, zero)
+        actual_values = actual.get(person, zero)
+        for field in ("total_paid", "total_share", "expense_count"):
+            difference = actual_values[field] - expected_values[field]
+            if difference:
+                drift.append({
+                    "name": person,
+                    "field": field,
+                    "ledger": actual_values[field],
+                    "expected": expected_values[field],
+                    "difference": difference
+                })
+
+    return drift
+
+async def ensure_ledger():
+    """
+    Build the ledger on first start when expenses exist but the ledger is empty,
+    or when it still holds the earlier Decimal128 totals instead of minor units.
+    """
+    ledger_collection = await get_ledger_collection()
+    expense_collection = await get_expense_collection()
+
+    if await ledger_collection.find_one({"total_paid": {"$type": "decimal"}}, {"_id": 1}):
+        logger.info("Balance ledger predates minor-unit totals, rebuilding from expenses...")
+        await rebuild_ledger()
+        return
+
+    if await ledger_collection.estimated_document_count() > 0:
+        return
+    if await expense_collection.estimated_document_count() == 0:
+        return
+
+    logger.info("Balance ledger is empty, rebuilding from expenses...")
+    await rebuild_ledger()
@@ -0,0 +1,96 @@
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+import logging
+
+from pymongo import UpdateOne
+
+from app.db.database import get_expense_collection, get_people_collection
+from app.db.indexes import index_models
+from app.db.repository import get_repository
+from app.services.rebuild_gate import PEOPLE_MARKER, run_rebuild
+
+logger = logging.getLogger(__name__)
+
+def _diff_counts(changes: Iterable[Tuple[Optional[dict], Optional[dict]]]) -> Counter:
+    """Per-person change in participation count between old and new versions of expenses"""
+    delta = Counter()
+    for before, after in changes:
+        if before:
+            delta.subtract(before["participants"])
+        if after:
+            delta.update(after["participants"])
+    return delta
+
+async def apply_people_changes(changes: Iterable[Tuple[Optional[dict], Optional[dict]]]):
+    """
+    Apply many (before, after) expense changes to the people registry in one bulk write.
+    Pass before=None for a create and after=None for a delete.
+    """
+    delta = _diff_counts(changes)
+    operations = [
+        UpdateOne({"name": name}, {"$inc": {"count": count}}, upsert=True)
+        for name, count in delta.items() if count
+    ]
+    if not operations:
+        return
+
+    people_collection = await get_people_collection()
+    await people_collection.bulk_write(operations, ordered=False)
+
+async def get_all_people() -> List[dict]:
+    """Everyone who takes part in at least one expense, by name, read from the registry"""
+    return await get_repository().list_people()
+
+async def count_people_from_expenses() -> Counter:
+    """Participation counts recomputed from every expense"""
+    expense_collection = await get_expense_collection()
+
+    counts = Counter()
+    pipeline = [
+        {"$unwind": "$participants"},
+        {"$group": {"_id": "$participants", "count": {"$sum": 1}}}
+    ]
+    async for person in expense_collection.aggregate(pipeline):
+        counts[person["_id"]] = person["count"]
+    return counts
+
+async def reconcile_people() -> Optional[int]:
+    """
+    Rebuild the people registry from the expenses collection and swap it in,
+    with expense writes held off meanwhile (see rebuild_gate). Returns the
+    number of people written, or None when another process was rebuilding it
+    and this one waited for that instead.
+    """
+    return await run_rebuild(PEOPLE_MARKER, _reconcile_people)
+
+async def _reconcile_people() -> int:
+    people_collection = await get_people_collection()
+    counts = await count_people_from_expenses()
+
+    # Build into a scratch collection and rename it over the live one,
+    # so readers never see a half-written registry
+    scratch = people_collection.database[f"{people_collection.name}_rebuild"]
+    await scratch.drop()
+
+    if counts:
+        await scratch.create_indexes(index_models("people"))
+        await scratch.insert_many([{"name": name, "count": count} for name, count in counts.items()])
+        await scratch.rename(people_collection.name, dropTarget=True)
+    else:
+        await people_collection.delete_many({})
+
+    logger.info(f"Reconciled people registry with {len(counts)} people")
+    return len(counts)
+
+async def ensure_people():
+    """Build the registry on first start when expenses exist but it is empty"""
+    people_collection = await get_people_collection()
+    expense_collection = await get_expense_collection()
+
+    if await people_collection.estimated_document_count() > 0:
+        return
+    if await expense_collection.estimated_document_count() == 0:
+        return
+
+    logger.info("People registry is empty, rebuilding from expenses...")
+    await reconcile_people()
@@ -0,0 +1,97 @@
+"""
+Rebuilds of derived collections that hold expense writes off while they run.
+
+The balance ledger and the people registry are kept current by an $inc on
+every expense write, and rebuilt by recomputing them from the expenses into
+a scratch collection that is renamed over the live one. An $inc landing on the live collection in
+between would be thrown away with it, so a rebuild first claims a shared
+marker (see ExpenseRepository.claim_marker). Every process checks the
+markers before it writes an expense and waits while one is held, and the
+rebuild itself only starts once writes already past that check have had
+REBUILD_SETTLE_SECONDS to finish. Only the claiming process rebuilds; others
+asking for the same rebuild wait for it instead, so replicas that start
+together rebuild once.
+"""
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from app.db.repository import get_repository
+
+logger = logging.getLogger(__name__)
+
+LEDGER_MARKER = "ledger_rebuild"
+PEOPLE_MARKER = "people_rebuild"
+# Markers of the rebuilds that hold writes off
+REBUILD_MARKERS = (LEDGER_MARKER, PEOPLE_MARKER)
+# A rebuild claim not renewed for this long no longer holds writes off
+REBUILD_STALE_SECONDS = int(os.getenv("REBUILD_STALE_SECONDS", 600))
+# How long a process trusts that no rebuild is running before checking again
+REBUILD_CHECK_SECONDS = float(os.getenv("REBUILD_CHECK_SECONDS", 1))
+# Pause after that before rebuilding, for writes already past the check to finish
+REBUILD_SETTLE_SECONDS = float(os.getenv("REBUILD_SETTLE_SECONDS", 2))
+# How often a waiting write checks whether the rebuild is done
+REBUILD_POLL_SECONDS = 0.2
+
+# time.monotonic() until which this process assumes no rebuild is running
+_clear_until = 0.0
+
+def _stale_before() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=REBUILD_STALE_SECONDS)
+
+async def _held(names=REBUILD_MARKERS) -> bool:
+    """Whether any of the named rebuilds is running under a live claim"""
+    repository = get_repository()
+    stale_before = _stale_before()
+    for name in names:
+        marker = await repository.read_marker(name)
+        if marker and marker["state"] == "running" and marker["at"] >= stale_before:
+            return True
+    return False
+
+async def wait_for_rebuilds():
+    """Return once no rebuild holds writes off; called before every expense write"""
+    global _clear_until
+    if time.monotonic() < _clear_until:
+        return
+    while await _held():
+        await asyncio.sleep(REBUILD_POLL_SECONDS)
+    _clear_until = time.monotonic() + REBUILD_CHECK_SECONDS
+
+async def _renew(name: str, owner: str):
+    while True:
+        await asyncio.sleep(REBUILD_STALE_SECONDS / 3)
+        if not await get_repository().claim_marker(name, owner, _stale_before()):
+            logger.warning(f"Lost the {name} claim to another process")
+            return
+
+async def run_rebuild(name: str, rebuild: Callable[[], Awaitable[int]]) -> Optional[int]:
+    """
+    Run rebuild with expense writes held off in every process and return its
+    result. When another process holds the claim, wait for it to finish and
+    return None instead.
+    """
+    global _clear_until
+    repository = get_repository()
+    owner = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}"
+    if not await repository.claim_marker(name, owner, _stale_before()):
+        logger.info(f"Another process holds {name}, waiting for it")
+        while await _held((name,)):
+            await asyncio.sleep(REBUILD_POLL_SECONDS)
+        return None
+
+    # Writes in this process see the claim at once; the others within REBUILD_CHECK_SECONDS
+    _clear_until = 0.0
+    renewal = asyncio.ensure_future(_renew(name, owner))
+    try:
+        await asyncio.sleep(REBUILD_CHECK_SECONDS + REBUILD_SETTLE_SECONDS)
+        return await rebuild()
+    finally:
+        renewal.cancel()
+        marker = await repository.read_marker(name)
+        if marker and marker["owner"] == owner:
+            await repository.delete_marker(name)
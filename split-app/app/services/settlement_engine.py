@@ -0,0 +1,415 @@
+"""
+Settlement planning over net balances.
+
+Works on integer minor units ("cents") so that transfers always add up exactly. Two modes:
+
+- greedy: repeatedly match the largest creditor with the largest debtor
+  using two heaps, O(n log n).
+- exact: find the true minimum number of transfers. A group of k people
+  whose balances sum to zero can always be settled with k - 1 transfers,
+  so the minimum is n minus the largest number of disjoint zero-sum
+  subsets, which a bitmask DP over the people finds. The DP is
+  exponential, so it only runs within a size and time budget and falls
+  back to greedy otherwise.
+
+Both build a plan from nothing, so one changed expense can reshuffle every
+transfer. adjust_transfers() instead repairs a previous plan for new
+balances, touching as few of its transfers as it can; stable_transfers()
+falls back to a fresh greedy plan when repairs have made it too long.
+"""
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import heapq
+import logging
+import os
+import time
+
+from app.db.codec import to_minor, from_minor
+
+logger = logging.getLogger(__name__)
+
+SETTLEMENT_MODES = ("greedy", "exact")
+
+# Largest number of non-zero balances the exact solver will attempt
+EXACT_MAX_PEOPLE = int(os.getenv("SETTLEMENT_EXACT_MAX_PEOPLE", 16))
+# Wall-clock budget for the exact solver before falling back to greedy
+EXACT_TIME_BUDGET_MS = int(os.getenv("SETTLEMENT_EXACT_TIME_BUDGET_MS", 250))
+
+# A repaired plan is rebuilt from scratch once it has this many percent more
+# transfers than a fresh greedy plan for the same balances
+STABLE_MAX_EXTRA_PERCENT = int(os.getenv("SETTLEMENT_STABLE_MAX_EXTRA_PERCENT", 25))
+
+# A transfer is (from_person, to_person, amount in cents)
+Transfer = Tuple[str, str, int]
+
+class BudgetExceeded(Exception):
+    """Raised when the exact solver runs past its time budget"""
+
+def to_cents(balances: Dict[str, Decimal]) -> Dict[str, int]:
+    """Round balances to whole cents, dropping people who are already settled"""
+    cents = {}
+    for name, balance in balances.items():
+        value = to_minor(balance)
+        if value:
+            cents[name] = value
+    return cents
+
+def greedy_transfers(cents: Dict[str, int]) -> List[Transfer]:
+    """
+    Match the largest creditor with the largest debtor until one side runs out.
+    Ties are broken by name so the plan is deterministic.
+    """
+    # heapq is a min-heap, so store negated amounts to pop the largest first
+    creditors = [(-amount, name) for name, amount in cents.items() if amount > 0]
+    debtors = [(amount, name) for name, amount in cents.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        owed, creditor = heapq.heappop(creditors)
+        owes, debtor = heapq.heappop(debtors)
+
+        amount = min(-owed, -owes)
+        transfers.append((debtor, creditor, amount))
+
+        # Push back whoever still has something left to settle
+        if -owed > amount:
+            heapq.heappush(creditors, (owed + amount, creditor))
+        if -owes > amount:
+            heapq.heappush(debtors, (owes + amount, debtor))
+
+    return transfers
+
+def _zero_sum_groups(amounts: List[int], deadline: float) -> List[List[int]]:
+    """
+    Split people into the largest number of disjoint zero-sum groups.
+
+    best[mask] is the most zero-sum groups that fit in the people of mask,
+    built up one person at a time: adding a person closes a group whenever
+    the running total of the mask is zero. Following the choices back from
+    the full mask gives an ordering of people whose prefix sums hit zero
+    at each group boundary.
+    """
+    n = len(amounts)
+    full = (1 << n) - 1
+    totals = [0] * (full + 1)
+    best = [0] * (full + 1)
+    last = [0] * (full + 1)
+
+    for mask in range(1, full + 1):
+        if not mask & 0xFFF and time.perf_counter() > deadline:
+            raise BudgetExceeded()
+
+        lowest = mask & -mask
+        totals[mask] = totals[mask ^ lowest] + amounts[lowest.bit_length() - 1]
+
+        # Choose which person was added last
+        best_value, best_person = -1, 0
+        remaining = mask
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            value = best[mask ^ bit]
+            if value > best_value:
+                best_value, best_person = value, bit
+        best[mask] = best_value + (1 if totals[mask] == 0 else 0)
+        last[mask] = best_person
+
+    # Recover the order people were added in
+    order = []
+    mask = full
+    while mask:
+        bit = last[mask]
+        order.append(bit.bit_length() - 1)
+        mask ^= bit
+    order.reverse()
+
+    # Cut the order wherever the running total returns to zero
+    groups, current, running = [], [], 0
+    for index in order:
+        current.append(index)
+        running += amounts[index]
+        if running == 0:
+            groups.append(current)
+            current = []
+    if current:
+        # Left over when the balances do not sum to exactly zero (rounding residue)
+        groups.append(current)
+
+    return groups
+
+def exact_transfers(
+    cents: Dict[str, int],
+    max_people: Optional[int] = None,
+    time_budget_ms: Optional[int] = None
+) -> Tuple[List[Transfer], bool]:
+    """
+    Plan the minimum number of transfers.
+    Returns (transfers, exact); exact is False when the budget forced a greedy fallback.
+    """
+    max_people = EXACT_MAX_PEOPLE if max_people is None else max_people
+    time_budget_ms = EXACT_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms
+
+    names = sorted(cents)
+    if len(names) > max_people:
+        logger.info(f"Exact settlement skipped for {len(names)} people (limit {max_people}), using greedy")
+        return greedy_transfers(cents), False
+
+    amounts = [cents[name] for name in names]
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    try:
+        groups = _zero_sum_groups(amounts, deadline)
+    except BudgetExceeded:
+        logger.info(f"Exact settlement ran past {time_budget_ms}ms for {len(names)} people, using greedy")
+        return greedy_transfers(cents), False
+
+    # Greedy settles a zero-sum group of k people in at most k - 1 transfers
+    transfers = []
+    for group in groups:
+        transfers.extend(greedy_transfers({names[i]: amounts[i] for i in group}))
+    return transfers, True
+
+def plan_settlements(
+    balances: Dict[str, Decimal],
+    mode: str = "greedy",
+    max_people: Optional[int] = None,
+    time_budget_ms: Optional[int] = None
+) -> List[Tuple[str, str, Decimal]]:
+    """
+    Plan transfers that settle the given net balances.
+    Positive balances are owed money, negative balances owe money.
+    Returns (from_person, to_person, amount) tuples with amounts in currency units.
+    """
+    if mode not in SETTLEMENT_MODES:
+        raise ValueError(f"Unknown settlement mode '{mode}', expected one of: {', '.join(SETTLEMENT_MODES)}")
+
+    cents = to_cents(balances)
+    if mode == "exact":
+        transfers, _ = exact_transfers(cents, max_people, time_budget_ms)
+    else:
+        transfers = greedy_transfers(cents)
+
+    return [
+        (debtor, creditor, from_minor(amount))
+        for debtor, creditor, amount in transfers
+    ]
+
+def plan_nets(transfers: List[Transfer]) -> Dict[str, int]:
+    """What each person receives (positive) or pays (negative) in total under a plan"""
+    nets: Dict[str, int] = {}
+    for debtor, creditor, amount in transfers:
+        nets[debtor] = nets.get(debtor, 0) - amount
+        nets[creditor] = nets.get(creditor, 0) + amount
+    return nets
+
+def adjust_transfers(previous: List[Transfer], cents: Dict[str, int]) -> List[Transfer]:
+    """
+    Repair a previous plan so that it settles cents, changing as few of its
+    transfers as possible. Whatever a person's balance moved by since the plan
+    is first absorbed by transfers the plan already has between people whose
+    balances moved in opposite directions (paying more or less on an existing
+    transfer); only what is left gets new greedy transfers. Untouched
+    transfers keep their place and amount.
+    """
+    nets = plan_nets(previous)
+    delta = {}
+    for name in set(cents) | set(nets):
+        moved = cents.get(name, 0) - nets.get(name, 0)
+        if moved:
+            delta[name] = moved
+
+    # One amount per (debtor, creditor), in the order of the previous plan
+    amounts: Dict[Tuple[str, str], int] = {}
+    for debtor, creditor, amount in previous:
+        amounts[(debtor, creditor)] = amounts.get((debtor, creditor), 0) + amount
+
+    if delta:
+        for (debtor, creditor), amount in amounts.items():
+            paying, receiving = delta.get(debtor, 0), delta.get(creditor, 0)
+            if paying < 0 < receiving:
+                # The debtor now owes more and the creditor is owed more
+                step = min(-paying, receiving)
+                amounts[(debtor, creditor)] = amount + step
+            elif receiving < 0 < paying:
+                # The debtor now owes less and the creditor is owed less
+                step = min(paying, -receiving, amount)
+                amounts[(debtor, creditor)] = amount - step
+                step = -step
+            else:
+                continue
+            delta[debtor] = paying + step
+            delta[creditor] = receiving - step
+
+        # What is left sums to zero like any set of balances
+        for debtor, creditor, amount in greedy_transfers(delta):
+            _add_transfer(amounts, debtor, creditor, amount)
+
+    return [(debtor, creditor, amount) for (debtor, creditor), amount in amounts.items() if amount > 0]
+
+def _add_transfer(amounts: Dict[Tuple[str, str], int], debtor: str, creditor: str, amount: int):
+    """Add a payment to a plan, netting it against a transfer running the other way"""
+    if (creditor, debtor) in amounts:
+        amount = amounts.pop((creditor, debtor)) - amount
+        if amount >= 0:
+            if amount:
+                amounts[(creditor, debtor)] = amount
+            return
+        amount = -amount
+    amounts[(debtor, creditor)] = amounts.get((debtor, creditor), 0) + amount
+
+def _movable(moved: Optional[Set[str]]) -> Callable[[str, str], bool]:
+    """Whether a transfer between two people may change: always, or when one of them is in moved"""
+    return lambda first, second: moved is None or first in moved or second in moved
+
+def _pass_through(
+    amounts: Dict[Tuple[str, str], int], person: str, movable: Callable[[str, str], bool]
+) -> Optional[Tuple[Tuple[str, str], Tuple[str, str]]]:
+    """A transfer into person and one out of them that can be joined into one, or None"""
+    incoming = [pair for pair, amount in amounts.items() if pair[1] == person and amount > 0 and movable(*pair)]
+    outgoing = [pair for pair, amount in amounts.items() if pair[0] == person and amount > 0 and movable(*pair)]
+    for first in incoming:
+        for second in outgoing:
+            if first[0] == second[1] or movable(first[0], second[1]):
+                return first, second
+    return None
+
+def compact_transfers(transfers: List[Transfer], moved: Optional[Set[str]] = None) -> List[Transfer]:
+    """
+    Take people who both pay and receive out of the middle: money that goes
+    x -> p -> y is paid x -> y directly. Repairs leave such pass-throughs
+    behind when a balance changes sign; removing them shortens the plan.
+    With moved, only transfers involving someone in moved are changed or
+    created, so transfers between anyone else stay exactly as they are.
+    """
+    movable = _movable(moved)
+    amounts: Dict[Tuple[str, str], int] = {}
+    for debtor, creditor, amount in transfers:
+        _add_transfer(amounts, debtor, creditor, amount)
+
+    for person in list(plan_nets(transfers)):
+        while True:
+            joined = _pass_through(amounts, person, movable)
+            if joined is None:
+                break
+            incoming, outgoing = joined
+            step = min(amounts[incoming], amounts[outgoing])
+            for pair in (incoming, outgoing):
+                amounts[pair] -= step
+                if not amounts[pair]:
+                    del amounts[pair]
+            if incoming[0] != outgoing[1]:
+                _add_transfer(amounts, incoming[0], outgoing[1], step)
+
+    return [(debtor, creditor, amount) for (debtor, creditor), amount in amounts.items()]
+
+def _find_cycle(pairs: List[Tuple[str, str]]) -> Optional[List[str]]:
+    """People around a cycle of transfers taken in either direction, or None when there is none"""
+    parent: Dict[str, str] = {}
+    neighbours: Dict[str, List[str]] = {}
+
+    def root(person: str) -> str:
+        while parent.setdefault(person, person) != person:
+            parent[person] = parent[parent[person]]
+            person = parent[person]
+        return person
+
+    for first, second in pairs:
+        if root(first) != root(second):
+            parent[root(first)] = root(second)
+            neighbours.setdefault(first, []).append(second)
+            neighbours.setdefault(second, []).append(first)
+            continue
+        # This transfer closes a cycle with the path between its people
+        previous = {first: None}
+        queue = [first]
+        for person in queue:
+            for neighbour in neighbours.get(person, ()):
+                if neighbour not in previous:
+                    previous[neighbour] = person
+                    queue.append(neighbour)
+        path = [second]
+        while path[-1] != first:
+            path.append(previous[path[-1]])
+        return path
+    return None
+
+def cancel_cycles(transfers: List[Transfer], limit: int = 0, moved: Optional[Set[str]] = None) -> List[Transfer]:
+    """
+    While a plan has more than limit transfers, find a cycle of transfers
+    (in either direction) and move money around it until one transfer on it
+    drops to zero. Everyone's total stays the same and only transfers on the
+    cycle change. Without cycles a plan has fewer transfers than people.
+    With moved, cycles only run through transfers involving someone in moved.
+    """
+    movable = _movable(moved)
+    amounts: Dict[Tuple[str, str], int] = {}
+    for debtor, creditor, amount in transfers:
+        _add_transfer(amounts, debtor, creditor, amount)
+
+    while len(amounts) > limit:
+        cycle = _find_cycle([pair for pair in amounts if movable(*pair)])
+        if cycle is None:
+            break
+        edges = [(cycle[index], cycle[(index + 1) % len(cycle)]) for index in range(len(cycle))]
+        forward = [pair for pair in edges if pair in amounts]
+        backward = [(second, first) for first, second in edges if (first, second) not in amounts]
+        # Sending t around the cycle adds t to forward transfers and takes it
+        # from backward ones, or the other way round; take the smaller shift
+        # that empties a transfer
+        shrink_backward = min(amounts[pair] for pair in backward) if backward else None
+        shrink_forward = min(amounts[pair] for pair in forward) if forward else None
+        if shrink_forward is None or (shrink_backward is not None and shrink_backward <= shrink_forward):
+            step, growing, shrinking = shrink_backward, forward, backward
+        else:
+            step, growing, shrinking = shrink_forward, backward, forward
+        for pair in growing:
+            amounts[pair] += step
+        for pair in shrinking:
+            amounts[pair] -= step
+            if not amounts[pair]:
+                del amounts[pair]
+
+    return [(debtor, creditor, amount) for (debtor, creditor), amount in amounts.items()]
+
+def stable_transfers(previous: Optional[List[Transfer]], cents: Dict[str, int]) -> Tuple[List[Transfer], bool]:
+    """
+    Plan transfers for cents starting from a previous plan.
+    Returns (transfers, rebuilt); rebuilt is True when the plan was made from
+    scratch, because there was none or repairs had grown it past
+    STABLE_MAX_EXTRA_PERCENT more transfers than a fresh greedy plan even
+    after compact_transfers() and cancel_cycles(). Unless rebuilt, transfers
+    between two people whose balances did not change stay as they were.
+    """
+    fresh = greedy_transfers(cents)
+    if previous is None:
+        return fresh, True
+    nets = plan_nets(previous)
+    moved = {name for name in set(nets) | set(cents) if nets.get(name, 0) != cents.get(name, 0)}
+    limit = len(fresh) + max(1, len(fresh) * STABLE_MAX_EXTRA_PERCENT // 100)
+    adjusted = adjust_transfers(previous, cents)
+    if len(adjusted) > limit:
+        adjusted = compact_transfers(adjusted, moved)
+    if len(adjusted) > limit:
+        adjusted = cancel_cycles(adjusted, limit, moved)
+    if len(adjusted) > limit:
+        return fresh, True
+    return adjusted, False
+
+def diff_transfers(previous: List[Transfer], current: List[Transfer]) -> dict:
+    """
+    Transfers added, removed and changed (same people, new amount) going from
+    previous to current, plus how many stayed exactly as they were
+    """
+    before = {(debtor, creditor): amount for debtor, creditor, amount in previous}
+    after = {(debtor, creditor): amount for debtor, creditor, amount in current}
+    diff = {"added": [], "removed": [], "changed": [], "unchanged": 0}
+    for pair, amount in after.items():
+        if pair not in before:
+            diff["added"].append((*pair, amount))
+        elif before[pair] != amount:
+            diff["changed"].append((*pair, before[pair], amount))
+        else:
+            diff["unchanged"] += 1
+    diff["removed"] = [(*pair, amount) for pair, amount in before.items() if pair not in after]
+    return diff
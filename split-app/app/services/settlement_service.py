@@ -1,141 +1,285 @@
-from decimal import Decimal
-from typing import Dict, List
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 import logging
+import os
 
-from app.db.database import get_expense_collection
-from app.models.responses import PersonBalance, Settlement
+from app.db.codec import from_minor, split_shares_minor
+from app.db.repository import STORAGE_BACKEND, get_repository
+from app.models.responses import PersonBalance, Settlement, SettlementChange, SettlementDiff
+from app.services.cache_service import get_data_version
+from app.services.columnar_engine import COLUMNAR_AVAILABLE, compute_totals_from_columns
+from app.services.history_service import totals_as_of
+from app.services.ledger_service import Totals, _empty_totals, expense_totals, sum_expense_totals
+from app.services.settlement_engine import (
+    EXACT_MAX_PEOPLE, Transfer, diff_transfers, plan_settlements, stable_transfers, to_cents
+)
+from app.utils.metrics import Counter, Gauge, Histogram
+from app.utils.offload import run_cpu
 
 logger = logging.getLogger(__name__)
 
-async def calculate_balances() -> List[PersonBalance]:
-    """
-    Calculate the balance of each person: total paid, total share, and net balance
-    """
-    # Get the expense collection
-    expense_collection = await get_expense_collection()
-    
-    # First, gather all expenses
-    expenses = []
-    async for expense in expense_collection.find():
-        expenses.append(expense)
-    
-    # If no expenses, return empty list
-    if not expenses:
-        return []
-    
-    # Collect all unique people involved in expenses
-    all_people = set()
-    for expense in expenses:
-        all_people.add(expense["paid_by"])
-        all_people.update(expense["participants"])
-    
-    # Initialize tracking for each person
-    balances: Dict[str, Dict] = {
-        person: {"total_paid": Decimal('0'), "total_share": Decimal('0')} 
-        for person in all_people
-    }
-    
-    # Process each expense
-    for expense in expenses:
-        # Convert to Decimal for accurate calculations
-        amount = Decimal(str(expense["amount"]))
-        paid_by = expense["paid_by"]
-        participants = expense["participants"]
-        
-        # Add to paid amount
-        balances[paid_by]["total_paid"] += amount
-        
-        # Calculate shares based on split_type
-        if expense["split_type"] == "equal":
-            # Equal split among participants
-            share = amount / Decimal(len(participants))
-            for person in participants:
-                balances[person]["total_share"] += share
-        
-        elif expense["split_type"] == "percentage":
-            # Split based on custom percentages
-            for person, percentage in expense["custom_split"].items():
-                share = amount * Decimal(str(percentage)) / Decimal('100')
-                balances[person]["total_share"] += share
-        
-        elif expense["split_type"] == "exact":
-            # Split based on exact amounts
-            for person, share in expense["custom_split"].items():
-                balances[person]["total_share"] += Decimal(str(share))
-    
-    # Calculate net balance for each person
+BALANCE_DURATION = Histogram(
+    "balance_compute_seconds", "Time to compute every person's balance, by engine", ("engine",)
+)
+BALANCE_PEOPLE = Gauge("balance_people", "People in the last balance computation", ("engine",))
+BALANCE_EXPENSES = Gauge("balance_expenses", "Expenses covered by the last balance computation", ("engine",))
+SETTLEMENT_DURATION = Histogram(
+    "settlement_plan_seconds", "Time to plan settlements from balances, by mode", ("mode",)
+)
+PERSON_BALANCE_DURATION = Histogram(
+    "person_balance_seconds", "Time to compute one person's balance and debts from their expenses"
+)
+SETTLEMENT_PEOPLE = Gauge("settlement_people", "People with a non-zero balance in the last plan", ("mode",))
+SETTLEMENT_TRANSFERS = Gauge("settlement_transfers", "Transfers in the last settlement plan", ("mode",))
+SETTLEMENT_STABLE_CHANGES = Counter(
+    "settlement_stable_changes_total", "Transfers added, removed or changed between stable plans", ("change",)
+)
+SETTLEMENT_STABLE_REBUILDS = Counter("settlement_stable_rebuilds_total", "Stable plans made from scratch")
+
+# Last plan of the stable settlement mode, for this process:
+# (data version, transfers in minor units, diff from the plan before it)
+_stable_plan: Optional[Tuple[int, List[Transfer], SettlementDiff]] = None
+
+# How balances are computed:
+#   ledger    - per-person totals kept by the storage backend (default): the
+#               incrementally maintained ledger collection on MongoDB, a
+#               GROUP BY over share rows on SQLite
+#   aggregate - sum paid/share server-side in a single MongoDB aggregation (mongo only)
+#   python    - scan every expense and sum in Python
+#   columnar  - load expenses into NumPy columns and sum in batches (needs numpy)
+BALANCE_ENGINES = (
+    ("ledger",)
+    + (("aggregate",) if STORAGE_BACKEND == "mongo" else ())
+    + ("python",)
+    + (("columnar",) if COLUMNAR_AVAILABLE else ())
+)
+BALANCE_ENGINE = os.getenv("BALANCE_ENGINE", "ledger")
+
+def _to_person_balances(totals: Totals) -> List[PersonBalance]:
+    """Turn per-person totals in minor units into PersonBalance rows"""
     result = []
-    for person, amounts in balances.items():
+    for person, amounts in totals.items():
         # Positive balance means the person is owed money
         # Negative balance means the person owes money
-        balance = amounts["total_paid"] - amounts["total_share"]
-        
-        # Ensure balances are rounded to 2 decimal places
         result.append(
             PersonBalance(
                 name=person,
-                total_paid=round(amounts["total_paid"], 2),
-                total_share=round(amounts["total_share"], 2),
-                balance=round(balance, 2)
+                total_paid=from_minor(amounts["total_paid"]),
+                total_share=from_minor(amounts["total_share"]),
+                balance=from_minor(amounts["total_paid"] - amounts["total_share"])
             )
         )
     
     # Sort by balance (highest positive to highest negative)
     return sorted(result, key=lambda x: x.balance, reverse=True)
 
-async def calculate_simplified_settlements() -> List[Settlement]:
+async def compute_totals(engine: Optional[str] = None) -> Totals:
+    """Compute per-person totals with the requested (or configured) balance engine"""
+    engine = engine or BALANCE_ENGINE
+    repository = get_repository()
+    if engine == "ledger":
+        return await repository.ledger_totals()
+    if engine == "aggregate":
+        if not hasattr(repository, "aggregate_totals"):
+            raise ValueError(f"The aggregate balance engine needs MongoDB, not the {repository.name} backend")
+        return await repository.aggregate_totals()
+    if engine == "python":
+        expenses = [expense async for expense in repository.scan_expenses()]
+        return await run_cpu(sum_expense_totals, expenses, size=len(expenses))
+    if engine == "columnar":
+        return await compute_totals_from_columns()
+    raise ValueError(f"Unknown balance engine '{engine}', expected one of: {', '.join(BALANCE_ENGINES)}")
+
+async def calculate_balances(engine: Optional[str] = None, as_of: Optional[datetime] = None) -> List[PersonBalance]:
+    """
+    Calculate the balance of each person: total paid, total share, and net balance.
+    The default ledger engine grows with the number of people, not expenses.
+    With as_of, balances are those at that moment, replayed from the expense
+    journal; the engine cannot be chosen then.
+    """
+    if as_of is not None:
+        if engine:
+            raise ValueError("as_of balances are replayed from the expense journal; leave out engine")
+        totals = await totals_as_of(as_of)
+        return await run_cpu(_to_person_balances, totals, size=len(totals))
+
+    engine = engine or BALANCE_ENGINE
+    with BALANCE_DURATION.time(engine):
+        totals = await compute_totals(engine)
+        balances = await run_cpu(_to_person_balances, totals, size=len(totals))
+
+    BALANCE_PEOPLE.set(len(balances), engine)
+    BALANCE_EXPENSES.set(await get_repository().count_expenses(), engine)
+    return balances
+
+def sum_person_expenses(name: str, expenses: List[dict]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    One person's totals and net debt with everyone they share an expense
+    with, in minor units. A positive debt means the other person owes them.
+    Debts are direct: each participant owes the payer their share of an
+    expense, netted per pair.
+    """
+    totals = _empty_totals()
+    debts: Dict[str, int] = {}
+    for expense in expenses:
+        for field, value in expense_totals(expense).get(name, {}).items():
+            totals[field] += value
+
+        payer = expense["paid_by"]
+        shares = split_shares_minor(expense)
+        if payer == name:
+            for person, share in shares.items():
+                if person != name:
+                    debts[person] = debts.get(person, 0) + share
+        elif shares.get(name):
+            debts[payer] = debts.get(payer, 0) - shares[name]
+    return totals, debts
+
+async def person_totals(name: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """sum_person_expenses over only the expenses the person paid for or takes part in"""
+    with PERSON_BALANCE_DURATION.time():
+        expenses = [expense async for expense in get_repository().person_expenses(name)]
+        return await run_cpu(sum_person_expenses, name, expenses, size=len(expenses))
+
+async def calculate_person_balance(name: str) -> Optional[PersonBalance]:
+    """A single person's balance, or None if they take part in no expense"""
+    totals, _ = await person_totals(name)
+    if not totals["expense_count"]:
+        return None
+    return _to_person_balances({name: totals})[0]
+
+async def calculate_person_settlements(name: str) -> Optional[List[Settlement]]:
     """
-    Calculate simplified settlement transactions that minimize the number of payments
+    Who owes the person and whom they owe, from the expenses they share,
+    largest first; None if they take part in no expense. What they are owed
+    minus what they owe is their balance whenever shares add up to the
+    expense amount (always for equal and percentage splits).
     """
+    totals, debts = await person_totals(name)
+    if not totals["expense_count"]:
+        return None
+
+    settlements = []
+    for person, amount in sorted(debts.items(), key=lambda item: (-abs(item[1]), item[0])):
+        if amount > 0:
+            settlements.append(Settlement(from_person=person, to_person=name, amount=from_minor(amount)))
+        elif amount < 0:
+            settlements.append(Settlement(from_person=name, to_person=person, amount=from_minor(-amount)))
+    return settlements
+
+async def compare_balance_engines(engines=BALANCE_ENGINES) -> List[dict]:
+    """
+    Run every engine over the current data and report rows whose rounded values disagree.
+    An empty list means all engines give identical results.
+    """
+    results = {engine: {b.name: b for b in await calculate_balances(engine)} for engine in engines}
+    reference_engine = engines[0]
+    reference = results[reference_engine]
+
+    mismatches = []
+    for engine in engines[1:]:
+        other = results[engine]
+        for name in sorted(set(reference) | set(other)):
+            expected = reference.get(name)
+            actual = other.get(name)
+            for field in ("total_paid", "total_share", "balance"):
+                expected_value = getattr(expected, field) if expected else None
+                actual_value = getattr(actual, field) if actual else None
+                if expected_value != actual_value:
+                    mismatches.append({
+                        "name": name,
+                        "field": field,
+                        "engine": engine,
+                        "expected": expected_value,
+                        "actual": actual_value
+                    })
+    return mismatches
+
+async def calculate_simplified_settlements(mode: str = "greedy", as_of: Optional[datetime] = None) -> List[Settlement]:
+    """
+    Calculate simplified settlement transactions that minimize the number of payments.
+    mode is "greedy" (heap-based, any group size), "exact" (true minimum for
+    small groups) or "stable" (the previous plan, adjusted; see calculate_stable_settlements).
+    With as_of, the plan settles the balances as they stood at that moment.
+    """
+    if mode == "stable":
+        if as_of is not None:
+            raise ValueError("as_of is not supported in stable mode, which adjusts the current plan")
+        settlements, _ = await calculate_stable_settlements()
+        return settlements
+    
     # Get balances for all people
-    balances = await calculate_balances()
+    balances = await calculate_balances(as_of=as_of)
     
     # If no balances, return empty list
     if not balances:
         return []
     
-    # Create separate lists for creditors (positive balance) and debtors (negative balance)
-    creditors = [b for b in balances if b.balance > Decimal('0')]
-    debtors = [b for b in balances if b.balance < Decimal('0')]
-    
-    # Sort creditors by descending balance (highest positive first)
-    creditors.sort(key=lambda x: x.balance, reverse=True)
-    
-    # Sort debtors by ascending balance (highest negative first)
-    debtors.sort(key=lambda x: x.balance)
-    
-    # Initialize the settlements list
-    settlements = []
+    # The exact solver is exponential in the people it works on
+    size = len(balances) if mode != "exact" else 2 ** min(len(balances), EXACT_MAX_PEOPLE)
+    with SETTLEMENT_DURATION.time(mode):
+        transfers = await run_cpu(plan_settlements, {b.name: b.balance for b in balances}, mode, size=size)
+
+    SETTLEMENT_PEOPLE.set(sum(1 for b in balances if b.balance != 0), mode)
+    SETTLEMENT_TRANSFERS.set(len(transfers), mode)
     
-    # Process until either creditors or debtors list is empty
-    while creditors and debtors:
-        creditor = creditors[0]
-        debtor = debtors[0]
-        
-        # Calculate the amount to settle (minimum of what's owed and what can be paid)
-        amount = min(creditor.balance, -debtor.balance)
-        
-        # Round to 2 decimal places for currency
-        amount = round(amount, 2)
-        
-        if amount > Decimal('0'):
-            settlements.append(
-                Settlement(
-                    from_person=debtor.name,
-                    to_person=creditor.name,
-                    amount=amount
-                )
+    return [
+        Settlement(from_person=debtor, to_person=creditor, amount=amount)
+        for debtor, creditor, amount in transfers
+    ]
+
+def _settlements(transfers: List[Transfer]) -> List[Settlement]:
+    return [
+        Settlement(from_person=debtor, to_person=creditor, amount=from_minor(amount))
+        for debtor, creditor, amount in transfers
+    ]
+
+async def calculate_stable_settlements() -> Tuple[List[Settlement], SettlementDiff]:
+    """
+    Settlement plan that changes as little as possible between writes.
+    Instead of planning from scratch, the last plan is adjusted for how
+    balances moved since it was made, so transfers nobody's balance change
+    touches stay exactly as they were. Returns the plan and its diff from the
+    previous one (added, removed and changed transfers). The plan is kept per
+    process and computed once per data version.
+    """
+    global _stable_plan
+    version = get_data_version()
+    if _stable_plan is not None and _stable_plan[0] == version:
+        return _settlements(_stable_plan[1]), _stable_plan[2]
+
+    balances = await calculate_balances()
+    cents = to_cents({b.name: b.balance for b in balances})
+    previous = _stable_plan[1] if _stable_plan is not None else None
+
+    with SETTLEMENT_DURATION.time("stable"):
+        transfers, rebuilt = await run_cpu(
+            stable_transfers, previous, cents, size=len(cents) + len(previous or ())
+        )
+    changes = diff_transfers(previous or [], transfers)
+    diff = SettlementDiff(
+        added=_settlements(changes["added"]),
+        removed=_settlements(changes["removed"]),
+        changed=[
+            SettlementChange(
+                from_person=debtor, to_person=creditor,
+                previous_amount=from_minor(before), amount=from_minor(after)
             )
-        
-        # Update balances
-        creditor.balance -= amount
-        debtor.balance += amount
-        
-        # Remove people with zero balance
-        if abs(creditor.balance) < Decimal('0.01'):
-            creditors.pop(0)
-        
-        if abs(debtor.balance) < Decimal('0.01'):
-            debtors.pop(0)
-    
-    return settlements
\ No newline at end of file
+            for debtor, creditor, before, after in changes["changed"]
+        ],
+        unchanged=changes["unchanged"],
+        rebuilt=rebuilt
+    )
+
+    # A computation that started before a newer one finished must not
+    # replace the newer plan
+    if _stable_plan is None or version >= _stable_plan[0]:
+        _stable_plan = (version, transfers, diff)
+    for change in ("added", "removed", "changed"):
+        SETTLEMENT_STABLE_CHANGES.inc(change, amount=len(changes[change]))
+    if rebuilt:
+        SETTLEMENT_STABLE_REBUILDS.inc()
+    SETTLEMENT_PEOPLE.set(len(cents), "stable")
+    SETTLEMENT_TRANSFERS.set(len(transfers), "stable")
+
+    return _settlements(transfers), diff
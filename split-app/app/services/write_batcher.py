@@ -0,0 +1,109 @@
+"""
+Group commit for single-document inserts.
+
+Under many concurrent POST /expenses each request used to pay for its own
+insert round trip, ledger update and journal append. With WRITE_BATCH_ENABLED
+the inserts arriving within WRITE_BATCH_WINDOW_MS of the first one (or until
+WRITE_BATCH_MAX_SIZE are waiting) are written together with one unordered
+insert_many. Every caller still gets back its own stored document, or its own
+error when only its document was rejected. The window adds at most that much
+latency to a lone write; under load batches fill before it runs out.
+"""
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+
+from app.utils.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_ENABLED = os.getenv("WRITE_BATCH_ENABLED", "false").lower() == "true"
+# How long the first insert of a batch waits for others to join it
+WRITE_BATCH_WINDOW_MS = float(os.getenv("WRITE_BATCH_WINDOW_MS", 2))
+WRITE_BATCH_MAX_SIZE = int(os.getenv("WRITE_BATCH_MAX_SIZE", 100))
+
+WRITE_BATCH_SIZE = Histogram(
+    "write_batch_size", "Documents per group-committed insert", buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500)
+)
+WRITE_BATCH_FLUSHES = Counter(
+    "write_batch_flushes_total", "Group-commit flushes, by trigger (window, size, close)", ("trigger",)
+)
+
+# Writes documents, returning the stored ones and (position, message) per rejected document
+InsertMany = Callable[[List[dict]], Awaitable[Tuple[List[dict], List[Tuple[int, str]]]]]
+
+class WriteRejectedError(Exception):
+    """The database rejected this document while the rest of its batch was written"""
+
+def _retrieve_exception(future: asyncio.Future):
+    if not future.cancelled():
+        future.exception()
+
+class WriteBatcher:
+    """Collects concurrent inserts and writes them with one insert_many"""
+
+    def __init__(self, insert_many: InsertMany, window_ms: float = WRITE_BATCH_WINDOW_MS, max_size: int = WRITE_BATCH_MAX_SIZE):
+        self.insert_many = insert_many
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def insert(self, document: dict) -> dict:
+        """Queue document for the next batch and return it as stored"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((document, future))
+        if len(self._pending) >= self.max_size:
+            self._flush("size")
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush, "window")
+
+        try:
+            # shield: the document is written whether or not this caller stays
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Nobody awaits the outcome any more; retrieve it so a failure is not logged as never retrieved
+            future.add_done_callback(_retrieve_exception)
+            raise
+
+    def _flush(self, trigger: str):
+        """Start writing everything pending as one batch"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        WRITE_BATCH_FLUSHES.inc(trigger)
+        WRITE_BATCH_SIZE.observe(len(batch))
+        task = asyncio.ensure_future(self._write(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            inserted, errors = await self.insert_many([document for document, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        # insert_many keeps the order of the documents it stored
+        rejected = dict(errors)
+        stored = iter(inserted)
+        for position, (_, future) in enumerate(batch):
+            if position in rejected:
+                future.set_exception(WriteRejectedError(rejected[position]))
+            else:
+                future.set_result(next(stored))
+
+    async def close(self):
+        """Write whatever is pending and wait for batches in progress; called on shutdown"""
+        self._flush("close")
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
@@ -0,0 +1,60 @@
+"""
+JSON responses without FastAPI's generic encoder walk.
+
+Routes with a typed response model build the model and return it in a
+FastJSONResponse, which serializes it in one pass with pydantic-core
+(model_dump_json) instead of validating a dict against the model, turning it
+back into plain Python values and encoding those again. Anything else
+(plain dicts from the stats endpoints, bulk import results) goes through
+orjson when it is installed (`pip install orjson`) and the standard library
+encoder otherwise.
+
+Encoding policy of the plain path:
+  Decimal  -> number, as expense amounts always were on the wire
+  ObjectId -> 24 character hex string
+  datetime -> ISO 8601
+Response models pick their own Decimal encoding: ExpenseOut writes numbers
+too, balances and settlements write strings.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+import json
+
+from bson.objectid import ObjectId
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+def json_default(value):
+    """Encode the values the standard encoders do not know"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", by_alias=True)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content) -> bytes:
+    """Compact JSON bytes for plain Python content"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content, default=json_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that renders response models with pydantic-core and everything else with orjson"""
+
+    def render(self, content) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.model_dump_json(by_alias=True).encode("utf-8")
+        return dumps(content)
@@ -0,0 +1,100 @@
+"""
+Run CPU-bound computation off the event loop.
+
+Balance and settlement computation is plain Python (Decimal and integer
+arithmetic over every expense or person), so on a large ledger running it in
+a coroutine stalls every other request on the worker. run_cpu() hands such a
+function to an executor instead:
+
+  thread   a thread pool (default). The GIL is still shared, but the
+           interpreter switches threads every few milliseconds, so the event
+           loop keeps serving requests while a computation runs.
+  process  a process pool. Computations run in parallel with the event loop
+           and with each other; arguments and results are pickled, so the
+           functions must be module-level and their inputs plain data.
+           Workers are spawned, so a script that starts the app itself must
+           do so under `if __name__ == "__main__":` (uvicorn already does).
+  inline   on the event loop, as before.
+
+Inputs smaller than COMPUTE_INLINE_THRESHOLD items run inline whatever the
+executor, since handing them over costs more than computing them.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+
+from app.utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+COMPUTE_EXECUTORS = ("thread", "process", "inline")
+COMPUTE_EXECUTOR = os.getenv("COMPUTE_EXECUTOR", "thread").lower()
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", min(4, os.cpu_count() or 1)))
+# Items (expenses, people, ...) below which a computation runs on the event loop
+COMPUTE_INLINE_THRESHOLD = int(os.getenv("COMPUTE_INLINE_THRESHOLD", 2000))
+
+COMPUTE_TASKS = Counter(
+    "compute_tasks_total", "CPU-bound computations, by function and where they ran", ("function", "executor")
+)
+
+T = TypeVar("T")
+
+_executor: Optional[Executor] = None
+
+def _create_executor(kind: str, workers: int) -> Optional[Executor]:
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compute")
+    if kind == "process":
+        # spawn, not fork: the parent has an event loop, driver threads and
+        # open sockets that a forked child must not inherit
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    if kind == "inline":
+        return None
+    raise ValueError(f"Unknown compute executor '{kind}', expected one of: {', '.join(COMPUTE_EXECUTORS)}")
+
+def get_executor() -> Optional[Executor]:
+    """The configured executor, created on first use; None when computing inline"""
+    global _executor
+    if _executor is None and COMPUTE_EXECUTOR != "inline":
+        _executor = _create_executor(COMPUTE_EXECUTOR, COMPUTE_WORKERS)
+        logger.info(f"Started {COMPUTE_EXECUTOR} compute pool with {COMPUTE_WORKERS} workers")
+    return _executor
+
+def configure(executor: Optional[str] = None, workers: Optional[int] = None, inline_threshold: Optional[int] = None):
+    """Change the executor settings, e.g. from a benchmark; the current pool is shut down"""
+    global COMPUTE_EXECUTOR, COMPUTE_WORKERS, COMPUTE_INLINE_THRESHOLD
+    shutdown()
+    if executor is not None:
+        if executor not in COMPUTE_EXECUTORS:
+            raise ValueError(f"Unknown compute executor '{executor}', expected one of: {', '.join(COMPUTE_EXECUTORS)}")
+        COMPUTE_EXECUTOR = executor
+    if workers is not None:
+        COMPUTE_WORKERS = workers
+    if inline_threshold is not None:
+        COMPUTE_INLINE_THRESHOLD = inline_threshold
+
+def shutdown():
+    """Stop the pool; called on app shutdown"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+async def run_cpu(function: Callable[..., T], *args, size: int) -> T:
+    """
+    Run function(*args) on the compute executor and wait for it without
+    blocking the event loop. size is the number of items the computation
+    works through; below COMPUTE_INLINE_THRESHOLD it runs inline.
+    """
+    executor = get_executor() if size >= COMPUTE_INLINE_THRESHOLD else None
+    if executor is None:
+        COMPUTE_TASKS.inc(function.__name__, "inline")
+        return function(*args)
+
+    COMPUTE_TASKS.inc(function.__name__, COMPUTE_EXECUTOR)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args))
@@ -0,0 +1,112 @@
+import codecs
+import json
+from typing import AsyncIterator, Tuple, Any
+
+# Largest single row accepted from a streamed upload
+MAX_ROW_BYTES = 1024 * 1024
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Yield (row_index, value) for each non-blank line of an NDJSON byte stream.
+    Lines that are not valid JSON are yielded as a ValueError instead of a value.
+    """
+    buffer = b""
+    index = 0
+
+    def parse(line: bytes):
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            return ValueError(f"Invalid JSON: {e}")
+
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield index, parse(line)
+                index += 1
+        if len(buffer) > MAX_ROW_BYTES:
+            raise ValueError(f"Row {index} is larger than {MAX_ROW_BYTES} bytes")
+
+    if buffer.strip():
+        yield index, parse(buffer)
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    while pos < len(text) and text[pos] in " \t\r\n":
+        pos += 1
+    return pos
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Yield (row_index, value) for each element of a top-level JSON array,
+    decoding incrementally so the whole array is never held in memory.
+    Raises ValueError if the stream is not a well-formed array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    index = 0
+    started = False
+    finished = False
+    expect_value = True
+
+    async def source():
+        async for chunk in chunks:
+            yield text_decoder.decode(chunk), False
+        yield text_decoder.decode(b"", final=True), True
+
+    async for text, at_end in source():
+        buffer += text
+        pos = 0
+        while not finished:
+            pos = _skip_whitespace(buffer, pos)
+            if pos >= len(buffer):
+                break
+
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array of expenses")
+                started = True
+                pos += 1
+                continue
+
+            char = buffer[pos]
+            if char == "]" and (expect_value is True and index == 0 or expect_value is False):
+                finished = True
+                pos += 1
+                break
+            if char == ",":
+                if expect_value:
+                    raise ValueError(f"Unexpected ',' before row {index}")
+                expect_value = True
+                pos += 1
+                continue
+            if not expect_value:
+                raise ValueError(f"Expected ',' or ']' after row {index - 1}")
+
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if at_end or len(buffer) - pos > MAX_ROW_BYTES:
+                    raise ValueError(f"Invalid JSON in row {index}: {e}")
+                # Most likely the row is split across chunks; wait for more data
+                break
+
+            # A bare number at the end of the buffer may continue in the next chunk
+            if end == len(buffer) and not at_end and not isinstance(value, (dict, list, str)):
+                break
+
+            yield index, value
+            index += 1
+            expect_value = False
+            pos = end
+
+        buffer = buffer[pos:]
+        if finished:
+            if buffer.strip():
+                raise ValueError("Unexpected data after the end of the JSON array")
+            buffer = ""
+
+    if not started or not finished:
+        raise ValueError("JSON array is incomplete")
@@ -0,0 +1,85 @@
+"""
+Benchmark the columnar balance engine against the per-expense Python loop.
+
+    python -m benchmarks.bench_columnar --sizes 10000 100000 1000000
+
+Runs in-process on synthetic expense documents in the stored format (no
+database needed). For each size it reports, as JSON:
+  - compute time of ledger_service.sum_expense_totals over a list of
+    documents versus load_columns + compute_totals_columnar
+  - peak traced memory of loading and computing each way: the list of full
+    dicts the Python engine holds versus the columns built from a stream
+It also checks that both engines produce identical totals.
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from app.models.expense import ExpenseCreate
+from app.services.columnar_engine import COLUMNAR_AVAILABLE, compute_totals_columnar, load_columns
+from app.services.expense_service import _prepare_new_expense
+from app.services.ledger_service import sum_expense_totals
+from benchmarks.generator import generate_expenses
+
+def stored_expenses(count: int, people: int, seed: int):
+    """Synthetic expenses as they are stored in MongoDB"""
+    for row in generate_expenses(count, people=people, seed=seed):
+        yield _prepare_new_expense(ExpenseCreate(**row))
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+def peak_memory(function) -> int:
+    """Peak bytes allocated while running function (its result is discarded)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_size(count: int, people: int, seed: int) -> dict:
+    documents = list(stored_expenses(count, people, seed))
+
+    python_totals, python_seconds = timed(sum_expense_totals, documents)
+    columns, load_seconds = timed(load_columns, documents)
+    columnar_totals, columnar_seconds = timed(compute_totals_columnar, columns)
+    del documents, columns
+
+    python_peak = peak_memory(lambda: sum_expense_totals(list(stored_expenses(count, people, seed))))
+    columnar_peak = peak_memory(lambda: compute_totals_columnar(load_columns(stored_expenses(count, people, seed))))
+
+    return {
+        "expenses": count,
+        "people": people,
+        "totals_match": python_totals == columnar_totals,
+        "python_seconds": round(python_seconds, 3),
+        "columnar_load_seconds": round(load_seconds, 3),
+        "columnar_compute_seconds": round(columnar_seconds, 3),
+        "compute_speedup": round(python_seconds / columnar_seconds, 1) if columnar_seconds else None,
+        "python_peak_mb": round(python_peak / 2 ** 20, 1),
+        "columnar_peak_mb": round(columnar_peak / 2 ** 20, 1)
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--people", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if not COLUMNAR_AVAILABLE:
+        raise SystemExit("numpy is not installed; the columnar engine is unavailable")
+
+    results = [run_size(count, args.people, args.seed) for count in args.sizes]
+    print(json.dumps({"benchmark": "columnar_balances", "results": results}, indent=2))
+    return 0 if all(result["totals_match"] for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Benchmark the streaming expense export.
+
+    python -m benchmarks.bench_export --expenses 1000000 --format csv
+
+Seeds a scratch database (see common.py) with synthetic expenses, streams the export through
+export_service.stream_expenses and reports rows/second and peak RSS as JSON.
+"""
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import time
+
+from benchmarks.common import BACKENDS, backend_label, connect, current_rss_kb, seed
+from app.db.repository import get_repository
+from app.services.export_service import stream_expenses, EXPORT_BATCH_SIZE
+
+async def run(args) -> dict:
+    await connect(args.backend)
+    try:
+        await seed(args.expenses, rebuild=False, people=args.people, seed=args.seed)
+
+        baseline_rss = current_rss_kb()
+        peak_rss = baseline_rss
+        rows = 0
+        size = 0
+
+        started = time.perf_counter()
+        async for chunk in stream_expenses(args.format, args.batch_size):
+            rows += chunk.count(b"\n")
+            size += len(chunk)
+            peak_rss = max(peak_rss, current_rss_kb())
+        elapsed = time.perf_counter() - started
+
+        if args.format == "csv":
+            rows -= 1  # header
+
+        return {
+            "benchmark": "export_expenses",
+            "backend": args.backend,
+            "database": backend_label(args.backend),
+            "format": args.format,
+            "batch_size": args.batch_size,
+            "rows": rows,
+            "bytes": size,
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(rows / elapsed) if elapsed else None,
+            "baseline_rss_kb": baseline_rss,
+            "peak_rss_during_export_kb": peak_rss,
+            "peak_rss_growth_kb": peak_rss - baseline_rss,
+            "process_max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+    finally:
+        await get_repository().close()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=BACKENDS, default="mongo")
+    parser.add_argument("--expenses", type=int, default=100000)
+    parser.add_argument("--people", type=int, default=200)
+    parser.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
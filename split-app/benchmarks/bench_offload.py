@@ -0,0 +1,129 @@
+"""
+Load test: latency of light requests while heavy computations run.
+
+    python -m benchmarks.bench_offload --backend memory --expenses 20000 --people 2000
+    python -m benchmarks.bench_offload --executors inline thread process --seconds 10
+
+For each compute executor (app/utils/offload.py), probes send GET / and
+GET /expenses/?limit=50 back to back through the ASGI app and record their
+latency, first alone and then while --heavy clients keep requesting
+GET /balances?engine=python and GET /settlements with the response cache
+invalidated before every request, so each one recomputes from scratch.
+Everything shares one event loop, like a single uvicorn worker. With the
+computation on the loop (inline) the probes' p99 grows to the length of a
+whole computation; with an executor it should stay near the unloaded value.
+Reports JSON.
+"""
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.common import BACKENDS, backend_label, connect, environment, seed, summarize
+from benchmarks.run import asgi_request
+from app.db.repository import get_repository
+from app.main import app
+from app.services.cache_service import bump_data_version
+from app.utils import offload
+
+PROBES = {
+    "root": "/",
+    "expenses_page": "/expenses/?limit=50"
+}
+HEAVY = ["/balances?engine=python", "/settlements"]
+
+async def _probe(target: str, stop: asyncio.Event, latencies: List[float]):
+    while not stop.is_set():
+        started = time.perf_counter()
+        status, _ = await asgi_request("GET", target)
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            raise RuntimeError(f"GET {target} returned {status}")
+        # Let the other clients in even when nothing in the request waited
+        await asyncio.sleep(0)
+
+async def _heavy(stop: asyncio.Event, latencies: List[float]):
+    index = 0
+    while not stop.is_set():
+        target = HEAVY[index % len(HEAVY)]
+        index += 1
+        # A write elsewhere would do the same: the next read has to recompute
+        bump_data_version()
+        started = time.perf_counter()
+        status, _ = await asgi_request("GET", target)
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            raise RuntimeError(f"GET {target} returned {status}")
+        # Let the other clients in even when nothing in the request waited
+        await asyncio.sleep(0)
+
+async def run_phase(seconds: float, heavy_clients: int) -> Dict[str, dict]:
+    """Probe for a number of seconds with heavy_clients computing alongside"""
+    stop = asyncio.Event()
+    probe_latencies = {name: [] for name in PROBES}
+    heavy_latencies: List[float] = []
+
+    tasks = [asyncio.create_task(_probe(target, stop, probe_latencies[name])) for name, target in PROBES.items()]
+    tasks += [asyncio.create_task(_heavy(stop, heavy_latencies)) for _ in range(heavy_clients)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    result = {name: summarize(values) for name, values in probe_latencies.items()}
+    if heavy_clients:
+        result["heavy"] = summarize(heavy_latencies)
+    return result
+
+async def run(args) -> dict:
+    await connect(args.backend)
+    try:
+        await seed(args.expenses, people=args.people, seed=args.seed)
+        results = {}
+        async with app.router.lifespan_context(app):
+            for executor in args.executors:
+                offload.configure(executor=executor, workers=args.workers, inline_threshold=args.inline_threshold)
+                # Warm the pool (process workers import the app) outside the measurement
+                await run_phase(1, 1)
+                results[executor] = {
+                    "idle": await run_phase(args.seconds, 0),
+                    "loaded": await run_phase(args.seconds, args.heavy)
+                }
+            offload.shutdown()
+
+        return {
+            "benchmark": "offload",
+            "backend": args.backend,
+            "database": backend_label(args.backend),
+            "dataset": {"expenses": args.expenses, "people": args.people, "seed": args.seed},
+            "settings": {
+                "seconds": args.seconds,
+                "heavy": args.heavy,
+                "workers": args.workers,
+                "inline_threshold": args.inline_threshold
+            },
+            "environment": environment(),
+            "results": results
+        }
+    finally:
+        await get_repository().close()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=BACKENDS, default="mongo")
+    parser.add_argument("--expenses", type=int, default=20000)
+    parser.add_argument("--people", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--executors", nargs="+", choices=offload.COMPUTE_EXECUTORS, default=["inline", "thread", "process"])
+    parser.add_argument("--workers", type=int, default=offload.COMPUTE_WORKERS)
+    parser.add_argument("--inline-threshold", type=int, default=offload.COMPUTE_INLINE_THRESHOLD)
+    parser.add_argument("--heavy", type=int, default=2, help="Clients sending heavy requests during the loaded phase")
+    parser.add_argument("--seconds", type=float, default=10, help="Length of each phase")
+    args = parser.parse_args(argv)
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
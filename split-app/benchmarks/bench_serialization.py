@@ -0,0 +1,154 @@
+"""
+Benchmark response serialization per route.
+
+    python -m benchmarks.bench_serialization --people 1000 --page 100
+
+Builds the payload each read route returns (balances, settlements, people,
+an expense page and a single expense) and times turning it into response
+bytes two ways:
+  generic  the route declares DataResponse (data: Any) and returns a dict:
+           FastAPI validates it against the model, serializes it back to
+           Python values and the stock JSONResponse encodes those
+  fast     what the routes do now: balances and settlements build their
+           typed response model and FastJSONResponse serializes it with
+           model_dump_json; people and expenses, which are plain dicts from
+           storage, are encoded directly (orjson when installed)
+No database is needed; everything runs in-process. Reports JSON.
+"""
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from bson.objectid import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.db.codec import from_minor
+from app.models.responses import (
+    BalancesResponse, DataResponse, ExpensePageResponse, ExpenseResponse,
+    PeopleResponse, PersonBalance, Settlement, SettlementsResponse
+)
+from app.utils.json_response import ORJSON_AVAILABLE, FastJSONResponse
+from benchmarks.common import summarize
+from benchmarks.generator import person_names
+
+class GenericPageResponse(DataResponse):
+    """The untyped page model the expense list used to declare"""
+    next_cursor: Optional[str] = None
+
+def build_payloads(people: int, page: int, seed: int) -> dict:
+    """The data of each route's response, as the services return it"""
+    rng = random.Random(seed)
+    names = person_names(people)
+
+    balances = []
+    for name in names:
+        paid, share = rng.randint(0, 10 ** 7), rng.randint(0, 10 ** 7)
+        balances.append(PersonBalance(
+            name=name, total_paid=from_minor(paid), total_share=from_minor(share), balance=from_minor(paid - share)
+        ))
+
+    settlements = [
+        Settlement(from_person=rng.choice(names), to_person=rng.choice(names), amount=from_minor(rng.randint(1, 10 ** 6)))
+        for _ in range(people - 1)
+    ]
+
+    people_rows = [{"name": name, "count": rng.randint(1, 500)} for name in names]
+
+    expenses = []
+    for _ in range(page):
+        group = rng.sample(names, min(len(names), rng.randint(2, 6)))
+        amount = from_minor(rng.randint(100, 10 ** 6))
+        expenses.append({
+            "_id": str(ObjectId()),
+            "amount": amount,
+            "description": "Groceries",
+            "paid_by": group[0],
+            "split_type": "exact",
+            "participants": group,
+            "custom_split": {person: Decimal(rng.randint(1, 10 ** 5)).scaleb(-2) for person in group},
+            "version": rng.randint(1, 5),
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        })
+
+    # route: (model the route used to declare, typed model it declares now,
+    #         whether the data is response models, data, extra fields)
+    return {
+        "balances": (DataResponse, BalancesResponse, True, balances, {}),
+        "settlements": (DataResponse, SettlementsResponse, True, settlements, {}),
+        "people": (DataResponse, PeopleResponse, False, people_rows, {}),
+        "expenses_page": (GenericPageResponse, ExpensePageResponse, False, expenses, {"next_cursor": "cursor"}),
+        "expense": (DataResponse, ExpenseResponse, False, expenses[0], {})
+    }
+
+async def generic_body(field, content: dict) -> bytes:
+    """What a route declared with an untyped response model did with a dict"""
+    return JSONResponse(await serialize_response(field=field, response_content=content)).body
+
+def fast_body(model, models: bool, content: dict) -> bytes:
+    """What the routes do now"""
+    if models:
+        return FastJSONResponse(model(**content)).body
+    return FastJSONResponse(content).body
+
+async def time_route(generic_model, model, models: bool, data, extra: dict, repeat: int) -> dict:
+    field = create_response_field(name="Response", type_=generic_model)
+    content = {"success": True, "data": data, "message": "ok", **extra}
+
+    generic, fast = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        generic_bytes = await generic_body(field, content)
+        generic.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        fast_bytes = fast_body(model, models, content)
+        fast.append(time.perf_counter() - started)
+
+    # The typed model must describe the fast output exactly
+    model.model_validate_json(fast_bytes)
+    generic_summary, fast_summary = summarize(generic), summarize(fast)
+    return {
+        "bytes": len(fast_bytes),
+        "same_json": json.loads(generic_bytes) == json.loads(fast_bytes),
+        "generic": generic_summary,
+        "fast": fast_summary,
+        "speedup": round(generic_summary["median_ms"] / fast_summary["median_ms"], 2) if fast_summary["median_ms"] else None
+    }
+
+async def run(args) -> dict:
+    payloads = build_payloads(args.people, args.page, args.seed)
+    results = {}
+    for route, payload in payloads.items():
+        results[route] = await time_route(*payload, args.repeat)
+    return {
+        "benchmark": "serialization",
+        "people": args.people,
+        "page": args.page,
+        "repeat": args.repeat,
+        "orjson": ORJSON_AVAILABLE,
+        "results": results
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--people", type=int, default=1000, help="Rows in the balances, settlements and people responses")
+    parser.add_argument("--page", type=int, default=100, help="Expenses in the page response")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    return 0 if all(row["same_json"] for row in report["results"].values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
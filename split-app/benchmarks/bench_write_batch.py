@@ -0,0 +1,98 @@
+"""
+Benchmark concurrent POST /expenses with group commit off and on.
+
+    python -m benchmarks.bench_write_batch --backend sqlite --requests 5000 --concurrency 1 50 200
+    python -m benchmarks.bench_write_batch --window-ms 1 2 5 --max-size 100
+
+Seeds a ledger, then for every concurrency level sends --requests creates
+through the ASGI app, first with every create doing its own insert, ledger
+update and journal append, then through the write batcher
+(app/services/write_batcher.py) for each --window-ms. Reports requests/second
+and latency per run as JSON. Admission control is switched off so that every
+client reaches the writer. The created expenses are deleted again afterwards.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+
+from benchmarks.common import BACKENDS, backend_label, connect, environment, seed
+from benchmarks.generator import person_names
+from benchmarks.run import _http_load, expense_payload
+from app.db.repository import get_repository
+from app.main import app
+from app.middleware import admission
+from app.services import expense_service
+from app.services.write_batcher import WriteBatcher
+
+async def _cleanup(created):
+    for expense_id in created:
+        await expense_service.delete_expense(expense_id)
+    created.clear()
+
+async def _load(args, concurrency: int, rng: random.Random, names, created) -> dict:
+    result = await _http_load(
+        "POST", "/expenses/", args.requests, concurrency, lambda: expense_payload(rng, names), created
+    )
+    await _cleanup(created)
+    return result
+
+async def run(args) -> dict:
+    await connect(args.backend)
+    admission.ADMISSION_ENABLED = False
+    try:
+        await seed(args.expenses, people=args.people, seed=args.seed)
+        names = person_names(args.people)
+        created = []
+        results = {}
+        async with app.router.lifespan_context(app):
+            for concurrency in args.concurrency:
+                rng = random.Random(args.seed + concurrency)
+                runs = {}
+                expense_service.WRITE_BATCH_ENABLED = False
+                runs["off"] = await _load(args, concurrency, rng, names, created)
+
+                expense_service.WRITE_BATCH_ENABLED = True
+                for window_ms in args.window_ms:
+                    expense_service.write_batcher = WriteBatcher(
+                        expense_service._insert_batch, window_ms=window_ms, max_size=args.max_size
+                    )
+                    runs[f"on_{window_ms:g}ms"] = await _load(args, concurrency, rng, names, created)
+                    await expense_service.write_batcher.close()
+                expense_service.WRITE_BATCH_ENABLED = False
+
+                baseline = runs["off"]["requests_per_second"]
+                for name, result in runs.items():
+                    result["speedup"] = round(result["requests_per_second"] / baseline, 2) if baseline else None
+                results[f"concurrency_{concurrency}"] = runs
+
+        return {
+            "benchmark": "write_batch",
+            "backend": args.backend,
+            "database": backend_label(args.backend),
+            "dataset": {"expenses": args.expenses, "people": args.people, "seed": args.seed},
+            "settings": {"requests": args.requests, "max_size": args.max_size},
+            "environment": environment(),
+            "results": results
+        }
+    finally:
+        await get_repository().close()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=BACKENDS, default="mongo")
+    parser.add_argument("--expenses", type=int, default=10000, help="Expenses seeded before the writes")
+    parser.add_argument("--people", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=2000, help="Creates per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 50, 200])
+    parser.add_argument("--window-ms", type=float, nargs="+", default=[2])
+    parser.add_argument("--max-size", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
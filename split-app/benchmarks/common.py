@@ -0,0 +1,154 @@
+"""
+Shared benchmark plumbing: scratch database setup, seeding and timing.
+
+Benchmarks run against one of the storage backends:
+  mongo   MONGODB_URI with DB_NAME taken from BENCH_DB_NAME
+          (default expense_splitter_bench)
+  sqlite  a scratch file, BENCH_SQLITE_PATH (default
+          expense_splitter_bench.sqlite3), recreated on every run
+  memory  the in-memory repository
+Importing this module points the app at the scratch database, so import it
+before any app module.
+"""
+from typing import Dict, List
+import os
+import platform
+import statistics
+import sys
+import time
+
+# Point the app at the scratch database before it reads its configuration
+os.environ["DB_NAME"] = os.getenv("BENCH_DB_NAME", "expense_splitter_bench")
+
+from app.db.backends.sqlite import SQLiteExpenseRepository
+from app.db.database import DB_NAME, db_manager, get_expense_collection
+from app.db.repository import STORAGE_BACKENDS, create_repository, get_repository, set_repository
+from app.models.expense import ExpenseCreate
+from app.services.expense_service import _prepare_new_expense
+from app.services.ledger_service import rebuild_ledger
+from app.services.people_service import reconcile_people
+from benchmarks.generator import generate_expenses
+
+BACKENDS = STORAGE_BACKENDS
+BENCH_SQLITE_PATH = os.getenv("BENCH_SQLITE_PATH", "expense_splitter_bench.sqlite3")
+SEED_BATCH_SIZE = 5000
+
+def current_rss_kb() -> int:
+    """Resident set size right now, from /proc (Linux only; 0 elsewhere)"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def backend_label(backend: str) -> str:
+    """Where the data lives, for the JSON report"""
+    if backend == "mongo":
+        return DB_NAME
+    if backend == "sqlite":
+        return BENCH_SQLITE_PATH
+    return backend
+
+async def connect(backend: str = "mongo"):
+    """Point the app's repository at the benchmark backend and open it"""
+    if backend == "mongo":
+        if "bench" not in DB_NAME:
+            raise SystemExit(f"Refusing to seed '{DB_NAME}': benchmark database names must contain 'bench'")
+        repository = create_repository("mongo")
+    elif backend == "sqlite":
+        # Start from an empty file every run
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(BENCH_SQLITE_PATH + suffix):
+                os.remove(BENCH_SQLITE_PATH + suffix)
+        repository = SQLiteExpenseRepository(BENCH_SQLITE_PATH)
+    elif backend == "memory":
+        repository = create_repository("memory")
+    else:
+        raise SystemExit(f"Unknown backend '{backend}', expected one of: {', '.join(BACKENDS)}")
+    set_repository(repository)
+    await repository.connect()
+
+async def seed(count: int, rebuild: bool = True, **generator_options) -> bool:
+    """
+    Fill storage with a deterministic synthetic ledger. Returns True if it reseeded.
+    On MongoDB the generator settings are stored next to the data, so an
+    identical dataset from an earlier run is reused; SQLite and memory
+    start empty on every run.
+    """
+    repository = get_repository()
+    if repository.name != "mongo":
+        batch = []
+        for row in generate_expenses(count, **generator_options):
+            batch.append(_prepare_new_expense(ExpenseCreate(**row)))
+            if len(batch) >= SEED_BATCH_SIZE:
+                await _insert_through_repository(batch)
+                batch = []
+        if batch:
+            await _insert_through_repository(batch)
+        return True
+
+    settings = {"count": count, **generator_options}
+    meta = db_manager.db.bench_meta
+    if await meta.find_one({"_id": "dataset", **settings}):
+        return False
+
+    expense_collection = await get_expense_collection()
+    await expense_collection.delete_many({})
+
+    batch = []
+    for row in generate_expenses(count, **generator_options):
+        batch.append(_prepare_new_expense(ExpenseCreate(**row)))
+        if len(batch) >= SEED_BATCH_SIZE:
+            await expense_collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await expense_collection.insert_many(batch, ordered=False)
+
+    if rebuild:
+        await rebuild_ledger()
+        await reconcile_people()
+    await meta.replace_one({"_id": "dataset"}, {"_id": "dataset", **settings}, upsert=True)
+    return True
+
+async def _insert_through_repository(documents: List[dict]):
+    repository = get_repository()
+    inserted, _ = await repository.insert_expenses(documents)
+    await repository.record_changes([(None, document) for document in inserted])
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds"""
+    ordered = sorted(seconds)
+    return {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3)
+    }
+
+async def time_async(function, repeat: int) -> List[float]:
+    """Wall time of `repeat` sequential awaits of function()"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await function()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def environment() -> dict:
+    """Where the numbers came from, so runs can be compared fairly"""
+    import motor
+    import pymongo
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "motor": motor.version,
+        "pymongo": pymongo.version
+    }
@@ -0,0 +1,76 @@
+"""
+Compare two benchmark suite results and flag regressions.
+
+    python -m benchmarks.compare baseline.json results.json --threshold 15
+
+Compares median latency (and requests/second for HTTP results) of every
+measurement present in both files. Exits with status 1 when any of them
+got worse by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+def load(path: str) -> dict:
+    with open(path) as source:
+        return json.load(source)
+
+# Dataset fields that describe a single run, not the data itself
+RUN_FIELDS = ("reseeded", "seed_seconds")
+
+def dataset_settings(report: dict) -> dict:
+    return {key: value for key, value in report.get("dataset", {}).items() if key not in RUN_FIELDS}
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """One row per shared measurement: name, metric, before, after, change % and whether it regressed"""
+    rows = []
+    for name in sorted(set(baseline["results"]) & set(current["results"])):
+        before, after = baseline["results"][name], current["results"][name]
+        if "error" in before or "error" in after:
+            continue
+
+        # Lower is better for latency, higher for throughput
+        metrics = [("median_ms", 1)]
+        if "requests_per_second" in before and "requests_per_second" in after:
+            metrics.append(("requests_per_second", -1))
+
+        for metric, direction in metrics:
+            old, new = before[metric], after[metric]
+            if not old:
+                continue
+            change = (new - old) / old * 100
+            rows.append({
+                "name": name,
+                "metric": metric,
+                "baseline": old,
+                "current": new,
+                "change_pct": round(change, 1),
+                "regressed": change * direction > threshold
+            })
+    return rows
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed slowdown in percent")
+    args = parser.parse_args(argv)
+
+    baseline, current = load(args.baseline), load(args.current)
+    if dataset_settings(baseline) != dataset_settings(current):
+        print("Warning: the two runs used different datasets", file=sys.stderr)
+
+    rows = compare(baseline, current, args.threshold)
+    for row in rows:
+        flag = "REGRESSED" if row["regressed"] else "ok"
+        print(f"[{flag}] {row['name']} {row['metric']}: {row['baseline']} -> {row['current']} ({row['change_pct']:+}%)")
+
+    regressions = [row for row in rows if row["regressed"]]
+    if regressions:
+        print(f"{len(regressions)} measurements regressed by more than {args.threshold}%")
+        return 1
+    print(f"No regressions over {args.threshold}% in {len(rows)} measurements")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
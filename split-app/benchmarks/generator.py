@@ -0,0 +1,62 @@
+"""
+Deterministic synthetic ledgers for benchmarks.
+
+The same seed and settings always produce the same expenses, shaped like
+ExpenseCreate payloads (amounts as decimal strings).
+"""
+from decimal import Decimal
+from typing import Dict, Iterator, Sequence
+import random
+
+SPLIT_TYPES = ("equal", "percentage", "exact")
+
+def person_names(people: int) -> list:
+    return [f"person{i:05d}" for i in range(people)]
+
+def _cut(total: int, parts: int, rng: random.Random) -> list:
+    """Split an integer total into `parts` positive integers"""
+    if parts == 1:
+        return [total]
+    points = sorted(rng.sample(range(1, total), parts - 1))
+    return [b - a for a, b in zip([0] + points, points + [total])]
+
+def generate_expenses(
+    count: int,
+    people: int = 50,
+    min_participants: int = 2,
+    max_participants: int = 6,
+    split_mix: Sequence[float] = (0.6, 0.2, 0.2),
+    seed: int = 42
+) -> Iterator[Dict]:
+    """
+    Yield `count` expenses among `people` people.
+    split_mix weights equal, percentage and exact splits in that order.
+    """
+    rng = random.Random(seed)
+    names = person_names(people)
+    max_participants = min(max_participants, people)
+    min_participants = min(min_participants, max_participants)
+
+    for index in range(count):
+        group = rng.sample(names, rng.randint(min_participants, max_participants))
+        cents = rng.randint(100, 500000)
+        split_type = rng.choices(SPLIT_TYPES, weights=split_mix)[0]
+
+        custom_split = {}
+        if split_type == "percentage":
+            basis_points = _cut(10000, len(group), rng)
+            custom_split = {name: str(Decimal(bp).scaleb(-2)) for name, bp in zip(group, basis_points)}
+        elif split_type == "exact":
+            if cents < len(group):
+                split_type = "equal"
+            else:
+                custom_split = {name: str(Decimal(c).scaleb(-2)) for name, c in zip(group, _cut(cents, len(group), rng))}
+
+        yield {
+            "amount": str(Decimal(cents).scaleb(-2)),
+            "description": f"Expense {index}",
+            "paid_by": group[0],
+            "split_type": split_type,
+            "participants": group,
+            "custom_split": custom_split
+        }
@@ -0,0 +1,301 @@
+"""
+Benchmark suite for the service layer and the HTTP API.
+
+    python -m benchmarks.run --expenses 100000 --people 500 --output results.json
+    python -m benchmarks.run --backend memory --expenses 5000
+    python -m benchmarks.compare baseline.json results.json
+
+Seeds a deterministic synthetic ledger (see generator.py), then measures:
+  balances.<engine>     calculate_balances with every balance engine
+  settlements.<mode>    calculate_simplified_settlements, greedy and exact
+  people.list           people_service.get_all_people (GET /people/)
+  people.reconcile      rebuilding the people registry from expenses (mongo)
+  writes.create         create_expense, one at a time
+  writes.update         update_expense with optimistic versioning
+  http.<endpoint>       requests/second through the ASGI app, with
+                        --concurrency requests in flight
+and writes everything as JSON (stdout, or --output).
+"""
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from benchmarks.common import (
+    BACKENDS, backend_label, connect, current_rss_kb, environment, seed, summarize, time_async
+)
+from app.db.repository import get_repository
+from app.main import app
+from app.models.expense import ExpenseCreate, ExpenseUpdate
+from app.services import expense_service, people_service, settlement_service
+from app.services.cache_service import bump_data_version
+from app.services.settlement_engine import SETTLEMENT_MODES
+from benchmarks.generator import person_names
+
+# Marks expenses the suite writes, so they can be removed afterwards
+BENCH_DESCRIPTION = "Benchmark expense"
+
+SUITES = ("balances", "settlements", "people", "writes", "http")
+
+HTTP_ENDPOINTS = {
+    "balances": ("GET", "/balances"),
+    "settlements": ("GET", "/settlements"),
+    "people": ("GET", "/people/"),
+    "expenses_page": ("GET", "/expenses/?limit=50"),
+    "create_expense": ("POST", "/expenses/")
+}
+
+async def asgi_request(method: str, target: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+    """Send one request straight into the ASGI app, without a server or socket"""
+    path, _, query = target.partition("?")
+    headers = [(b"host", b"bench")]
+    if body is not None:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80)
+    }
+    sent_body = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body or b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    status = 0
+    chunks: List[bytes] = []
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    return status, b"".join(chunks)
+
+def expense_payload(rng: random.Random, names: List[str]) -> dict:
+    """One random equal-split expense, as the API accepts it"""
+    group = rng.sample(names, min(len(names), rng.randint(2, 5)))
+    return {
+        "amount": str(Decimal(rng.randint(100, 100000)).scaleb(-2)),
+        "description": BENCH_DESCRIPTION,
+        "paid_by": group[0],
+        "split_type": "equal",
+        "participants": group
+    }
+
+async def bench_balances(args) -> Dict[str, dict]:
+    results = {}
+    for engine in settlement_service.BALANCE_ENGINES:
+        try:
+            timings = await time_async(lambda: settlement_service.calculate_balances(engine), args.repeat)
+            results[f"balances.{engine}"] = summarize(timings)
+        except Exception as e:
+            results[f"balances.{engine}"] = {"error": str(e)}
+    return results
+
+async def bench_settlements(args) -> Dict[str, dict]:
+    results = {}
+    for mode in SETTLEMENT_MODES:
+        timings = await time_async(lambda: settlement_service.calculate_simplified_settlements(mode), args.repeat)
+        results[f"settlements.{mode}"] = summarize(timings)
+    return results
+
+async def bench_people(args) -> Dict[str, dict]:
+    results = {"people.list": summarize(await time_async(people_service.get_all_people, args.repeat))}
+    # The registry is a MongoDB collection; other backends derive people on read
+    if get_repository().name == "mongo":
+        results["people.reconcile"] = summarize(
+            await time_async(people_service.reconcile_people, max(1, args.repeat // 5))
+        )
+    return results
+
+async def bench_writes(args) -> Dict[str, dict]:
+    rng = random.Random(args.seed + 1)
+    names = person_names(args.people)
+
+    created = []
+    create_timings = []
+    for _ in range(args.writes):
+        expense = ExpenseCreate(**expense_payload(rng, names))
+        started = time.perf_counter()
+        created.append(await expense_service.create_expense(expense))
+        create_timings.append(time.perf_counter() - started)
+
+    update_timings = []
+    for expense in created:
+        update = ExpenseUpdate(amount=Decimal(rng.randint(100, 100000)).scaleb(-2), version=expense["version"])
+        started = time.perf_counter()
+        await expense_service.update_expense(expense["_id"], update)
+        update_timings.append(time.perf_counter() - started)
+
+    # Leave the dataset as it was for the next run
+    for expense in created:
+        await expense_service.delete_expense(expense["_id"])
+
+    return {"writes.create": summarize(create_timings), "writes.update": summarize(update_timings)}
+
+async def _http_load(method: str, target: str, requests: int, concurrency: int, body_factory=None, created=None) -> dict:
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            body = json.dumps(body_factory()).encode() if body_factory else None
+            started = time.perf_counter()
+            status, response = await asgi_request(method, target, body)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+            if created is not None and status == 201:
+                created.append(json.loads(response)["data"]["_id"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1) if elapsed else None,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        **summarize(latencies)
+    }
+
+async def bench_http(args) -> Dict[str, dict]:
+    rng = random.Random(args.seed + 2)
+    names = person_names(args.people)
+    results = {}
+    created: List[str] = []
+    for name, (method, target) in HTTP_ENDPOINTS.items():
+        body_factory = (lambda: expense_payload(rng, names)) if method == "POST" else None
+        # Start from a cold response cache, as after a write
+        bump_data_version()
+        results[f"http.{name}"] = await _http_load(
+            method, target, args.http_requests, args.concurrency, body_factory, created
+        )
+
+    # Take the expenses created over HTTP back out, through the service so
+    # the ledger and people registry follow
+    for expense_id in created:
+        await expense_service.delete_expense(expense_id)
+    return results
+
+BENCHMARKS = {
+    "balances": bench_balances,
+    "settlements": bench_settlements,
+    "people": bench_people,
+    "writes": bench_writes,
+    "http": bench_http
+}
+
+async def run(args) -> dict:
+    await connect(args.backend)
+    try:
+        started = time.perf_counter()
+        reseeded = await seed(
+            args.expenses,
+            people=args.people,
+            min_participants=args.min_participants,
+            max_participants=args.max_participants,
+            split_mix=args.split_mix,
+            seed=args.seed
+        )
+        seed_seconds = time.perf_counter() - started
+
+        results = {}
+        # Run the app's startup and shutdown around the suites, as a server would
+        async with app.router.lifespan_context(app):
+            for suite in args.suites:
+                results.update(await BENCHMARKS[suite](args))
+
+        return {
+            "benchmark": "suite",
+            "started_at": datetime.utcnow().isoformat() + "Z",
+            "backend": args.backend,
+            "database": backend_label(args.backend),
+            "dataset": {
+                "expenses": args.expenses,
+                "people": args.people,
+                "min_participants": args.min_participants,
+                "max_participants": args.max_participants,
+                "split_mix": args.split_mix,
+                "seed": args.seed,
+                "reseeded": reseeded,
+                "seed_seconds": round(seed_seconds, 3)
+            },
+            "settings": {
+                "repeat": args.repeat,
+                "writes": args.writes,
+                "http_requests": args.http_requests,
+                "concurrency": args.concurrency,
+                "balance_engine": settlement_service.BALANCE_ENGINE
+            },
+            "environment": environment(),
+            "peak_rss_kb": current_rss_kb(),
+            "results": results
+        }
+    finally:
+        await get_repository().close()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=BACKENDS, default="mongo")
+    parser.add_argument("--expenses", type=int, default=10000)
+    parser.add_argument("--people", type=int, default=100)
+    parser.add_argument("--min-participants", type=int, default=2)
+    parser.add_argument("--max-participants", type=int, default=6)
+    parser.add_argument(
+        "--split-mix", type=float, nargs=3, default=[0.6, 0.2, 0.2], metavar=("EQUAL", "PERCENTAGE", "EXACT"),
+        help="Relative weights of the split types"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per service-level measurement")
+    parser.add_argument("--writes", type=int, default=200, help="Expenses created and updated by the write benchmark")
+    parser.add_argument("--http-requests", type=int, default=500, help="Requests per HTTP endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="HTTP requests in flight at once")
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    report = asyncio.run(run(args))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -101,17 +101,23 @@ export default function EditExpense() {
       throw new Error("No expense ID available");
     }
     
-    // Send the data as is - your API expects the right format already
-    console.log("Submitting expense data:", data);
+    // The version the form was loaded from, so a concurrent edit is
+    // rejected with 409 instead of being overwritten
+    const payload = { ...data, version: expenseData?.version ?? 0 };
+    console.log("Submitting expense data:", payload);
     
     const response = await fetch(`http://localhost:8000/expenses/${finalExpenseId}`, {
       method: "PUT",
       headers: {
         "Content-Type": "application/json",
       },
-      body: JSON.stringify(data),
+      body: JSON.stringify(payload),
     });
 
+    if (response.status === 409) {
+      throw new Error("Someone else changed this expense meanwhile. Go back to the list to load their changes, then edit again.");
+    }
+
     if (!response.ok) {
       const errorText = await response.text();
       throw new Error(`Error ${response.status}: ${errorText}`);
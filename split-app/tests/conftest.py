@@ -0,0 +1,101 @@
+"""
+Shared fixtures.
+
+Tests are plain functions that drive their coroutines with asyncio.run, so
+every repository is opened and closed inside the event loop that uses it.
+The mongo backend runs on mongomock-motor; tests that need a real server
+(query plans, the aggregation engine) use the `mongo_database` fixture and
+are skipped when MONGODB_TEST_URI (default mongodb://localhost:27017) does
+not answer.
+"""
+from contextlib import asynccontextmanager
+import os
+
+import pytest
+
+from app.db.backends.sqlite import SQLiteExpenseRepository
+from app.db.database import db_manager
+from app.db.repository import create_repository, set_repository
+from app.services import history_service
+
+MONGODB_TEST_URI = os.getenv("MONGODB_TEST_URI", "mongodb://localhost:27017")
+MONGODB_TEST_DB = os.getenv("MONGODB_TEST_DB", "expense_splitter_test")
+
+BACKENDS = ("memory", "sqlite", "mongo")
+
+@pytest.fixture(autouse=True)
+def fresh_history(monkeypatch):
+    """Every test starts on storage whose journal has not been checked, without the backfill pause"""
+    monkeypatch.setattr(history_service, "_history_ready", False)
+    monkeypatch.setattr(history_service, "BACKFILL_SETTLE_SECONDS", 0)
+
+@pytest.fixture
+def open_repository(tmp_path, monkeypatch):
+    """
+    Async context manager factory: `async with open_repository("sqlite") as repository`
+    creates an empty repository of that backend, makes it the app's repository
+    and closes it afterwards.
+    """
+    @asynccontextmanager
+    async def opened(backend: str):
+        if backend == "sqlite":
+            repository = SQLiteExpenseRepository(str(tmp_path / "expenses.sqlite3"))
+        elif backend == "mongo":
+            from mongomock_motor import AsyncMongoMockClient, AsyncMongoMockCollection
+            # mongomock has no read preferences; read-only collections are the same collection
+            monkeypatch.setattr(AsyncMongoMockCollection, "with_options", lambda self, **options: self, raising=False)
+            await db_manager.connect(client=AsyncMongoMockClient())
+            repository = create_repository("mongo")
+        else:
+            repository = create_repository(backend)
+
+        set_repository(repository)
+        await repository.connect()
+        try:
+            yield repository
+        finally:
+            await repository.close()
+            set_repository(None)
+
+    return opened
+
+def _mongod_reachable() -> bool:
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+    client = MongoClient(MONGODB_TEST_URI, serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+@pytest.fixture
+def mongo_database(monkeypatch):
+    """
+    Async context manager factory for a scratch database on a real mongod:
+    `async with mongo_database(event_listeners=[...]) as repository`.
+    The database is dropped afterwards.
+    """
+    if not _mongod_reachable():
+        pytest.skip(f"no mongod reachable at {MONGODB_TEST_URI}")
+
+    @asynccontextmanager
+    async def opened(**client_options):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(MONGODB_TEST_URI, **client_options)
+        await client.drop_database(MONGODB_TEST_DB)
+        monkeypatch.setattr(db_manager, "db_name", MONGODB_TEST_DB)
+        await db_manager.connect(client=client)
+        repository = create_repository("mongo")
+        set_repository(repository)
+        await repository.connect()
+        try:
+            yield repository
+        finally:
+            await client.drop_database(MONGODB_TEST_DB)
+            await repository.close()
+            set_repository(None)
+
+    return opened
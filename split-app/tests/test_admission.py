@@ -0,0 +1,114 @@
+"""
+Admission control: FIFO handoff of slots, shedding with 503 once a class's
+queue is full, and no slot lost to a waiter that goes away.
+"""
+import asyncio
+import json
+
+from app.middleware import admission
+from app.middleware.admission import Limiter
+from benchmarks.run import asgi_request
+
+async def _queued(limiter: Limiter, timeout: float = 1) -> asyncio.Task:
+    """A task waiting in limiter's queue"""
+    task = asyncio.ensure_future(limiter.acquire(timeout))
+    await asyncio.sleep(0)
+    return task
+
+def test_slots_are_handed_over_in_arrival_order():
+    async def scenario():
+        limiter = Limiter("test", 1, 8)
+        assert await limiter.acquire(1) is None
+
+        admitted = []
+
+        async def request(name: str):
+            assert await limiter.acquire(1) is None
+            admitted.append(name)
+
+        tasks = []
+        for name in ("a", "b", "c", "d"):
+            tasks.append(asyncio.ensure_future(request(name)))
+            await asyncio.sleep(0)
+        assert len(limiter.waiters) == 4
+
+        for _ in tasks:
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert admitted == ["a", "b", "c", "d"]
+
+        # The slot moved from request to request; only the last holder remains
+        assert limiter.active == 1
+        limiter.release()
+        assert (limiter.active, len(limiter.waiters)) == (0, 0)
+
+    asyncio.run(scenario())
+
+def test_full_queue_is_shed_with_503(monkeypatch):
+    async def scenario():
+        limiter = Limiter("heavy", 1, 1)
+        monkeypatch.setitem(admission.limiters, "heavy", limiter)
+        assert await limiter.acquire(1) is None
+        waiting = await _queued(limiter)
+
+        status, body = await asgi_request("GET", "/balances")
+        assert status == 503
+        assert "queue_full" in json.loads(body)["detail"]
+        assert limiter.shed["queue_full"] == 1
+
+        limiter.release()
+        assert await waiting is None
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+def test_waiting_too_long_is_shed():
+    async def scenario():
+        limiter = Limiter("test", 1, 4)
+        assert await limiter.acquire(1) is None
+        assert await limiter.acquire(0.01) == "timeout"
+        assert (limiter.shed["timeout"], len(limiter.waiters)) == (1, 0)
+
+    asyncio.run(scenario())
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        limiter = Limiter("test", 1, 1)
+        assert await limiter.acquire(1) is None
+
+        # A client that disconnects while queued leaves the queue
+        waiting = await _queued(limiter)
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert len(limiter.waiters) == 0
+
+        # ...so the queue has room again
+        waiting = await _queued(limiter)
+        limiter.release()
+        assert await waiting is None
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def scenario():
+        limiter = Limiter("test", 1, 4)
+        assert await limiter.acquire(1) is None
+        first = await _queued(limiter)
+        second = await _queued(limiter)
+
+        # The slot is handed to first, which is cancelled before it runs
+        limiter.release()
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert first.cancelled()
+
+        assert await second is None
+        assert limiter.active == 1
+        limiter.release()
+        assert (limiter.active, len(limiter.waiters)) == (0, 0)
+
+    asyncio.run(scenario())
@@ -0,0 +1,150 @@
+"""
+Every balance engine must give exactly the same totals, in minor units, for
+the same stored expenses: generated equal, percentage and exact splits,
+hand-picked rounding and residue cases, legacy float documents, and
+expenses changed and deleted through the service afterwards.
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.db.codec import split_shares_minor, stored_amount_minor
+from app.models.expense import ExpenseCreate, ExpenseUpdate
+from app.services import columnar_engine, expense_service
+from app.services.expense_service import _prepare_new_expense
+from app.services.settlement_service import COLUMNAR_AVAILABLE, calculate_balances, compute_totals
+from benchmarks.generator import generate_expenses
+from benchmarks.run import asgi_request
+
+BACKENDS = ("memory", "sqlite", "mongo")
+# Engines that run on every backend; aggregate needs a real mongod (below)
+ENGINES = ("ledger", "python") + (("columnar",) if COLUMNAR_AVAILABLE else ())
+
+# Rounding and residue edge cases, as API payloads
+EDGE_CASES = [
+    # 1 minor unit over three people: the first participant takes it
+    {"amount": "0.01", "split_type": "equal", "participants": ["ann", "bob", "cy"]},
+    {"amount": "100.00", "split_type": "equal", "participants": ["ann", "bob", "cy"]},
+    {"amount": "0.05", "split_type": "equal", "participants": ["ann", "bob", "cy", "dee", "eve", "fay"]},
+    {"amount": "10.00", "split_type": "percentage", "participants": ["ann", "bob", "cy"],
+     "custom_split": {"ann": "33.33", "bob": "33.33", "cy": "33.34"}},
+    # Percentages with more digits than money has
+    {"amount": "0.07", "split_type": "percentage", "participants": ["bob", "cy", "dee"],
+     "custom_split": {"bob": "33.3333", "cy": "33.3333", "dee": "33.3334"}},
+    {"amount": "999999.99", "split_type": "percentage", "participants": ["eve", "fay"],
+     "custom_split": {"eve": "12.5", "fay": "87.5"}},
+    # Exact values may miss the amount by up to 0.01
+    {"amount": "1.00", "split_type": "exact", "participants": ["ann", "bob", "cy"],
+     "custom_split": {"ann": "0.33", "bob": "0.33", "cy": "0.33"}},
+    {"amount": "0.03", "split_type": "exact", "participants": ["dee", "eve"],
+     "custom_split": {"dee": "0.015", "eve": "0.015"}},
+]
+
+# Documents as stored before money was kept in minor units: float amounts and
+# custom_split values, no version or timestamps. Only MongoDB (and the
+# schemaless memory backend) can hold them; SQLite never had that format.
+LEGACY_BACKENDS = ("memory", "mongo")
+LEGACY_DOCUMENTS = [
+    {"amount": 10.1, "description": "legacy equal", "paid_by": "ann", "split_type": "equal",
+     "participants": ["ann", "bob", "cy"], "custom_split": {}},
+    # 2.675 is 2.67499... as a double; it is read as 2.675 and rounds to 2.68
+    {"amount": 2.675, "description": "legacy half", "paid_by": "bob", "split_type": "equal",
+     "participants": ["bob", "cy"], "custom_split": {}},
+    {"amount": 0.3, "description": "legacy percentage", "paid_by": "cy", "split_type": "percentage",
+     "participants": ["cy", "dee"], "custom_split": {"cy": 33.3, "dee": 66.7}},
+    {"amount": 12.345, "description": "legacy exact", "paid_by": "dee", "split_type": "exact",
+     "participants": ["dee", "eve"], "custom_split": {"dee": 6.17, "eve": 6.175}},
+    # The payer does not have to take part
+    {"amount": 20.0, "description": "legacy outside payer", "paid_by": "gus", "split_type": "equal",
+     "participants": ["eve", "fay"], "custom_split": {}},
+]
+
+def _payloads():
+    rows = list(generate_expenses(300, people=9, seed=11))
+    for index, case in enumerate(EDGE_CASES):
+        rows.append({"description": f"Edge case {index}", "paid_by": case["participants"][0], **case})
+    return rows
+
+async def _seed(repository):
+    """Store the dataset, then change and delete some of it through the service"""
+    documents = [_prepare_new_expense(ExpenseCreate(**row)) for row in _payloads()]
+    if repository.name in LEGACY_BACKENDS:
+        documents += [dict(row) for row in LEGACY_DOCUMENTS]
+    inserted, errors = await repository.insert_expenses(documents)
+    assert errors == []
+    await repository.record_changes([(None, document) for document in inserted])
+
+    ids = [str(document["_id"]) for document in inserted]
+    await expense_service.update_expense(ids[0], ExpenseUpdate(amount="33.33"))
+    await expense_service.update_expense(ids[1], ExpenseUpdate(split_type="percentage"))
+    await expense_service.update_expense(ids[2], ExpenseUpdate(split_type="exact"))
+    await expense_service.update_expense(ids[-1], ExpenseUpdate(amount="7.77"))
+    for expense_id in ids[10:20] + ids[-3:-2]:
+        assert await expense_service.delete_expense(expense_id)
+
+async def _expected_totals(repository) -> dict:
+    """Totals straight from the codec, as the reference every engine must match"""
+    totals = {}
+    async for document in repository.iter_expenses():
+        amount = stored_amount_minor(document)
+        row = totals.setdefault(document["paid_by"], {"total_paid": 0, "total_share": 0})
+        row["total_paid"] += amount
+        for person, share in split_shares_minor(document).items():
+            totals.setdefault(person, {"total_paid": 0, "total_share": 0})["total_share"] += share
+    return totals
+
+def _money(totals: dict) -> dict:
+    return {
+        person: (row["total_paid"], row["total_share"])
+        for person, row in totals.items()
+        if row["total_paid"] or row["total_share"]
+    }
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_engines_agree(backend, open_repository):
+    async def scenario():
+        async with open_repository(backend) as repository:
+            await _seed(repository)
+            expected = _money(await _expected_totals(repository))
+
+            for engine in ENGINES:
+                assert _money(await compute_totals(engine)) == expected, engine
+
+            balances = {engine: await calculate_balances(engine) for engine in ENGINES}
+            for engine in ENGINES[1:]:
+                assert balances[engine] == balances[ENGINES[0]], engine
+
+    asyncio.run(scenario())
+
+def test_aggregate_engine_agrees(mongo_database):
+    # mongomock cannot run BALANCE_PIPELINE ($type, $toDecimal and Decimal128
+    # arithmetic), so this one needs a real server
+    async def scenario():
+        async with mongo_database() as repository:
+            await _seed(repository)
+            expected = _money(await _expected_totals(repository))
+            for engine in ("aggregate",) + ENGINES:
+                assert _money(await compute_totals(engine)) == expected, engine
+
+    asyncio.run(scenario())
+
+def test_residue_goes_to_the_first_participants():
+    equal = _prepare_new_expense(ExpenseCreate(**EDGE_CASES[1], description="x", paid_by="ann"))
+    assert split_shares_minor(equal) == {"ann": 3334, "bob": 3333, "cy": 3333}
+
+    percentage = _prepare_new_expense(ExpenseCreate(**EDGE_CASES[4], description="x", paid_by="bob"))
+    assert split_shares_minor(percentage) == {"bob": 3, "cy": 2, "dee": 2}
+
+    assert split_shares_minor(LEGACY_DOCUMENTS[1]) == {"bob": 134, "cy": 134}
+
+def test_columnar_without_numpy_is_a_clear_400(open_repository, monkeypatch):
+    monkeypatch.setattr(columnar_engine, "COLUMNAR_AVAILABLE", False)
+
+    async def scenario():
+        async with open_repository("memory"):
+            return await asgi_request("GET", "/balances?engine=columnar")
+
+    status, body = asyncio.run(scenario())
+    assert status == 400
+    assert "requires numpy" in json.loads(body)["detail"]
@@ -0,0 +1,122 @@
+"""
+The in-memory expense state: polling picks up writes that committed after a
+later-stamped one, the full comparison repairs whatever polls missed, and a
+change stream that fails before its first change resumes without a gap.
+"""
+from datetime import datetime, timedelta
+import asyncio
+
+from pymongo.errors import PyMongoError
+
+from app.db.database import get_expense_collection
+from app.services import expense_state as expense_state_module
+from app.services.expense_state import ExpenseState
+
+def _expense(expense_id: str, updated_at: datetime) -> dict:
+    return {"_id": expense_id, "description": expense_id, "updated_at": updated_at}
+
+def test_poll_picks_up_a_write_stamped_before_the_last_poll(open_repository):
+    async def scenario():
+        async with open_repository("mongo"):
+            collection = await get_expense_collection()
+            now = datetime.utcnow()
+            await collection.insert_one(_expense("first", now))
+            state = ExpenseState()
+            await state._load()
+
+            # Stamped before "first" but committed after the load saw it
+            await collection.insert_one(_expense("late", now - timedelta(seconds=3)))
+            await state._poll_updates()
+            assert set(state.expenses) == {"first", "late"}
+
+    asyncio.run(scenario())
+
+def test_full_sync_adds_replaces_and_drops(open_repository, monkeypatch):
+    monkeypatch.setattr(expense_state_module, "EXPENSE_STATE_POLL_OVERLAP", 1)
+
+    async def scenario():
+        async with open_repository("mongo"):
+            collection = await get_expense_collection()
+            now = datetime.utcnow()
+            await collection.insert_many([_expense("kept", now), _expense("changed", now), _expense("gone", now)])
+            state = ExpenseState()
+            await state._load()
+
+            # Beyond the overlap: polls alone never see these
+            await collection.insert_one(_expense("very late", now - timedelta(hours=1)))
+            await collection.update_one({"_id": "changed"}, {"$set": {"description": "renamed"}})
+            await collection.delete_one({"_id": "gone"})
+            await state._poll_updates()
+            assert "very late" not in state.expenses
+
+            await state._sync_all()
+            assert set(state.expenses) == {"kept", "changed", "very late"}
+            assert state.expenses["changed"]["description"] == "renamed"
+
+    asyncio.run(scenario())
+
+class FakeStream:
+    """A change stream that fails on its first open and then waits for changes"""
+
+    def __init__(self, collection, resume_token):
+        self.collection = collection
+        self.resume_token = resume_token
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if len(self.collection.opened) == 1:
+            raise PyMongoError("connection reset")
+        await asyncio.Event().wait()
+
+class FakeCollection:
+    def __init__(self, open_token):
+        self.open_token = open_token
+        self.opened = []
+        self.loads = 0
+
+    def watch(self, full_document, resume_after):
+        self.opened.append(resume_after)
+        return FakeStream(self, self.open_token)
+
+    async def find(self):
+        self.loads += 1
+        yield _expense("first", datetime.utcnow())
+
+def _follow_until_reopened(monkeypatch, collection: FakeCollection):
+    async def get_collection():
+        return collection
+
+    monkeypatch.setattr(expense_state_module, "get_expense_collection", get_collection)
+    monkeypatch.setattr(expense_state_module, "EXPENSE_STATE_RETRY_DELAY", 0)
+
+    async def scenario():
+        state = ExpenseState()
+        task = asyncio.ensure_future(state._follow_change_stream())
+        while len(collection.opened) < 2:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return state
+
+    return asyncio.run(scenario())
+
+def test_stream_failing_before_its_first_change_resumes_from_where_it_opened(monkeypatch):
+    collection = FakeCollection("opened")
+    state = _follow_until_reopened(monkeypatch, collection)
+    assert collection.opened == [None, "opened"]
+    assert collection.loads == 1 and state.warm
+
+def test_stream_without_a_resume_point_reloads(monkeypatch):
+    # A stream that reports no resume token until its first change
+    collection = FakeCollection(None)
+    _follow_until_reopened(monkeypatch, collection)
+    assert collection.opened == [None, None]
+    assert collection.loads == 2
@@ -0,0 +1,32 @@
+"""
+PUT /expenses/{id} needs the version the edit is based on: without it the
+update is a 428, and an edit based on an older version is a 409.
+"""
+import asyncio
+import json
+
+from benchmarks.run import asgi_request
+
+EXPENSE = {"amount": "30", "description": "dinner", "paid_by": "ann", "participants": ["ann", "bob"]}
+
+def test_update_requires_the_current_version(open_repository):
+    async def scenario():
+        async with open_repository("memory"):
+            status, body = await asgi_request("POST", "/expenses/", json.dumps(EXPENSE).encode())
+            assert status == 201, body
+            expense = json.loads(body)["data"]
+            target = f"/expenses/{expense['_id']}"
+
+            status, _ = await asgi_request("PUT", target, json.dumps({"description": "lunch"}).encode())
+            assert status == 428
+
+            update = {"description": "lunch", "version": expense["version"]}
+            status, body = await asgi_request("PUT", target, json.dumps(update).encode())
+            assert status == 200
+            assert json.loads(body)["data"]["version"] == expense["version"] + 1
+
+            # The same edit again is based on a version that is gone now
+            status, _ = await asgi_request("PUT", target, json.dumps(update).encode())
+            assert status == 409
+
+    asyncio.run(scenario())
@@ -0,0 +1,48 @@
+"""
+Exports write amounts the way the API does: expense amounts as numbers,
+balances as strings. CSV cells a spreadsheet would run as formulas are quoted.
+"""
+import asyncio
+import csv
+import io
+import json
+
+from benchmarks.run import asgi_request
+
+EXPENSE = {"amount": "30.10", "description": "dinner", "paid_by": "ann", "participants": ["ann", "bob"]}
+
+def test_ndjson_exports_match_the_api(open_repository):
+    async def scenario():
+        async with open_repository("memory"):
+            await asgi_request("POST", "/expenses/", json.dumps(EXPENSE).encode())
+            _, expenses = await asgi_request("GET", "/expenses/export?format=ndjson")
+            _, balances = await asgi_request("GET", "/balances/export?format=ndjson")
+            return expenses, balances
+
+    expenses, balances = asyncio.run(scenario())
+    [expense] = [json.loads(line) for line in expenses.splitlines()]
+    assert expense["amount"] == 30.1
+    rows = {row["name"]: row for row in map(json.loads, balances.splitlines())}
+    assert rows["bob"]["balance"] == "-15.05"
+
+def test_csv_cells_are_not_run_as_formulas(open_repository):
+    payload = {
+        "amount": "12", "description": "=HYPERLINK(\"http://evil\")", "paid_by": "@ann",
+        "participants": ["@ann", "-bob"]
+    }
+
+    async def scenario():
+        async with open_repository("memory"):
+            status, body = await asgi_request("POST", "/expenses/", json.dumps(payload).encode())
+            assert status == 201, body
+            _, expenses = await asgi_request("GET", "/expenses/export?format=csv")
+            _, balances = await asgi_request("GET", "/balances/export?format=csv")
+            return expenses, balances
+
+    expenses, balances = asyncio.run(scenario())
+    [row] = list(csv.DictReader(io.StringIO(expenses.decode())))
+    assert row["description"] == "'=HYPERLINK(\"http://evil\")"
+    assert row["paid_by"] == "'@ann"
+    assert row["participants"] == "'@ann;-bob"
+    rows = {row["name"]: row for row in csv.DictReader(io.StringIO(balances.decode()))}
+    assert rows["'-bob"]["balance"] == "-6.00"
@@ -0,0 +1,120 @@
+"""
+Backfilling the expense journal: once for every process sharing the
+storage, idempotent, and exact while writes go on.
+"""
+from datetime import datetime, timedelta
+import asyncio
+
+import pytest
+
+from app.models.expense import ExpenseCreate, ExpenseUpdate
+from app.services import expense_service, history_service
+from app.services.expense_service import _prepare_new_expense
+from app.services.history_service import HISTORY_MARKER, build_events, ensure_history, verify_history
+from benchmarks.generator import generate_expenses
+
+BACKENDS = ("memory", "sqlite", "mongo")
+
+async def _store_unjournaled(repository, count: int) -> list:
+    """Expenses as stored before the journal existed: on the ledger but not journaled"""
+    documents = [_prepare_new_expense(ExpenseCreate(**row)) for row in generate_expenses(count, people=5, seed=3)]
+    inserted, errors = await repository.insert_expenses(documents)
+    assert errors == []
+    await repository.record_changes([(None, document) for document in inserted])
+    return inserted
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_markers(backend, open_repository):
+    async def scenario():
+        async with open_repository(backend) as repository:
+            assert await repository.read_marker("job") is None
+            recent = datetime.utcnow() - timedelta(minutes=5)
+            assert await repository.claim_marker("job", "a", recent)
+            assert not await repository.claim_marker("job", "b", recent)
+            # Renewing a claim
+            assert await repository.claim_marker("job", "a", recent)
+
+            # A claim older than stale_before is taken over
+            assert await repository.claim_marker("job", "b", datetime.utcnow() + timedelta(days=1))
+            assert not await repository.complete_marker("job", "a")
+            assert await repository.complete_marker("job", "b")
+            marker = await repository.read_marker("job")
+            assert (marker["state"], marker["owner"]) == ("done", "b")
+            assert not await repository.claim_marker("job", "c", datetime.utcnow() + timedelta(days=1))
+
+            await repository.delete_marker("job")
+            assert await repository.read_marker("job") is None
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_concurrent_backfills_journal_once(backend, open_repository, monkeypatch):
+    monkeypatch.setattr(history_service, "BACKFILL_POLL_SECONDS", 0.01)
+
+    async def scenario():
+        async with open_repository(backend) as repository:
+            await _store_unjournaled(repository, 50)
+
+            # Two processes starting at once: one backfills, the other waits for it
+            written = await asyncio.gather(ensure_history(), ensure_history())
+            assert sorted(written) == [0, 50]
+            assert await repository.count_events() == 50
+            assert await verify_history() == []
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backfill_again_adds_nothing(backend, open_repository, monkeypatch):
+    async def scenario():
+        async with open_repository(backend) as repository:
+            inserted = await _store_unjournaled(repository, 20)
+            assert await ensure_history() == 20
+
+            # The same change journaled again is stored once
+            await repository.append_events(build_events([(None, inserted[0])]))
+            assert await repository.count_events() == 20
+
+            # A journal that already covers every expense (say, from before
+            # the marker existed) is left as it is
+            await repository.delete_marker(HISTORY_MARKER)
+            monkeypatch.setattr(history_service, "_history_ready", False)
+            assert await ensure_history() == 0
+            assert await repository.count_events() == 20
+            assert await verify_history() == []
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backfill_is_exact_while_writes_go_on(backend, open_repository, monkeypatch):
+    async def scenario():
+        async with open_repository(backend) as repository:
+            inserted = await _store_unjournaled(repository, 30)
+            ids = [document["_id"] for document in inserted]
+            iter_expenses = repository.iter_expenses
+
+            async def writes_midway(batch_size=1000, read_only=False):
+                # Journaled writes to expenses the scan has and has not reached
+                # yet; small batches, so later ones are read after the writes
+                async for position, expense in _enumerate(iter_expenses(4, read_only)):
+                    yield expense
+                    if position == 10:
+                        await expense_service.create_expense(ExpenseCreate(
+                            amount="40", description="during backfill", paid_by="ann", participants=["ann", "bob"]
+                        ))
+                        await expense_service.update_expense(ids[5], ExpenseUpdate(amount="12.34"))
+                        await expense_service.update_expense(ids[20], ExpenseUpdate(amount="56.78"))
+                        await expense_service.update_expense(ids[20], ExpenseUpdate(split_type="percentage"))
+                        assert await expense_service.delete_expense(ids[3])
+                        assert await expense_service.delete_expense(ids[25])
+
+            monkeypatch.setattr(repository, "iter_expenses", writes_midway)
+            await ensure_history()
+            assert await verify_history() == []
+
+    asyncio.run(scenario())
+
+async def _enumerate(iterator):
+    position = 0
+    async for item in iterator:
+        yield position, item
+        position += 1
@@ -0,0 +1,50 @@
+"""
+Money on the wire: expense amounts are JSON numbers, as they always were, and
+balances and settlements are strings with the currency's decimals.
+"""
+from decimal import Decimal
+import asyncio
+import json
+
+from app.models.expense import ExpenseOut
+from benchmarks.run import asgi_request
+
+EXPENSE = {
+    "amount": "30.10", "description": "dinner", "paid_by": "ann",
+    "participants": ["ann", "bob"], "split_type": "exact",
+    "custom_split": {"ann": "15.05", "bob": 15.05}
+}
+
+def test_expense_amounts_are_numbers_and_balances_strings(open_repository):
+    async def scenario():
+        async with open_repository("memory"):
+            status, body = await asgi_request("POST", "/expenses/", json.dumps(EXPENSE).encode())
+            assert status == 201, body
+            created = json.loads(body)["data"]
+            assert created["amount"] == 30.1
+            assert created["custom_split"] == {"ann": 15.05, "bob": 15.05}
+
+            update = {"amount": 40, "custom_split": {"ann": 20, "bob": 20}, "version": created["version"]}
+            status, body = await asgi_request("PUT", f"/expenses/{created['_id']}", json.dumps(update).encode())
+            assert status == 200, body
+            assert json.loads(body)["data"]["amount"] == 40
+
+            status, body = await asgi_request("GET", "/expenses/")
+            assert status == 200
+            assert [expense["amount"] for expense in json.loads(body)["data"]] == [40]
+
+            status, body = await asgi_request("GET", "/balances")
+            assert status == 200
+            balances = {row["name"]: row for row in json.loads(body)["data"]}
+            assert balances["ann"]["balance"] == "20.00"
+
+    asyncio.run(scenario())
+
+def test_expense_model_writes_numbers():
+    expense = ExpenseOut(
+        _id="x", amount=Decimal("12.50"), description="taxi", paid_by="ann",
+        split_type="percentage", participants=["ann"], custom_split={"ann": Decimal("100")}
+    )
+    data = json.loads(expense.model_dump_json(by_alias=True))
+    assert data["amount"] == 12.5
+    assert data["custom_split"] == {"ann": 100}
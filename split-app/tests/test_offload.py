@@ -0,0 +1,69 @@
+"""
+Offloading balance and settlement computation keeps the event loop free:
+cheap requests stay fast while heavy ones run.
+"""
+import asyncio
+import time
+
+from app.models.expense import ExpenseCreate
+from app.services import cache_service
+from app.services.expense_service import _prepare_new_expense
+from app.utils import offload
+from benchmarks.generator import generate_expenses
+from benchmarks.run import asgi_request
+
+HEAVY_TARGETS = ("/balances?engine=python", "/settlements", "/balances?engine=python")
+PROBES = 100
+PROBE_INTERVAL = 0.01
+# Inline, a probe waits behind whole computations (seconds on this ledger)
+PROBE_P99_BOUND = 0.25
+
+def test_probe_stays_fast_under_heavy_requests(open_repository, monkeypatch):
+    monkeypatch.setattr(offload, "COMPUTE_EXECUTOR", "thread")
+    monkeypatch.setattr(offload, "COMPUTE_WORKERS", 2)
+    monkeypatch.setattr(offload, "COMPUTE_INLINE_THRESHOLD", 1000)
+    monkeypatch.setattr(offload, "_executor", None)
+
+    async def scenario():
+        async with open_repository("memory") as repository:
+            documents = [
+                _prepare_new_expense(ExpenseCreate(**row))
+                for row in generate_expenses(10000, people=2000, seed=1)
+            ]
+            inserted, _ = await repository.insert_expenses(documents)
+            await repository.record_changes([(None, document) for document in inserted])
+
+            stop = False
+
+            async def heavy(target: str):
+                while not stop:
+                    # Each one computes afresh instead of hitting the cache
+                    cache_service.bump_data_version()
+                    status, _ = await asgi_request("GET", target)
+                    assert status == 200
+
+            tasks = [asyncio.ensure_future(heavy(target)) for target in HEAVY_TARGETS]
+            await asyncio.sleep(0.05)
+
+            # Latency from when each probe was due, so time spent waiting
+            # for a blocked loop to schedule it is counted
+            latencies = []
+            start = time.perf_counter()
+            for index in range(PROBES):
+                due = start + index * PROBE_INTERVAL
+                await asyncio.sleep(max(0, due - time.perf_counter()))
+                status, _ = await asgi_request("GET", "/")
+                latencies.append(time.perf_counter() - due)
+                assert status == 200
+
+            stop = True
+            await asyncio.gather(*tasks)
+
+            latencies.sort()
+            p99 = latencies[int(len(latencies) * 0.99) - 1]
+            assert p99 < PROBE_P99_BOUND, f"probe p99 {p99 * 1000:.1f} ms"
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        offload.shutdown()
@@ -0,0 +1,178 @@
+"""
+Query plans of the commands the MongoDB repository really sends.
+
+Every repository method is called against a real mongod while a command
+listener records what it sends; each recorded query is then explained and
+must not fall back to a collection scan unless the method reads or clears a
+whole collection by design. Every find must also appear in QUERY_PLANS, so
+`python -m app.cli indexes explain` checks the same queries in production.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import asyncio
+import copy
+
+from pymongo import monitoring
+
+from app.db.database import db_manager
+from app.db.indexes import QUERY_PLANS, plan_stages
+from app.models.expense import ExpenseCreate
+from app.services.expense_service import _prepare_new_expense
+from app.services.history_service import build_events
+from benchmarks.generator import generate_expenses
+
+# Commands whose query can be explained; inserts have none, and a count
+# without a query is answered from collection metadata
+EXPLAINABLE = ("find", "aggregate", "count", "distinct", "findAndModify", "update", "delete")
+# Driver and session fields explain does not accept inside the explained command
+SESSION_FIELDS = (
+    "lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit", "startTransaction",
+    "readConcern", "writeConcern"
+)
+# Methods that read or clear a whole collection by design
+COLLSCAN_METHODS = ("scan_expenses", "aggregate_totals", "ledger_totals", "clear_history")
+
+class CommandRecorder(monitoring.CommandListener):
+    """Records the explainable commands sent while a repository method runs"""
+
+    def __init__(self):
+        self.method = None
+        self.commands = []
+
+    @contextmanager
+    def recording(self, method: str):
+        self.method = method
+        try:
+            yield
+        finally:
+            self.method = None
+
+    def started(self, event):
+        if self.method and event.command_name in EXPLAINABLE:
+            self.commands.append((self.method, copy.deepcopy(dict(event.command))))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def _explainable(command: dict):
+    """The command without session fields, one statement per update or delete"""
+    name = next(iter(command))
+    body = {field: value for field, value in command.items() if field not in SESSION_FIELDS}
+    if name == "count" and not body.get("query"):
+        return
+    statements = {"update": "updates", "delete": "deletes"}.get(name)
+    if statements:
+        for statement in body[statements]:
+            yield {**body, statements: [statement]}
+    else:
+        yield body
+
+def _shape(value):
+    """A filter with its values left out, to compare with QUERY_PLANS"""
+    if isinstance(value, dict):
+        return tuple(sorted(((field, _shape(item)) for field, item in value.items()), key=lambda item: item[0]))
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return tuple(_shape(item) for item in value)
+    return None
+
+def _sort_shape(sort):
+    if not sort:
+        return None
+    return tuple(tuple(key) for key in (sort.items() if isinstance(sort, dict) else sort))
+
+def _by_id(query: dict) -> bool:
+    """A lookup by _id alone, which always uses the _id index"""
+    return set(query) == {"_id"} and not isinstance(query["_id"], dict)
+
+async def _drain(iterator):
+    return [item async for item in iterator]
+
+async def _exercise(repository, recorder: CommandRecorder):
+    """Call every repository method once, recording what each sends"""
+    documents = [_prepare_new_expense(ExpenseCreate(**row)) for row in generate_expenses(200, people=6, seed=5)]
+    with recorder.recording("insert_expenses"):
+        inserted, errors = await repository.insert_expenses(documents)
+    assert errors == []
+    first, second = inserted[0], inserted[1]
+    now = datetime.utcnow()
+
+    calls = [
+        ("record_changes", lambda: repository.record_changes([(None, document) for document in inserted])),
+        ("list_expenses", lambda: repository.list_expenses(None, 0, 11)),
+        ("list_expenses", lambda: repository.list_expenses(first["_id"], 0, 11)),
+        ("get_expense", lambda: repository.get_expense(first["_id"])),
+        ("expense_exists", lambda: repository.expense_exists(first["_id"])),
+        ("update_expense", lambda: repository.update_expense(
+            first["_id"], {"description": "renamed"}, first.get("version", 0)
+        )),
+        ("update_expense", lambda: repository.update_expense(second["_id"], {"description": "renamed"}, None)),
+        ("delete_expense", lambda: repository.delete_expense(second["_id"])),
+        ("record_changes", lambda: repository.record_changes([(second, None)])),
+        ("iter_expenses", lambda: _drain(repository.iter_expenses())),
+        ("scan_expenses", lambda: _drain(repository.scan_expenses(["paid_by", "participants"]))),
+        ("person_expenses", lambda: _drain(repository.person_expenses(first["paid_by"]))),
+        ("count_expenses", repository.count_expenses),
+        ("ledger_totals", repository.ledger_totals),
+        ("aggregate_totals", repository.aggregate_totals),
+        ("list_people", repository.list_people),
+        ("read_data_version", repository.read_data_version),
+        ("advance_data_version", repository.advance_data_version),
+        ("claim_marker", lambda: repository.claim_marker("job", "owner", datetime(2000, 1, 1))),
+        ("read_marker", lambda: repository.read_marker("job")),
+        ("complete_marker", lambda: repository.complete_marker("job", "owner")),
+        ("delete_marker", lambda: repository.delete_marker("job")),
+        ("append_events", lambda: repository.append_events(build_events([(None, first)]))),
+        ("iter_events", lambda: _drain(repository.iter_events(None, now))),
+        ("iter_events", lambda: _drain(repository.iter_events(datetime(2000, 1, 1), now))),
+        ("count_events", repository.count_events),
+        ("save_checkpoint", lambda: repository.save_checkpoint({"at": datetime(2000, 1, 1), "totals": {}})),
+        ("latest_checkpoint", lambda: repository.latest_checkpoint(now)),
+        ("clear_history", repository.clear_history),
+    ]
+    for method, call in calls:
+        with recorder.recording(method):
+            await call()
+
+def test_repository_queries_use_indexes(mongo_database):
+    recorder = CommandRecorder()
+
+    async def scenario():
+        async with mongo_database(event_listeners=[recorder]) as repository:
+            await _exercise(repository, recorder)
+            assert recorder.commands
+
+            scans = []
+            for method, command in recorder.commands:
+                for explained in _explainable(command):
+                    explain = await db_manager.db.command({"explain": explained, "verbosity": "queryPlanner"})
+                    if "COLLSCAN" in plan_stages(explain) and method not in COLLSCAN_METHODS:
+                        scans.append((method, explained))
+            assert scans == []
+
+    asyncio.run(scenario())
+
+def test_query_plans_cover_repository_finds(mongo_database):
+    recorder = CommandRecorder()
+    registered = {
+        (query.collection, _shape(query.filter), _sort_shape(query.sort))
+        for query in QUERY_PLANS if query.pipeline is None
+    }
+
+    async def scenario():
+        async with mongo_database(event_listeners=[recorder]) as repository:
+            await _exercise(repository, recorder)
+
+            missing = []
+            for method, command in recorder.commands:
+                query = command.get("filter", {})
+                if next(iter(command)) != "find" or _by_id(query):
+                    continue
+                if (command["find"], _shape(query), _sort_shape(command.get("sort"))) not in registered:
+                    missing.append((method, command["find"], query, command.get("sort")))
+            # Add these to QUERY_PLANS in app/db/indexes.py
+            assert missing == []
+
+    asyncio.run(scenario())
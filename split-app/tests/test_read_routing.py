@@ -0,0 +1,47 @@
+"""
+Which MongoDB reads may go to the configured read preference.
+
+Results cached under the data version must be computed from the primary;
+only uncached reads (expense pages and the expense export) may use a
+secondary.
+"""
+from datetime import datetime
+import asyncio
+
+from app.db.database import db_manager
+from app.models.expense import ExpenseCreate
+from app.services import expense_service, export_service, people_service, settlement_service
+from app.services.history_service import totals_as_of
+
+def test_cached_results_read_the_primary(open_repository, monkeypatch):
+    async def scenario():
+        async with open_repository("mongo"):
+            await expense_service.create_expense(ExpenseCreate(
+                amount="30", description="dinner", paid_by="ann", participants=["ann", "bob"]
+            ))
+
+            routed = []
+            get_collection = db_manager.get_collection
+
+            async def spy(name, read_only=False):
+                routed.append((name, read_only))
+                return await get_collection(name, read_only)
+
+            monkeypatch.setattr(db_manager, "get_collection", spy)
+
+            for engine in ("ledger", "python", "columnar"):
+                await settlement_service.calculate_balances(engine)
+            await settlement_service.calculate_simplified_settlements()
+            await settlement_service.calculate_person_balance("ann")
+            await settlement_service.calculate_person_settlements("ann")
+            await people_service.get_all_people()
+            await totals_as_of(datetime.utcnow())
+            assert routed and [read for read in routed if read[1]] == []
+
+            routed.clear()
+            await expense_service.get_all_expenses(limit=10)
+            async for _ in export_service.stream_expenses("ndjson"):
+                pass
+            assert routed and all(read_only for _, read_only in routed)
+
+    asyncio.run(scenario())
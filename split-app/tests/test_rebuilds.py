@@ -0,0 +1,89 @@
+"""
+Ledger rebuilds and people reconciles hold expense writes off: writes made
+while the collection is recomputed and swapped in are not lost, and
+processes that ask for a rebuild at the same time rebuild once.
+"""
+import asyncio
+
+import pytest
+
+from app.db.repository import get_repository
+from app.models.expense import ExpenseCreate
+from app.services import expense_service, ledger_service, people_service, rebuild_gate
+from app.services.rebuild_gate import LEDGER_MARKER
+
+@pytest.fixture(autouse=True)
+def quick_rebuilds(monkeypatch):
+    monkeypatch.setattr(rebuild_gate, "REBUILD_CHECK_SECONDS", 0.01)
+    monkeypatch.setattr(rebuild_gate, "REBUILD_SETTLE_SECONDS", 0.01)
+    monkeypatch.setattr(rebuild_gate, "REBUILD_POLL_SECONDS", 0.005)
+    monkeypatch.setattr(rebuild_gate, "_clear_until", 0.0)
+
+def _expense(n: int) -> ExpenseCreate:
+    return ExpenseCreate(amount=f"{n + 1}.25", description=f"expense {n}", paid_by="ann", participants=["ann", f"p{n % 7}"])
+
+def _slow_scan(monkeypatch, module=ledger_service, name="compute_totals_from_expenses"):
+    """Leave time between reading the expenses and swapping the result in, as a large scan would"""
+    compute = getattr(module, name)
+
+    async def slow(*args, **kwargs):
+        result = await compute(*args, **kwargs)
+        await asyncio.sleep(0.05)
+        return result
+
+    monkeypatch.setattr(module, name, slow)
+
+async def _write_meanwhile(rebuild):
+    """Create expenses while rebuild runs, and return its result"""
+    async def write():
+        for n in range(10, 40):
+            await expense_service.create_expense(_expense(n))
+            await asyncio.sleep(0.002)
+
+    writes = asyncio.ensure_future(write())
+    await asyncio.sleep(0.005)
+    result = await rebuild()
+    await writes
+    return result
+
+def test_writes_during_a_rebuild_are_kept(open_repository, monkeypatch):
+    _slow_scan(monkeypatch)
+
+    async def scenario():
+        async with open_repository("mongo"):
+            for n in range(10):
+                await expense_service.create_expense(_expense(n))
+
+            assert await _write_meanwhile(ledger_service.rebuild_ledger) is not None
+            assert await ledger_service.verify_ledger() == []
+            assert await get_repository().read_marker(LEDGER_MARKER) is None
+
+    asyncio.run(scenario())
+
+def test_concurrent_rebuilds_run_once(open_repository, monkeypatch):
+    _slow_scan(monkeypatch)
+
+    async def scenario():
+        async with open_repository("mongo"):
+            for n in range(5):
+                await expense_service.create_expense(_expense(n))
+
+            results = await asyncio.gather(*[ledger_service.rebuild_ledger() for _ in range(3)])
+            assert sorted(results, key=lambda result: result is None) == [6, None, None]
+            assert await ledger_service.verify_ledger() == []
+
+    asyncio.run(scenario())
+
+def test_writes_during_a_people_reconcile_are_kept(open_repository, monkeypatch):
+    _slow_scan(monkeypatch, people_service, "count_people_from_expenses")
+
+    async def scenario():
+        async with open_repository("mongo") as repository:
+            for n in range(10):
+                await expense_service.create_expense(_expense(n))
+
+            assert await _write_meanwhile(people_service.reconcile_people) is not None
+            expected = await people_service.count_people_from_expenses()
+            assert {person["name"]: person["count"] for person in await repository.list_people()} == expected
+
+    asyncio.run(scenario())
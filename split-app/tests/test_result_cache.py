@@ -0,0 +1,178 @@
+"""
+The result cache: invalidation through the shared data version, and
+single-flight computation of concurrent misses.
+"""
+import asyncio
+
+from app.db.backends.sqlite import SQLiteExpenseRepository
+from app.services import cache_service
+from app.services.cache_service import ResultCache, advance_data_version, make_etag, result_cache
+
+def _request(coroutine):
+    """Run coroutine as its own task, the way each HTTP request is"""
+    return asyncio.ensure_future(coroutine)
+
+def test_write_through_another_process_invalidates(open_repository, tmp_path):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def scenario():
+        async with open_repository("sqlite"):
+            assert await _request(result_cache.get_or_compute("totals", None, compute)) == 1
+            etag = await _request(make_etag("totals"))
+            assert await _request(result_cache.get_or_compute("totals", None, compute)) == 1
+            assert await _request(make_etag("totals")) == etag
+
+            # Another API process on the same database records a write
+            other = SQLiteExpenseRepository(str(tmp_path / "expenses.sqlite3"))
+            await other.connect()
+            try:
+                await other.advance_data_version()
+            finally:
+                await other.close()
+
+            assert await _request(make_etag("totals")) != etag
+            assert await _request(result_cache.get_or_compute("totals", None, compute)) == 2
+
+    asyncio.run(scenario())
+
+def test_etag_follows_the_shared_version(open_repository):
+    async def scenario():
+        async with open_repository("memory") as repository:
+            await _request(advance_data_version())
+            epoch, count = await repository.read_data_version()
+            etag = await _request(make_etag("people"))
+            assert f"-{epoch}.{count}-" in etag
+
+            # Process-local invalidations leave it alone, so every replica at
+            # this shared version hands out the same ETag
+            cache_service.bump_data_version()
+            assert await _request(make_etag("people")) == etag
+
+            await _request(advance_data_version())
+            assert await _request(make_etag("people")) != etag
+
+    asyncio.run(scenario())
+
+def test_concurrent_misses_compute_once(open_repository):
+    cache = ResultCache(16)
+    calls = []
+    release = asyncio.Event()
+
+    async def compute():
+        calls.append(1)
+        await release.wait()
+        return len(calls)
+
+    async def scenario():
+        async with open_repository("memory"):
+            requests = [_request(cache.get_or_compute("balances", None, compute)) for _ in range(50)]
+            await asyncio.sleep(0.01)
+            release.set()
+            assert await asyncio.gather(*requests) == [1] * 50
+            assert len(calls) == 1
+            assert (cache.misses, cache.coalesced) == (1, 49)
+            assert not cache.inflight
+
+            # Now cached
+            assert await _request(cache.get_or_compute("balances", None, compute)) == 1
+            assert cache.hits == 1
+
+    asyncio.run(scenario())
+
+def test_cancelled_waiter_does_not_cancel_the_computation(open_repository):
+    cache = ResultCache(16)
+    calls = []
+    release = asyncio.Event()
+
+    async def compute():
+        calls.append(1)
+        await release.wait()
+        return "settlements"
+
+    async def scenario():
+        async with open_repository("memory"):
+            first = _request(cache.get_or_compute("settlements", None, compute))
+            second = _request(cache.get_or_compute("settlements", None, compute))
+            await asyncio.sleep(0.01)
+
+            # The request that started the computation goes away
+            first.cancel()
+            await asyncio.sleep(0.01)
+            assert first.cancelled()
+
+            release.set()
+            assert await second == "settlements"
+            assert len(calls) == 1
+            assert await _request(cache.get_or_compute("settlements", None, compute)) == "settlements"
+            assert len(calls) == 1
+
+    asyncio.run(scenario())
+
+def test_abandoned_computation_is_cancelled(open_repository):
+    cache = ResultCache(16)
+    started = asyncio.Event()
+    cancelled = []
+
+    async def compute():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def scenario():
+        async with open_repository("memory"):
+            request = _request(cache.get_or_compute("people", None, compute))
+            await started.wait()
+            request.cancel()
+            await asyncio.sleep(0.01)
+            # With every waiter gone nobody needs it; the next miss starts afresh
+            assert cancelled == [1]
+            assert not cache.inflight
+
+    asyncio.run(scenario())
+
+def test_failure_reaches_every_waiter_and_is_not_cached(open_repository):
+    cache = ResultCache(16)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("storage went away")
+
+    async def scenario():
+        async with open_repository("memory"):
+            requests = [_request(cache.get_or_compute("balances", None, compute)) for _ in range(5)]
+            results = await asyncio.gather(*requests, return_exceptions=True)
+            assert all(isinstance(result, ValueError) for result in results)
+            assert len(calls) == 1
+
+            await asyncio.gather(_request(cache.get_or_compute("balances", None, compute)), return_exceptions=True)
+            assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+def test_result_of_a_computation_overtaken_by_a_write_is_not_cached(open_repository):
+    cache = ResultCache(16)
+    release = asyncio.Event()
+
+    async def compute():
+        await release.wait()
+        return "old totals"
+
+    async def scenario():
+        async with open_repository("memory"):
+            request = _request(cache.get_or_compute("balances", None, compute))
+            await asyncio.sleep(0.01)
+            cache_service.bump_data_version()
+            release.set()
+            assert await request == "old totals"
+            assert not cache.entries
+
+    asyncio.run(scenario())
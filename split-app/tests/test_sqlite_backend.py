@@ -0,0 +1,39 @@
+"""
+SQLite backend: a failing row in a bulk insert fails alone.
+"""
+import asyncio
+
+from app.models.expense import ExpenseCreate
+from app.services.expense_service import _prepare_new_expense
+
+def _expense(description: str) -> dict:
+    return _prepare_new_expense(ExpenseCreate(
+        amount="9", description=description, paid_by="ann", participants=["ann", "bob", "cy"]
+    ))
+
+def test_insert_expenses_reports_failed_rows(open_repository):
+    async def scenario():
+        async with open_repository("sqlite") as repository:
+            documents = [_expense("one"), _expense("two"), _expense("three"), _expense("four")]
+            documents[1]["description"] = None
+            del documents[3]["updated_at"]
+
+            inserted, errors = await repository.insert_expenses(documents)
+
+            assert [position for position, _ in errors] == [1, 3]
+            assert "NOT NULL" in errors[0][1]
+            assert "updated_at" in errors[1][1]
+            assert [document["description"] for document in inserted] == ["one", "three"]
+
+            # The rows that went in are complete, share rows included
+            stored = [document async for document in repository.iter_expenses()]
+            assert sorted(document["_id"] for document in stored) == sorted(document["_id"] for document in inserted)
+            totals = await repository.ledger_totals()
+            assert totals["ann"]["total_paid"] == 1800
+            assert totals["bob"]["expense_count"] == 2
+
+            # The transaction was committed and the connection is usable again
+            assert await repository.insert_expense(_expense("five"))
+            assert await repository.count_expenses() == 3
+
+    asyncio.run(scenario())
@@ -0,0 +1,85 @@
+"""
+Stable settlement plans against a full recompute on random ledgers.
+
+Each ledger starts from a greedy plan for random balances; random expenses
+are then applied one at a time and every step is planned both ways. A stable
+plan must settle the new balances exactly within the rebuild bound, leave
+transfers between people whose balances did not change as they were, and
+touch fewer transfers overall than recomputing from scratch.
+"""
+import random
+from typing import Dict, List
+
+import pytest
+
+from app.services import settlement_engine
+from app.services.settlement_engine import diff_transfers, greedy_transfers, plan_nets, stable_transfers
+
+LEDGERS = 30
+MOST_PEOPLE = 30
+WRITES = 20
+
+def _random_expense(rng: random.Random, names: List[str]) -> Dict[str, int]:
+    """Balance changes of one random equal-split expense, in cents"""
+    group = rng.sample(names, rng.randint(1, min(len(names), 6)))
+    payer = rng.choice(names)
+    amount = rng.randint(1, 100000)
+    share, remainder = divmod(amount, len(group))
+    change = {payer: amount}
+    for index, name in enumerate(group):
+        change[name] = change.get(name, 0) - share - (1 if index < remainder else 0)
+    return change
+
+def _apply(cents: Dict[str, int], change: Dict[str, int]):
+    for name, amount in change.items():
+        cents[name] = cents.get(name, 0) + amount
+
+def _touched(before, after) -> int:
+    diff = diff_transfers(before, after)
+    return len(diff["added"]) + len(diff["removed"]) + len(diff["changed"])
+
+@pytest.mark.parametrize("seed", range(10))
+def test_stable_plans_settle_with_fewer_changes(seed):
+    rng = random.Random(seed)
+    touched = {"stable": 0, "recompute": 0}
+
+    for _ in range(LEDGERS):
+        names = [f"P{index}" for index in range(rng.randint(2, MOST_PEOPLE))]
+        cents: Dict[str, int] = {}
+        for _ in range(WRITES):
+            _apply(cents, _random_expense(rng, names))
+        stable = recomputed = greedy_transfers({name: value for name, value in cents.items() if value})
+
+        for _ in range(WRITES):
+            before = dict(cents)
+            _apply(cents, _random_expense(rng, names))
+            balances = {name: value for name, value in cents.items() if value}
+            moved = {name for name in set(before) | set(cents) if before.get(name, 0) != cents.get(name, 0)}
+            fresh = greedy_transfers(balances)
+            planned, rebuilt = stable_transfers(stable, balances)
+
+            assert {name: value for name, value in plan_nets(planned).items() if value} == balances
+            assert all(amount > 0 and debtor != creditor for debtor, creditor, amount in planned)
+            assert len({(debtor, creditor) for debtor, creditor, _ in planned}) == len(planned)
+            bound = len(fresh) + max(1, len(fresh) * settlement_engine.STABLE_MAX_EXTRA_PERCENT // 100)
+            assert len(planned) <= bound
+
+            if not rebuilt:
+                after = {(debtor, creditor): amount for debtor, creditor, amount in planned}
+                unaffected = [
+                    (debtor, creditor, amount) for debtor, creditor, amount in stable
+                    if debtor not in moved and creditor not in moved
+                ]
+                assert [after.get((debtor, creditor)) for debtor, creditor, _ in unaffected] == [
+                    amount for _, _, amount in unaffected
+                ]
+
+            touched["stable"] += _touched(stable, planned)
+            touched["recompute"] += _touched(recomputed, fresh)
+            stable, recomputed = planned, fresh
+
+    assert touched["stable"] < touched["recompute"], touched
+
+def test_plan_without_a_previous_one_is_built_fresh():
+    cents = {"ann": 500, "bob": -200, "cy": -300}
+    assert stable_transfers(None, cents) == (greedy_transfers(cents), True)
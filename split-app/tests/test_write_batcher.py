@@ -0,0 +1,151 @@
+"""
+Group commit: batches flush when the window runs out or the batch is full,
+every caller gets its own document back, a rejected document fails only
+its own caller, and stored documents are returned even when recording them
+fails.
+"""
+import asyncio
+import gc
+import logging
+
+import pytest
+
+from app.db.repository import get_repository
+from app.models.expense import ExpenseCreate
+from app.services.expense_service import _insert_batch, _prepare_new_expense
+from app.services.write_batcher import WriteBatcher, WriteRejectedError
+
+class FakeStorage:
+    """insert_many that records its batches and rejects documents marked bad"""
+
+    def __init__(self):
+        self.batches = []
+
+    async def insert_many(self, documents):
+        self.batches.append([document["n"] for document in documents])
+        errors = [(position, f"bad {document['n']}") for position, document in enumerate(documents) if document.get("bad")]
+        rejected = {position for position, _ in errors}
+        inserted = [
+            {**document, "_id": f"id-{document['n']}"}
+            for position, document in enumerate(documents) if position not in rejected
+        ]
+        return inserted, errors
+
+def test_flushes_when_the_window_runs_out():
+    async def scenario():
+        storage = FakeStorage()
+        batcher = WriteBatcher(storage.insert_many, window_ms=20, max_size=100)
+        requests = [asyncio.ensure_future(batcher.insert({"n": n})) for n in range(3)]
+        await asyncio.sleep(0.005)
+        # Still inside the window
+        assert storage.batches == []
+
+        results = await asyncio.gather(*requests)
+        assert storage.batches == [[0, 1, 2]]
+        assert [result["_id"] for result in results] == ["id-0", "id-1", "id-2"]
+
+    asyncio.run(scenario())
+
+def test_flushes_when_the_batch_is_full():
+    async def scenario():
+        storage = FakeStorage()
+        batcher = WriteBatcher(storage.insert_many, window_ms=10000, max_size=4)
+        requests = [asyncio.ensure_future(batcher.insert({"n": n})) for n in range(10)]
+        await asyncio.gather(*requests[:8])
+        # Two full batches went without waiting for the window
+        assert storage.batches == [[0, 1, 2, 3], [4, 5, 6, 7]]
+        assert not any(request.done() for request in requests[8:])
+
+        # The rest are written on shutdown
+        await batcher.close()
+        assert storage.batches[-1] == [8, 9]
+        assert [(await request)["_id"] for request in requests] == [f"id-{n}" for n in range(10)]
+
+    asyncio.run(scenario())
+
+def test_rejected_document_fails_only_its_caller():
+    async def scenario():
+        storage = FakeStorage()
+        batcher = WriteBatcher(storage.insert_many, window_ms=5, max_size=16)
+        documents = [{"n": n, "bad": n % 7 == 3} for n in range(40)]
+        results = await asyncio.gather(*[batcher.insert(document) for document in documents], return_exceptions=True)
+
+        assert [len(batch) for batch in storage.batches] == [16, 16, 8]
+        for n, result in enumerate(results):
+            if n % 7 == 3:
+                assert isinstance(result, WriteRejectedError) and str(result) == f"bad {n}"
+            else:
+                assert result["_id"] == f"id-{n}"
+
+    asyncio.run(scenario())
+
+def test_failed_batch_fails_every_caller():
+    async def insert_many(documents):
+        raise ConnectionError("storage went away")
+
+    async def scenario():
+        batcher = WriteBatcher(insert_many, window_ms=5)
+        results = await asyncio.gather(*[batcher.insert({"n": n}) for n in range(3)], return_exceptions=True)
+        assert all(isinstance(result, ConnectionError) for result in results)
+
+    asyncio.run(scenario())
+
+def _expense(n: int) -> dict:
+    return _prepare_new_expense(ExpenseCreate(
+        amount="10", description=f"expense {n}", paid_by="ann", participants=["ann", "bob"]
+    ))
+
+@pytest.mark.parametrize("backend", ("sqlite", "mongo"))
+def test_rejected_row_in_a_stored_batch(backend, open_repository):
+    async def scenario():
+        async with open_repository(backend):
+            batcher = WriteBatcher(get_repository().insert_expenses, window_ms=5, max_size=16)
+            documents = [_expense(n) for n in range(5)]
+            # Duplicate _id: rejected by the unique key
+            documents[1]["_id"] = documents[3]["_id"] = "0123456789abcdef01234567"
+            if backend == "sqlite":
+                # SQLite generates ids; a NULL description breaks a NOT NULL column instead
+                documents[3]["description"] = None
+
+            results = await asyncio.gather(*[batcher.insert(document) for document in documents], return_exceptions=True)
+            assert isinstance(results[3], WriteRejectedError)
+            assert [result["description"] for position, result in enumerate(results) if position != 3] == [
+                "expense 0", "expense 1", "expense 2", "expense 4"
+            ]
+            assert await get_repository().count_expenses() == 4
+
+    asyncio.run(scenario())
+
+def test_failure_of_a_cancelled_caller_is_retrieved():
+    async def insert_many(documents):
+        raise ConnectionError("storage went away")
+
+    async def scenario():
+        reported = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: reported.append(context))
+        batcher = WriteBatcher(insert_many, window_ms=5)
+        request = asyncio.ensure_future(batcher.insert({"n": 0}))
+        await asyncio.sleep(0)
+        request.cancel()
+        await batcher.close()
+        del request
+        gc.collect()
+        return reported
+
+    assert asyncio.run(scenario()) == []
+
+def test_stored_batch_is_returned_when_recording_it_fails(open_repository, monkeypatch, caplog):
+    async def record_changes(changes):
+        raise ConnectionError("ledger went away")
+
+    async def scenario():
+        async with open_repository("memory") as repository:
+            monkeypatch.setattr(repository, "record_changes", record_changes)
+            batcher = WriteBatcher(_insert_batch, window_ms=5)
+            results = await asyncio.gather(*[batcher.insert(_expense(n)) for n in range(3)])
+            assert [result["description"] for result in results] == ["expense 0", "expense 1", "expense 2"]
+            assert await repository.count_expenses() == 3
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(scenario())
+    assert "ledger rebuild" in caplog.text